@@ -0,0 +1,431 @@
+"""Hot/cold split of the appointment history.
+
+Closed, old appointments move with their treatments and bills into an
+attached archive database; ``?history=all`` reads both through views.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from flask import current_app, jsonify, request
+
+from backend import changes, stats
+from backend.db import DB_PATH, connect, get_db, write_transaction
+from backend.normalized import API_COLUMNS, APPOINTMENT_STATUSES, GENERATED_COLUMNS, PAYMENT_STATUSES, day_start
+from backend.pagination import QueryError
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "archive"
+ARCHIVED_TABLES = ("appointments", "treatments", "billing")
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_ARCHIVE_BATCH_SIZE = 500
+DEFAULT_ARCHIVE_PAUSE_SECONDS = 0.1
+DEFAULT_ARCHIVE_INTERVAL_SECONDS = 0  # background archiving off; use the command line
+
+CLOSED_STATUSES = ("completed", "cancelled", "no-show")
+OPEN_PAYMENTS = ("unpaid", "pending")
+
+# The main tables' columns, without foreign keys (the parents stay in main)
+# or AUTOINCREMENT (ids come from main).
+COLUMN_DEFINITIONS = {
+    "appointments": """
+        appointment_id INTEGER PRIMARY KEY,
+        patient_id INTEGER NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        appointment_date TEXT NOT NULL,
+        appointment_time TEXT NOT NULL,
+        reason_for_visit TEXT,
+        status TEXT
+    """,
+    "treatments": """
+        treatment_id INTEGER PRIMARY KEY,
+        appointment_id INTEGER NOT NULL,
+        treatment_type TEXT,
+        description TEXT,
+        cost REAL,
+        treatment_date TEXT
+    """,
+    "billing": """
+        bill_id INTEGER PRIMARY KEY,
+        patient_id INTEGER NOT NULL,
+        treatment_id INTEGER,
+        bill_date TEXT,
+        amount REAL NOT NULL,
+        payment_method TEXT,
+        payment_status TEXT
+    """,
+}
+
+ARCHIVE_INDEXES = (
+    "idx_appointment_doctor_starts ON appointments(doctor_id, starts_at)",
+    "idx_appointment_doctor_patient_starts ON appointments(doctor_id, patient_id, starts_at)",
+    "idx_appointment_patient_starts ON appointments(patient_id, starts_at)",
+    "idx_appointment_starts ON appointments(starts_at)",
+    "idx_appointment_status_starts ON appointments(status_code, starts_at)",
+    "idx_treatment_appointment ON treatments(appointment_id)",
+    "idx_billing_patient_billed ON billing(patient_id, billed_at)",
+    "idx_billing_billed ON billing(billed_at)",
+    "idx_billing_payment_billed ON billing(payment_code, billed_at)",
+    "idx_billing_treatment ON billing(treatment_id)",
+)
+
+
+ARCHIVE_KEYS = {"appointments": "appointment_id", "treatments": "treatment_id", "billing": "bill_id"}
+
+
+def _only_archived(table, where="1"):
+    # A batch interrupted between its two transactions is in both files; main counts it.
+    key = ARCHIVE_KEYS[table]
+    return f"(SELECT * FROM {SCHEMA}.{table} WHERE {where} AND {key} NOT IN (SELECT {key} FROM main.{table}))"
+
+
+def stats_sources(conn):
+    """Archived rows for ``stats.rebuild`` to count with the main tables'."""
+
+    if not is_attached(conn):
+        return {}
+    return {table: _only_archived(table) for table in ARCHIVED_TABLES}
+
+
+def _columns(table):
+    return ", ".join(API_COLUMNS[table])
+
+
+def _create_table_sql(table):
+    generated = ", ".join(
+        f"{name} INTEGER GENERATED ALWAYS AS ({expr}) VIRTUAL" for name, expr in GENERATED_COLUMNS[table]
+    )
+    return f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{table} ({COLUMN_DEFINITIONS[table]}, {generated})"
+
+
+def _view_sql(table):
+    columns = ", ".join((*API_COLUMNS[table], *(name for name, _ in GENERATED_COLUMNS[table])))
+    return (
+        f"CREATE TEMP VIEW IF NOT EXISTS all_{table} AS "
+        f"SELECT {columns} FROM main.{table} UNION ALL SELECT {columns} FROM {_only_archived(table)}"
+    )
+
+
+CREATE_TABLES = (
+    *(_create_table_sql(table) for table in ARCHIVED_TABLES),
+    *(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.{index}" for index in ARCHIVE_INDEXES),
+)
+
+
+def archive_path(db_path):
+    """Default archive file for ``db_path``: ``hospital.db`` -> ``hospital-archive.db``."""
+
+    root, ext = os.path.splitext(db_path)
+    return f"{root}-archive{ext or '.db'}"
+
+
+def attach(conn, path):
+    """Attach the archive (creating it if needed) and the ``all_*`` views."""
+
+    conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+    conn.execute(f"PRAGMA {SCHEMA}.journal_mode = WAL")
+    conn.execute(f"PRAGMA {SCHEMA}.synchronous = NORMAL")
+    # Cold pages get a small cache of their own instead of evicting hot ones.
+    conn.execute(f"PRAGMA {SCHEMA}.cache_size = -4000")
+    for sql in CREATE_TABLES:
+        conn.execute(sql)
+    for table in ARCHIVED_TABLES:
+        conn.execute(_view_sql(table))
+
+
+def is_attached(conn):
+    return any(row[1] == SCHEMA for row in conn.execute("PRAGMA database_list"))
+
+
+def is_archived(conn, table, key):
+    """Whether row ``key`` of ``table`` lives only in the (read-only) archive."""
+
+    if not is_attached(conn):
+        return False
+    column = ARCHIVE_KEYS[table]
+    return conn.execute(f"SELECT 1 FROM {SCHEMA}.{table} WHERE {column} = ?", (key,)).fetchone() is not None
+
+
+def not_updated(table, key, noun):
+    """Error response for an UPDATE of ``table`` that matched no row: 409 if archived, else 404."""
+
+    if is_archived(get_db(), table, key):
+        return jsonify({"error": f"{noun} is archived and read-only"}), 409
+    return jsonify({"error": f"{noun} not found"}), 404
+
+
+def source(table):
+    """What the current request reads ``table`` from: hot rows, or all with ``?history=all``."""
+
+    history = request.args.get("history", "recent")
+    if history not in ("recent", "all"):
+        raise QueryError("history must be recent or all")
+    if history == "all" and current_app.config.get("ARCHIVE_ENABLED", True):
+        return f"all_{table}"
+    return table
+
+
+def _codes(names, codes):
+    return ", ".join(str(codes[name]) for name in names)
+
+
+CLOSED_SQL = f"""
+    +a.status_code IN ({_codes(CLOSED_STATUSES, APPOINTMENT_STATUSES)})
+    AND NOT EXISTS (
+        SELECT 1 FROM main.treatments t CROSS JOIN main.billing b ON b.treatment_id = t.treatment_id
+        WHERE t.appointment_id = a.appointment_id
+          AND b.payment_code IN ({_codes(OPEN_PAYMENTS, PAYMENT_STATUSES)})
+    )
+"""
+
+# Keyset over (starts_at, appointment_id), so each run reads every old row once
+# even when many of them have to stay behind. The unary + keeps the planner on
+# the starts_at index (no sort per batch) and CROSS JOIN makes it look up the
+# appointment's few bills rather than scan every unpaid one.
+CANDIDATES_SQL = f"""
+    SELECT a.appointment_id, a.starts_at FROM main.appointments a
+    WHERE a.starts_at < ? AND (a.starts_at, a.appointment_id) > (?, ?) AND {CLOSED_SQL}
+    ORDER BY a.starts_at, a.appointment_id
+    LIMIT ?
+"""
+
+BATCH_IDS = "SELECT appointment_id FROM temp.archive_batch"
+BATCH_TREATMENT_IDS = f"SELECT treatment_id FROM main.treatments WHERE appointment_id IN ({BATCH_IDS})"
+BATCH_ROWS = {
+    "appointments": f"appointment_id IN ({BATCH_IDS})",
+    "treatments": f"appointment_id IN ({BATCH_IDS})",
+    "billing": f"treatment_id IN ({BATCH_TREATMENT_IDS})",
+}
+# Batch members that stopped qualifying (edited, billed or deleted) since the copy.
+STALE_SQL = f"""
+    SELECT appointment_id FROM temp.archive_batch
+    WHERE appointment_id NOT IN (
+        SELECT a.appointment_id FROM main.appointments a
+        WHERE a.appointment_id IN ({BATCH_IDS}) AND a.starts_at < ? AND {CLOSED_SQL}
+    )
+"""
+
+
+def _start_batch(conn):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (appointment_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.archive_batch")
+
+
+def _copy_batch(conn):
+    for table, where in BATCH_ROWS.items():
+        conn.execute(
+            f"INSERT OR REPLACE INTO {SCHEMA}.{table} ({_columns(table)}) "
+            f"SELECT {_columns(table)} FROM main.{table} WHERE {where}"
+        )
+
+
+def _drop_stale_copies(conn, cutoff):
+    conn.execute(
+        f"DELETE FROM {SCHEMA}.billing WHERE treatment_id IN "
+        f"(SELECT treatment_id FROM {SCHEMA}.treatments WHERE appointment_id IN ({STALE_SQL}))",
+        (cutoff,),
+    )
+    for table in (f"{SCHEMA}.treatments", f"{SCHEMA}.appointments", "temp.archive_batch"):
+        conn.execute(f"DELETE FROM {table} WHERE appointment_id IN ({STALE_SQL})", (cutoff,))
+
+
+def _drop_leftover_copies(conn, cutoff):
+    """Drop the copies of an interrupted batch whose rows stopped qualifying since.
+
+    The rows themselves are still in main; the copies would otherwise stay in
+    the archive for good. Copies that still qualify are moved by the next batch.
+    """
+
+    with write_transaction(conn):
+        _start_batch(conn)
+        conn.execute(
+            f"INSERT INTO temp.archive_batch SELECT appointment_id FROM {SCHEMA}.appointments "
+            f"WHERE appointment_id IN (SELECT appointment_id FROM main.appointments)"
+        )
+        _drop_stale_copies(conn, cutoff)
+
+
+def move_batch(conn, cutoff, after=(-1, -1), batch_size=DEFAULT_ARCHIVE_BATCH_SIZE):
+    """Move up to ``batch_size`` closed appointments starting before ``cutoff``.
+
+    ``after`` is the ``(starts_at, appointment_id)`` the previous batch ended
+    at. Returns ``(counts, after)``; ``counts`` is ``None`` when nothing is left.
+    """
+
+    # A transaction writing both files makes main's deletes visible before the
+    # archive's inserts, so a reader in between (history=all, a backup) would
+    # miss the batch. The copy is committed first instead; the second
+    # transaction drops copies that stopped qualifying meanwhile, refreshes the
+    # rest and only then deletes from main.
+    with write_transaction(conn):
+        rows = conn.execute(CANDIDATES_SQL, (cutoff, *after, batch_size)).fetchall()
+        if not rows:
+            return None, after
+        _start_batch(conn)
+        conn.executemany("INSERT INTO temp.archive_batch VALUES (?)", [(row[0],) for row in rows])
+        _copy_batch(conn)
+
+    with write_transaction(conn):
+        _drop_stale_copies(conn, cutoff)
+        _copy_batch(conn)
+        counts = {}
+        # Children first; these are moves, not deletes, for the change feed.
+        with changes.paused(conn, "archive"):
+            for table in ("billing", "treatments", "appointments"):
+                counts[table] = conn.execute(f"DELETE FROM main.{table} WHERE {BATCH_ROWS[table]}").rowcount
+    return counts, (rows[-1]["starts_at"], rows[-1]["appointment_id"])
+
+
+def run(conn, after_days=DEFAULT_ARCHIVE_AFTER_DAYS, batch_size=DEFAULT_ARCHIVE_BATCH_SIZE,
+        pause_seconds=DEFAULT_ARCHIVE_PAUSE_SECONDS, today=None):
+    """Archive everything due, batch by batch; returns the rows moved per table."""
+
+    cutoff = day_start((today or date.today()) - timedelta(days=after_days))
+    totals = dict.fromkeys(ARCHIVED_TABLES, 0)
+    totals["batches"] = 0
+    _drop_leftover_copies(conn, cutoff)
+    after = (-1, -1)
+    while True:
+        counts, after = move_batch(conn, cutoff, after, batch_size)
+        if counts is None:
+            return totals
+        for table, count in counts.items():
+            totals[table] += count
+        totals["batches"] += 1
+        time.sleep(pause_seconds)
+
+
+def purge(conn, column, value):
+    """Delete the archived history of a deleted patient or doctor.
+
+    ``column`` is ``patient_id`` or ``doctor_id``; mirrors the main tables'
+    ``ON DELETE`` actions. Call inside the transaction deleting the parent.
+    """
+
+    if not is_attached(conn):
+        return
+    appointments = f"SELECT appointment_id FROM {SCHEMA}.appointments WHERE {column} = ?"
+    treatments = f"SELECT treatment_id FROM {SCHEMA}.treatments WHERE appointment_id IN ({appointments})"
+    # No trigger sees these deletes; the dashboard counts archived rows too.
+    if column == "patient_id":
+        stats.subtract(conn, "billing", _only_archived("billing", "patient_id = ?"), (value,))
+        conn.execute(f"DELETE FROM {SCHEMA}.billing WHERE patient_id = ?", (value,))
+    else:
+        conn.execute(f"UPDATE {SCHEMA}.billing SET treatment_id = NULL WHERE treatment_id IN ({treatments})", (value,))
+    stats.subtract(conn, "treatments", _only_archived("treatments", f"appointment_id IN ({appointments})"), (value,))
+    conn.execute(f"DELETE FROM {SCHEMA}.treatments WHERE appointment_id IN ({appointments})", (value,))
+    stats.subtract(conn, "appointments", _only_archived("appointments", f"{column} = ?"), (value,))
+    conn.execute(f"DELETE FROM {SCHEMA}.appointments WHERE {column} = ?", (value,))
+
+
+def status(conn):
+    """Row counts per table, hot and archived."""
+
+    return {
+        table: {
+            "hot": conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0],
+            "archived": conn.execute(f"SELECT COUNT(*) FROM {SCHEMA}.{table}").fetchone()[0],
+        }
+        for table in ARCHIVED_TABLES
+    }
+
+
+class ArchiveWorker:
+    """Runs ``run`` every ``interval`` seconds in a daemon thread of this process."""
+
+    def __init__(self, db_path, path, interval, **options):
+        self.db_path = db_path
+        self.path = path
+        self.interval = float(interval)
+        self.options = options
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_running(self):
+        # Threads do not survive a fork; each worker process starts its own.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="archive", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                conn = connect(self.db_path)
+                try:
+                    attach(conn, self.path)
+                    moved = run(conn, **self.options)
+                finally:
+                    conn.close()
+                if moved["batches"]:
+                    logger.info("archived %s", moved)
+            except Exception:
+                logger.exception("archiving failed")
+            time.sleep(self.interval)
+
+
+def init_app(app):
+    """Attach the archive to pooled connections; call before ``db.init_app``."""
+
+    app.config.setdefault("ARCHIVE_ENABLED", True)
+    app.config.setdefault("ARCHIVE_PATH", archive_path(app.config.get("DB_PATH", DB_PATH)))
+    app.config.setdefault("ARCHIVE_AFTER_DAYS", DEFAULT_ARCHIVE_AFTER_DAYS)
+    app.config.setdefault("ARCHIVE_BATCH_SIZE", DEFAULT_ARCHIVE_BATCH_SIZE)
+    app.config.setdefault("ARCHIVE_PAUSE_SECONDS", DEFAULT_ARCHIVE_PAUSE_SECONDS)
+    app.config.setdefault("ARCHIVE_INTERVAL_SECONDS", DEFAULT_ARCHIVE_INTERVAL_SECONDS)
+    if not app.config["ARCHIVE_ENABLED"]:
+        return
+
+    path = app.config["ARCHIVE_PATH"]
+    app.config.setdefault("DB_CONNECTION_SETUP", lambda conn: attach(conn, path))
+    if float(app.config["ARCHIVE_INTERVAL_SECONDS"]) > 0:
+        worker = ArchiveWorker(
+            app.config.get("DB_PATH", DB_PATH),
+            path,
+            app.config["ARCHIVE_INTERVAL_SECONDS"],
+            after_days=int(app.config["ARCHIVE_AFTER_DAYS"]),
+            batch_size=int(app.config["ARCHIVE_BATCH_SIZE"]),
+            pause_seconds=float(app.config["ARCHIVE_PAUSE_SECONDS"]),
+        )
+        app.extensions["archive_worker"] = worker
+        app.before_request(worker.ensure_running)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move closed appointment history to the archive database.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--archive", help="archive database file (default: <db>-archive.db)")
+    parser.add_argument("--older-than", type=int, default=DEFAULT_ARCHIVE_AFTER_DAYS,
+                        help="archive closed appointments more than this many days old")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_ARCHIVE_BATCH_SIZE,
+                        help="appointments moved per transaction")
+    parser.add_argument("--pause", type=float, default=DEFAULT_ARCHIVE_PAUSE_SECONDS,
+                        help="seconds to sleep between batches")
+    parser.add_argument("--status", action="store_true", help="only print hot and archived row counts")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        attach(conn, args.archive or archive_path(args.db))
+        if not args.status:
+            started = time.perf_counter()
+            moved = run(conn, args.older_than, args.batch_size, args.pause)
+            print(f"moved {moved} in {time.perf_counter() - started:.1f}s")
+        for table, counts in status(conn).items():
+            print(f"{table}: {counts['hot']} hot, {counts['archived']} archived")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
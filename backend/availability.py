@@ -0,0 +1,193 @@
+"""Appointment slots: free-slot search and double-booking checks.
+
+Every appointment blocks its doctor for ``APPOINTMENT_MINUTES`` (app config,
+default 30) from its start time; cancelled appointments block nothing.
+"""
+
+from datetime import date, timedelta
+
+from flask import current_app
+
+from backend.normalized import APPOINTMENT_STATUSES, day_start
+from backend.pagination import QueryError
+
+DEFAULT_APPOINTMENT_MINUTES = 30
+DEFAULT_DAY_START = "09:00"
+DEFAULT_DAY_END = "17:00"
+MAX_RANGE_DAYS = 31
+
+# Appointments in these states no longer occupy their slot.
+FREE_STATUSES = ("cancelled",)
+FREE_STATUS_CODES = tuple(APPOINTMENT_STATUSES[status] for status in FREE_STATUSES)
+BUSY_SQL = f"status_code NOT IN ({', '.join(map(str, FREE_STATUS_CODES))})"
+
+
+class SlotConflict(Exception):
+    """The requested time overlaps another appointment of the same doctor."""
+
+    def __init__(self, appointment_id):
+        super().__init__(f"doctor is already booked by appointment {appointment_id}")
+        self.appointment_id = appointment_id
+
+
+def appointment_minutes() -> int:
+    return int(current_app.config.get("APPOINTMENT_MINUTES", DEFAULT_APPOINTMENT_MINUTES))
+
+
+def to_minutes(value) -> int:
+    """Minutes after midnight for ``HH:MM`` or ``HH:MM:SS``."""
+
+    hours, minutes = str(value).split(":")[:2]
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError(f"invalid time {value!r}")
+    return hours * 60 + minutes
+
+
+def format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _time_arg(name, value):
+    try:
+        return to_minutes(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"{name} must be an HH:MM time")
+
+
+def _date_arg(name, value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"{name} must be a YYYY-MM-DD date")
+
+
+def find_conflict(conn, doctor_id, appointment_date, appointment_time, exclude_id=None):
+    """Id of an active appointment overlapping the given start time, or None.
+
+    Call inside ``write_transaction`` so the answer still holds at insert time.
+    """
+
+    start = day_start(_date_arg("appointment_date", appointment_date))
+    start += 60 * _time_arg("appointment_time", appointment_time)
+    length = 60 * appointment_minutes()
+    row = conn.execute(
+        f"""
+        SELECT appointment_id FROM appointments
+        WHERE doctor_id = ? AND starts_at > ? AND starts_at < ? AND appointment_id IS NOT ? AND {BUSY_SQL}
+        LIMIT 1
+        """,
+        (doctor_id, start - length, start + length, exclude_id),
+    ).fetchone()
+    return row["appointment_id"] if row else None
+
+
+def check_slot(conn, doctor_id, appointment_date, appointment_time, status=None, exclude_id=None):
+    """Raise ``SlotConflict`` if booking this time would double-book the doctor."""
+
+    if status and str(status).lower() in FREE_STATUSES:
+        return
+    conflict = find_conflict(conn, doctor_id, appointment_date, appointment_time, exclude_id)
+    if conflict is not None:
+        raise SlotConflict(conflict)
+
+
+SLOT_FIELDS = ("doctor_id", "appointment_date", "appointment_time", "status")
+
+
+def recheck_slot(conn, appointment_id, updates):
+    """Conflict-check an existing appointment as it will look after ``updates``."""
+
+    if not any(field in updates for field in SLOT_FIELDS):
+        return
+    row = conn.execute(
+        f"SELECT {', '.join(SLOT_FIELDS)} FROM appointments WHERE appointment_id = ?",
+        (appointment_id,),
+    ).fetchone()
+    if not row:
+        return
+    merged = {field: updates.get(field, row[field]) for field in SLOT_FIELDS}
+    check_slot(conn, exclude_id=appointment_id, **merged)
+
+
+def free_slots(booked, day_start, day_end, slot, length):
+    """Start times (minutes) of the ``slot``-long windows clear of ``booked``.
+
+    ``booked`` holds sorted start minutes of appointments lasting ``length``;
+    since their ends are sorted too, one forward sweep checks every window.
+    """
+
+    slots = []
+    i = 0
+    start = day_start
+    while start + slot <= day_end:
+        while i < len(booked) and booked[i] + length <= start:
+            i += 1
+        if i == len(booked) or booked[i] >= start + slot:
+            slots.append(start)
+        start += slot
+    return slots
+
+
+def parse_window(args):
+    """Read ``from``/``to``/``slot``/``start``/``end`` from the query string."""
+
+    first = _date_arg("from", args["from"]) if args.get("from") else date.today()
+    last = _date_arg("to", args["to"]) if args.get("to") else first + timedelta(days=6)
+    if last < first:
+        raise QueryError("to must not be before from")
+    if (last - first).days >= MAX_RANGE_DAYS:
+        raise QueryError(f"date range is limited to {MAX_RANGE_DAYS} days")
+
+    slot = args.get("slot", appointment_minutes())
+    try:
+        slot = int(slot)
+    except (TypeError, ValueError):
+        raise QueryError("slot must be a number of minutes")
+    if not 5 <= slot <= 24 * 60:
+        raise QueryError("slot must be between 5 and 1440 minutes")
+
+    day_start = _time_arg("start", args.get("start", DEFAULT_DAY_START))
+    day_end = _time_arg("end", args.get("end", DEFAULT_DAY_END))
+    if day_end <= day_start:
+        raise QueryError("end must be after start")
+
+    days = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+    return {"days": days, "slot": slot, "day_start": day_start, "day_end": day_end}
+
+
+def availability(conn, doctor_ids, window):
+    """Free slots per doctor and day, from one scan of the booked appointments.
+
+    Returns ``{doctor_id: [{"date", "slots"}, ...]}`` for every id given.
+    """
+
+    days = window["days"]
+    booked = {}
+    if doctor_ids:
+        # Chunk the id list to stay under SQLite's bound-parameter limit.
+        ids = list(doctor_ids)
+        for offset in range(0, len(ids), 500):
+            chunk = ids[offset:offset + 500]
+            rows = conn.execute(
+                f"""
+                SELECT doctor_id, starts_at FROM appointments
+                WHERE doctor_id IN ({', '.join('?' * len(chunk))})
+                  AND starts_at >= ? AND starts_at < ? AND {BUSY_SQL}
+                """,
+                (*chunk, day_start(days[0]), day_start(days[-1] + timedelta(days=1))),
+            )
+            for doctor_id, starts_at in rows:
+                day, seconds = divmod(starts_at, 86400)
+                booked.setdefault((doctor_id, day), []).append(seconds // 60)
+
+    length = appointment_minutes()
+    result = {}
+    for doctor_id in doctor_ids:
+        schedule = []
+        for day in days:
+            taken = sorted(booked.get((doctor_id, day_start(day) // 86400), ()))
+            slots = free_slots(taken, window["day_start"], window["day_end"], window["slot"], length)
+            schedule.append({"date": day.isoformat(), "slots": [format_minutes(m) for m in slots]})
+        result[doctor_id] = schedule
+    return result
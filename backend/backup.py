@@ -0,0 +1,412 @@
+"""Online snapshots of ``hospital.db`` and its archive with SQLite's backup API.
+
+``python -m backend.backup snapshot|list|verify|restore``; see the README.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from backend import archive, changes, etag
+from backend.db import DB_PATH, PROJECT_ROOT, connect
+from backend.schema import current_version, migrate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKUP_DIR = os.path.join(PROJECT_ROOT, "backups")
+DEFAULT_BACKUP_PAGES = 1024  # 4 MB per step with the default page size
+DEFAULT_BACKUP_SLEEP_SECONDS = 0.02
+DEFAULT_BACKUP_KEEP = 7
+DEFAULT_BACKUP_INTERVAL_SECONDS = 0  # scheduled snapshots off; use the command line
+
+PREFIX = "hospital-"
+PARTIAL = ".partial"
+MANIFEST = "manifest.json"
+# A ``.partial`` directory this old belongs to a snapshot that died.
+STALE_PARTIAL_SECONDS = 24 * 3600
+
+
+class BackupError(RuntimeError):
+    """Raised when a snapshot fails verification or cannot be taken."""
+
+
+def snapshot_name(moment=None) -> str:
+    """Directory name of a snapshot taken at ``moment`` (epoch seconds, default now)."""
+
+    moment = datetime.fromtimestamp(time.time() if moment is None else moment, timezone.utc)
+    return PREFIX + moment.strftime("%Y%m%dT%H%M%SZ")
+
+
+def sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy(source, target_path, name, pages, sleep_seconds, stats):
+    def pause(status, remaining, total):
+        stats["steps"] += 1
+        stats["pages"] = total
+        if remaining and sleep_seconds > 0:
+            time.sleep(sleep_seconds)
+
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=pause, name=name)
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+
+
+def snapshot(db_path=DB_PATH, directory=DEFAULT_BACKUP_DIR, archive_path=None, pages=DEFAULT_BACKUP_PAGES,
+             sleep_seconds=DEFAULT_BACKUP_SLEEP_SECONDS, keep=DEFAULT_BACKUP_KEEP, name=None, traffic=None,
+             since=None):
+    """Copy ``db_path`` (and its archive, if there is one) into a new snapshot.
+
+    ``name`` defaults to the current time; a snapshot of that name already
+    taken or in progress raises ``FileExistsError``. ``traffic`` is an
+    optional callable returning ``(requests, seconds)`` served so far; the
+    manifest gets the traffic during the copy and, given ``since`` (an
+    earlier ``(requests, seconds, time.monotonic())``), before it. Returns
+    the manifest, with the snapshot's ``path`` added.
+    """
+
+    archive_path = archive_path or archive.archive_path(db_path)
+    name = name or snapshot_name()
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    os.makedirs(directory, exist_ok=True)
+    partial = path + PARTIAL
+    # Also the claim on the name when several processes snapshot on the same schedule.
+    os.mkdir(partial)
+    try:
+        files = {"main": db_path}
+        source = connect(db_path)
+        try:
+            if os.path.exists(archive_path):
+                source.execute(f"ATTACH DATABASE ? AS {archive.SCHEMA}", (archive_path,))
+                files[archive.SCHEMA] = archive_path
+            before = traffic() if traffic else None
+            started = time.monotonic()
+            source.execute("BEGIN")
+            manifest = {"name": name, "schema_version": current_version(source), "files": {}}
+            for schema in files:
+                # Starts the read transaction on this file too.
+                source.execute(f"SELECT COUNT(*) FROM {schema}.sqlite_master").fetchone()
+            stats = {}
+            for schema, live_path in files.items():
+                file_name = os.path.basename(live_path)
+                stats[schema] = {"steps": 0, "pages": 0}
+                _copy(source, os.path.join(partial, file_name), schema, pages, sleep_seconds, stats[schema])
+            page_size = source.execute("PRAGMA page_size").fetchone()[0]
+            source.commit()
+            seconds = time.monotonic() - started
+            after = traffic() if traffic else None
+        finally:
+            source.close()
+
+        copied = 0
+        for schema, live_path in files.items():
+            file_name = os.path.basename(live_path)
+            copy_path = os.path.join(partial, file_name)
+            size = os.path.getsize(copy_path)
+            copied += size
+            manifest["files"][schema] = {
+                "file": file_name,
+                "bytes": size,
+                "pages": stats[schema]["pages"],
+                "sha256": sha256(copy_path),
+            }
+        manifest.update(
+            {
+                "taken_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "source": {"db": os.path.abspath(db_path), "archive": os.path.abspath(archive_path)},
+                "seconds": round(seconds, 3),
+                "mb_per_second": round(copied / 2**20 / max(seconds, 1e-9), 1),
+                "steps": sum(item["steps"] for item in stats.values()),
+                "step_pages": pages,
+                "step_sleep_seconds": sleep_seconds,
+                "page_size": page_size,
+            }
+        )
+        if before is not None:
+            manifest["traffic"] = {"during": _traffic(before, after, seconds)}
+            if since is not None:
+                manifest["traffic"]["before"] = _traffic(since[:2], before, started - since[2])
+        with open(os.path.join(partial, MANIFEST), "w") as handle:
+            json.dump(manifest, handle, indent=2, sort_keys=True)
+        verify(partial, quick=True)
+        os.rename(partial, path)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+
+    prune(directory, keep)
+    manifest["path"] = path
+    return manifest
+
+
+def _traffic(before, after, seconds):
+    requests, latency = after[0] - before[0], after[1] - before[1]
+    return {
+        "requests": requests,
+        "requests_per_second": round(requests / max(seconds, 1e-9), 1),
+        "mean_ms": round(latency / requests * 1000, 3) if requests else None,
+    }
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError) as error:
+        raise BackupError(f"{path}: no readable {MANIFEST} ({error})")
+
+
+def verify(path, quick=False):
+    """Check a snapshot's checksums and integrity; returns its manifest.
+
+    ``quick`` runs ``quick_check``, which skips the index contents and takes
+    a fraction of the time.
+    """
+
+    manifest = read_manifest(path)
+    for schema, entry in manifest["files"].items():
+        file_path = os.path.join(path, entry["file"])
+        if not os.path.exists(file_path):
+            raise BackupError(f"{file_path}: missing")
+        if os.path.getsize(file_path) != entry["bytes"] or sha256(file_path) != entry["sha256"]:
+            raise BackupError(f"{file_path}: checksum mismatch")
+        conn = sqlite3.connect(f"file:{file_path}?mode=ro&immutable=1", uri=True)
+        try:
+            result = [row[0] for row in conn.execute("PRAGMA quick_check" if quick else "PRAGMA integrity_check")]
+        finally:
+            conn.close()
+        if result != ["ok"]:
+            raise BackupError(f"{file_path}: integrity check failed: {'; '.join(result[:5])}")
+    return manifest
+
+
+def snapshots(directory=DEFAULT_BACKUP_DIR):
+    """Paths of the completed snapshots in ``directory``, oldest first."""
+
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, entry)
+        for entry in sorted(os.listdir(directory))
+        if entry.startswith(PREFIX) and not entry.endswith(PARTIAL)
+        and os.path.exists(os.path.join(directory, entry, MANIFEST))
+    ]
+
+
+def prune(directory=DEFAULT_BACKUP_DIR, keep=DEFAULT_BACKUP_KEEP):
+    """Remove all but the newest ``keep`` snapshots, and abandoned partial ones."""
+
+    removed = []
+    for path in snapshots(directory)[:-keep] if keep > 0 else []:
+        shutil.rmtree(path)
+        removed.append(path)
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry.startswith(PREFIX) and entry.endswith(PARTIAL) \
+                and time.time() - os.path.getmtime(path) > STALE_PARTIAL_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    return removed
+
+
+def _last_change_id(db_path):
+    if not os.path.exists(db_path):
+        return 0
+    conn = connect(db_path)
+    try:
+        return changes.last_change_id(conn)
+    except sqlite3.OperationalError:  # from before the change log
+        return 0
+    finally:
+        conn.close()
+
+
+def restore(path, db_path=DB_PATH, archive_path=None):
+    """Copy a verified snapshot back over ``db_path`` and its archive.
+
+    Goes through the backup API, so connections still open see an ordinary
+    (large) write. A snapshot from an older schema is migrated. Without an
+    archive in the snapshot, the live archive is emptied: its rows would
+    duplicate ones the restored main file holds. The change log restarts
+    past the live one's last id, so change feeds reset instead of missing
+    events.
+    """
+
+    manifest = verify(path)
+    archive_path = archive_path or archive.archive_path(db_path)
+    last_change_id = _last_change_id(db_path)
+    targets = {"main": db_path, archive.SCHEMA: archive_path}
+    for schema, entry in manifest["files"].items():
+        source = sqlite3.connect(f"file:{os.path.join(path, entry['file'])}?mode=ro&immutable=1", uri=True)
+        target = connect(targets[schema])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    conn = connect(db_path)
+    try:
+        migrate(conn)
+        with conn:
+            if archive.SCHEMA not in manifest["files"] and os.path.exists(archive_path):
+                archive.attach(conn, archive_path)
+                for table in reversed(archive.ARCHIVED_TABLES):
+                    conn.execute(f"DELETE FROM {archive.SCHEMA}.{table}")
+            changes.restart_log(conn, last_change_id)
+            etag.new_epoch(conn)
+    finally:
+        conn.close()
+    return manifest
+
+
+class BackupWorker:
+    """Takes a snapshot every ``interval`` seconds in a daemon thread of this process.
+
+    Snapshots are named after the start of their interval, so when every
+    worker process runs one of these only the first to claim the name copies.
+    """
+
+    def __init__(self, db_path, interval, traffic=None, **options):
+        self.db_path = db_path
+        self.interval = float(interval)
+        self.traffic = traffic
+        self.options = options
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_running(self):
+        # Threads do not survive a fork; each worker process starts its own.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="backup", daemon=True)
+                self._thread.start()
+
+    def _mark(self):
+        return (*self.traffic(), time.monotonic()) if self.traffic else None
+
+    def _loop(self):
+        since = self._mark()
+        while True:
+            slot = (time.time() // self.interval + 1) * self.interval
+            time.sleep(max(0.0, slot - time.time()))
+            try:
+                manifest = snapshot(self.db_path, name=snapshot_name(slot), traffic=self.traffic, since=since,
+                                    **self.options)
+            except FileExistsError:
+                continue  # another process took this one
+            except Exception:
+                logger.exception("backup failed")
+                continue
+            finally:
+                since = self._mark()
+            logger.info(
+                "backup %s: %.1fs, %s MB/s, traffic %s",
+                manifest["path"], manifest["seconds"], manifest["mb_per_second"], manifest.get("traffic"),
+            )
+
+
+def init_app(app):
+    app.config.setdefault("BACKUP_DIR", DEFAULT_BACKUP_DIR)
+    app.config.setdefault("BACKUP_INTERVAL_SECONDS", DEFAULT_BACKUP_INTERVAL_SECONDS)
+    app.config.setdefault("BACKUP_KEEP", DEFAULT_BACKUP_KEEP)
+    app.config.setdefault("BACKUP_PAGES", DEFAULT_BACKUP_PAGES)
+    app.config.setdefault("BACKUP_SLEEP_SECONDS", DEFAULT_BACKUP_SLEEP_SECONDS)
+    if float(app.config["BACKUP_INTERVAL_SECONDS"]) <= 0:
+        return
+
+    registry = app.extensions.get("metrics")
+    worker = BackupWorker(
+        app.config.get("DB_PATH", DB_PATH),
+        app.config["BACKUP_INTERVAL_SECONDS"],
+        traffic=registry.totals if registry else None,
+        directory=app.config["BACKUP_DIR"],
+        archive_path=app.config.get("ARCHIVE_PATH"),
+        pages=int(app.config["BACKUP_PAGES"]),
+        sleep_seconds=float(app.config["BACKUP_SLEEP_SECONDS"]),
+        keep=int(app.config["BACKUP_KEEP"]),
+    )
+    app.extensions["backup_worker"] = worker
+    app.before_request(worker.ensure_running)
+
+
+def _describe(manifest):
+    sizes = ", ".join(f"{entry['file']} {entry['bytes'] / 2**20:.1f} MB" for entry in manifest["files"].values())
+    return (f"{manifest['name']}: schema {manifest['schema_version']}, {sizes}, "
+            f"{manifest['seconds']}s at {manifest['mb_per_second']} MB/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot, verify and restore the hospital database.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--archive", help="archive database file (default: <db>-archive.db)")
+    parser.add_argument("--dir", default=DEFAULT_BACKUP_DIR, help="directory holding the snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    take = commands.add_parser("snapshot", help="take a snapshot now")
+    take.add_argument("--pages", type=int, default=DEFAULT_BACKUP_PAGES, help="pages copied per step")
+    take.add_argument("--sleep", type=float, default=DEFAULT_BACKUP_SLEEP_SECONDS,
+                      help="seconds to sleep between steps")
+    take.add_argument("--keep", type=int, default=DEFAULT_BACKUP_KEEP, help="snapshots to keep (0 = all)")
+    commands.add_parser("list", help="list the snapshots")
+    check = commands.add_parser("verify", help="check snapshots' checksums and integrity")
+    check.add_argument("names", nargs="*", help="snapshots to check (default: all)")
+    back = commands.add_parser("restore", help="replace the live database with a snapshot")
+    back.add_argument("name", help="snapshot to restore (name or path)")
+    back.add_argument("--no-snapshot", action="store_true", help="do not snapshot the live database first")
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        manifest = snapshot(args.db, args.dir, args.archive, args.pages, args.sleep, args.keep)
+        print(f"{_describe(manifest)} -> {manifest['path']}")
+    elif args.command == "list":
+        for path in snapshots(args.dir):
+            print(_describe(read_manifest(path)))
+    elif args.command == "verify":
+        paths = [os.path.join(args.dir, name) for name in args.names] or snapshots(args.dir)
+        failed = 0
+        for path in paths:
+            try:
+                verify(path)
+                print(f"{os.path.basename(path)}: ok")
+            except BackupError as error:
+                failed += 1
+                print(f"{os.path.basename(path)}: FAILED {error}")
+        return 1 if failed else 0
+    else:
+        path = args.name if os.path.isdir(args.name) else os.path.join(args.dir, args.name)
+        try:
+            verify(path)
+        except BackupError as error:
+            print(f"not restoring: {error}")
+            return 1
+        if not args.no_snapshot:
+            manifest = snapshot(args.db, args.dir, args.archive, keep=0)
+            print(f"live database saved as {manifest['name']}")
+        restore(path, args.db, args.archive)
+        print(f"restored {os.path.basename(path)} into {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,15 @@
 from backend.blueprints.admin import admin_bp
 from backend.blueprints.appointments import appointments_bp
+from backend.blueprints.batch import batch_bp
 from backend.blueprints.doctors import doctors_bp
 from backend.blueprints.patients import patients_bp
+from backend.blueprints.search import search_bp
 
 __all__ = [
     "admin_bp",
     "appointments_bp",
+    "batch_bp",
     "doctors_bp",
     "patients_bp",
+    "search_bp",
 ]
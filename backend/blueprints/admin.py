@@ -1,50 +1,96 @@
+from datetime import date, timedelta
+
 from flask import Blueprint, jsonify, request
 
-from backend.db import get_db_connection
+from backend import archive, cache, slowlog, stats, writes
+from backend.availability import recheck_slot
+from backend.db import get_db, get_pool
+from backend.etag import VERSIONED_TABLES, conditional
+from backend.normalized import APPOINTMENT_STATUSES, PAYMENT_STATUSES, api_columns, day_start
+from backend.pagination import list_rows
 from backend.utils import row_to_dict
 
 admin_bp = Blueprint("admin", __name__)
 
 
 @admin_bp.route("/admin/dashboard", methods=["GET"])
+@conditional(*VERSIONED_TABLES)
 def admin_dashboard():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    totals = {}
-    for table in ["patients", "doctors", "appointments", "treatments", "billing"]:
-        count = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
-        totals[table] = count
-    conn.close()
-    return jsonify(totals)
+    conn = get_db()
+    return jsonify(stats.dashboard(conn))
+
+
+@admin_bp.route("/admin/db/pool", methods=["GET"])
+def admin_pool_stats():
+    return jsonify(get_pool().stats())
+
+
+@admin_bp.route("/admin/db/cache", methods=["GET"])
+def admin_cache_stats():
+    read_cache = cache.get_cache()
+    if read_cache is None:
+        return jsonify({"error": "Cache is disabled"}), 404
+    return jsonify(read_cache.stats())
+
+
+@admin_bp.route("/admin/db/slow-queries", methods=["GET"])
+def admin_slow_queries():
+    log = slowlog.get_log()
+    if log is None:
+        return jsonify({"error": "Slow-query log is disabled"}), 404
+    return jsonify(slowlog.search(log, request.args))
 
 
 # Patient management
+PATIENT_FILTERS = {
+    "patient_id": ("int", "patient_id"),
+    "name": ("name", ("first_name", "last_name")),
+    "gender": ("eq", "gender"),
+    "phone": ("contains", "contact_number"),
+    "age_min": ("age_gte", "date_of_birth"),
+    "age_max": ("age_lte", "date_of_birth"),
+    "insurance": ("contains", "insurance_provider"),
+    "registration_date": ("day", "registration_date"),
+    "email": ("contains", "email"),
+    "address": ("contains", "address"),
+    "date_of_birth": ("eq", "date_of_birth"),
+}
+PATIENT_SORTS = {
+    "id": ("patient_id",),
+    "name": ("last_name", "first_name", "patient_id"),
+    "registration_date": ("IFNULL(registration_date, '')", "patient_id"),
+    "date_of_birth": ("IFNULL(date_of_birth, '')", "patient_id"),
+}
+
+
 @admin_bp.route("/admin/patients", methods=["GET"])
+@conditional("patients")
 def admin_list_patients():
-    conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM patients").fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    conn = get_db()
+    return list_rows(
+        conn,
+        request.args,
+        columns="*",
+        from_clause="patients",
+        filters=PATIENT_FILTERS,
+        sort_keys=PATIENT_SORTS,
+        default_sort=("id", "asc"),
+    )
 
 
 @admin_bp.route("/admin/patients/<int:patient_id>", methods=["GET"])
+@conditional("patient:{patient_id}")
 def admin_get_patient(patient_id: int):
-    conn = get_db_connection()
-    row = conn.execute(
-        "SELECT * FROM patients WHERE patient_id = ?", (patient_id,)
-    ).fetchone()
-    conn.close()
-    if not row:
+    patient = cache.patient(patient_id)
+    if not patient:
         return jsonify({"error": "Patient not found"}), 404
-    return jsonify(row_to_dict(row))
+    return jsonify(patient)
 
 
 @admin_bp.route("/admin/patients", methods=["POST"])
 def admin_create_patient():
     data = request.get_json() or {}
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = writes.execute(
         """
         INSERT INTO patients (first_name, last_name, gender, date_of_birth, contact_number, address, insurance_provider, insurance_number, email)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -61,9 +107,7 @@ def admin_create_patient():
             data.get("email"),
         ),
     )
-    conn.commit()
     patient_id = cursor.lastrowid
-    conn.close()
     return jsonify({"patient_id": patient_id}), 201
 
 
@@ -89,51 +133,68 @@ def admin_update_patient(patient_id: int):
     values = list(updates.values())
     values.append(patient_id)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE patients SET {set_clause} WHERE patient_id = ?", values)
-    conn.commit()
-    conn.close()
+    writes.execute(f"UPDATE patients SET {set_clause} WHERE patient_id = ?", values, group=True)
+    cache.invalidate("patient", patient_id)
     return jsonify({"message": "Patient updated"})
 
 
 @admin_bp.route("/admin/patients/<int:patient_id>", methods=["DELETE"])
 def admin_delete_patient(patient_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
-    conn.commit()
-    conn.close()
+    def delete(conn):
+        archive.purge(conn, "patient_id", patient_id)
+        conn.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
+
+    writes.run(delete)
+    cache.invalidate("patient", patient_id)
     return jsonify({"message": "Patient deleted"})
 
 
 # Doctor management
+DOCTOR_FILTERS = {
+    "doctor_id": ("int", "doctor_id"),
+    "name": ("name", ("first_name", "last_name")),
+    "specialization": ("eq", "specialization"),
+    "branch": ("eq", "hospital_branch"),
+    "experience_min": ("gte", "years_experience"),
+    "experience_max": ("lte", "years_experience"),
+    "phone": ("contains", "phone_number"),
+    "email": ("contains", "email"),
+}
+DOCTOR_SORTS = {
+    "id": ("doctor_id",),
+    "name": ("last_name", "first_name", "doctor_id"),
+    "experience": ("IFNULL(years_experience, 0)", "doctor_id"),
+}
+
+
 @admin_bp.route("/admin/doctors", methods=["GET"])
+@conditional("doctors")
 def admin_list_doctors():
-    conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM doctors").fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    conn = get_db()
+    return list_rows(
+        conn,
+        request.args,
+        columns="*",
+        from_clause="doctors",
+        filters=DOCTOR_FILTERS,
+        sort_keys=DOCTOR_SORTS,
+        default_sort=("id", "asc"),
+    )
 
 
 @admin_bp.route("/admin/doctors/<int:doctor_id>", methods=["GET"])
+@conditional("doctor:{doctor_id}")
 def admin_get_doctor(doctor_id: int):
-    conn = get_db_connection()
-    row = conn.execute(
-        "SELECT * FROM doctors WHERE doctor_id = ?", (doctor_id,)
-    ).fetchone()
-    conn.close()
-    if not row:
+    doctor = cache.doctor(doctor_id)
+    if not doctor:
         return jsonify({"error": "Doctor not found"}), 404
-    return jsonify(row_to_dict(row))
+    return jsonify(doctor)
 
 
 @admin_bp.route("/admin/doctors", methods=["POST"])
 def admin_create_doctor():
     data = request.get_json() or {}
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = writes.execute(
         """
         INSERT INTO doctors (first_name, last_name, specialization, phone_number, years_experience, hospital_branch, email)
         VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -148,9 +209,8 @@ def admin_create_doctor():
             data.get("email"),
         ),
     )
-    conn.commit()
     doctor_id = cursor.lastrowid
-    conn.close()
+    cache.invalidate("doctors")
     return jsonify({"doctor_id": doctor_id}), 201
 
 
@@ -174,57 +234,77 @@ def admin_update_doctor(doctor_id: int):
     values = list(updates.values())
     values.append(doctor_id)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE doctors SET {set_clause} WHERE doctor_id = ?", values)
-    conn.commit()
-    conn.close()
+    writes.execute(f"UPDATE doctors SET {set_clause} WHERE doctor_id = ?", values, group=True)
+    cache.invalidate("doctor", doctor_id)
+    cache.invalidate("doctors")
     return jsonify({"message": "Doctor updated"})
 
 
 @admin_bp.route("/admin/doctors/<int:doctor_id>", methods=["DELETE"])
 def admin_delete_doctor(doctor_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM doctors WHERE doctor_id = ?", (doctor_id,))
-    conn.commit()
-    conn.close()
+    def delete(conn):
+        archive.purge(conn, "doctor_id", doctor_id)
+        conn.execute("DELETE FROM doctors WHERE doctor_id = ?", (doctor_id,))
+
+    writes.run(delete)
+    cache.invalidate("doctor", doctor_id)
+    cache.invalidate("doctors")
     return jsonify({"message": "Doctor deleted"})
 
 
 # Appointment management
+APPOINTMENT_FILTERS = {
+    "appointment_id": ("int", "a.appointment_id"),
+    "patient_id": ("int", "a.patient_id"),
+    "doctor_id": ("int", "a.doctor_id"),
+    "patient_name": ("name", ("p.first_name", "p.last_name")),
+    "doctor_name": ("name", ("d.first_name", "d.last_name")),
+    "status": ("code", ("a.status_code", APPOINTMENT_STATUSES)),
+    "reason": ("eq", "a.reason_for_visit"),
+    "date_from": ("since", "a.starts_at"),
+    "date_to": ("until", "a.starts_at"),
+    "time_from": ("after", "a.appointment_time"),
+    "time_to": ("before", "a.appointment_time"),
+}
+APPOINTMENT_SORTS = {
+    "date": ("a.starts_at", "a.appointment_id"),
+    "id": ("a.appointment_id",),
+}
+
+
 @admin_bp.route("/admin/appointments", methods=["GET"])
+@conditional("appointments", "patients", "doctors")
 def admin_list_appointments():
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT a.*, p.first_name AS patient_first_name, p.last_name AS patient_last_name,
-               d.first_name AS doctor_first_name, d.last_name AS doctor_last_name
-        FROM appointments a
+    conn = get_db()
+    return list_rows(
+        conn,
+        request.args,
+        columns=f"""{api_columns("appointments", "a")}, p.first_name AS patient_first_name,
+               p.last_name AS patient_last_name, d.first_name AS doctor_first_name, d.last_name AS doctor_last_name""",
+        from_clause=f"""{archive.source("appointments")} a
         JOIN patients p ON a.patient_id = p.patient_id
-        JOIN doctors d ON a.doctor_id = d.doctor_id
-        ORDER BY a.appointment_date DESC, a.appointment_time DESC
-        """
-    ).fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+        JOIN doctors d ON a.doctor_id = d.doctor_id""",
+        filters=APPOINTMENT_FILTERS,
+        sort_keys=APPOINTMENT_SORTS,
+        default_sort=("date", "desc"),
+    )
 
 
 @admin_bp.route("/admin/appointments/<int:appointment_id>", methods=["GET"])
+@conditional("appointments", "patients", "doctors")
 def admin_get_appointment(appointment_id: int):
-    conn = get_db_connection()
+    conn = get_db()
     row = conn.execute(
-        """
-        SELECT a.*, p.first_name AS patient_first_name, p.last_name AS patient_last_name,
-               d.first_name AS doctor_first_name, d.last_name AS doctor_last_name
-        FROM appointments a
+        f"""
+        SELECT {api_columns("appointments", "a")}, p.first_name AS patient_first_name,
+               p.last_name AS patient_last_name, d.first_name AS doctor_first_name, d.last_name AS doctor_last_name
+        FROM {archive.source("appointments")} a
         JOIN patients p ON a.patient_id = p.patient_id
         JOIN doctors d ON a.doctor_id = d.doctor_id
         WHERE a.appointment_id = ?
         """,
         (appointment_id,),
     ).fetchone()
-    conn.close()
     if not row:
         return jsonify({"error": "Appointment not found"}), 404
     return jsonify(row_to_dict(row))
@@ -249,43 +329,86 @@ def admin_update_appointment(appointment_id: int):
     values = list(updates.values())
     values.append(appointment_id)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE appointments SET {set_clause} WHERE appointment_id = ?", values)
-    conn.commit()
-    conn.close()
+    def update(conn):
+        recheck_slot(conn, appointment_id, updates)
+        return conn.execute(f"UPDATE appointments SET {set_clause} WHERE appointment_id = ?", values).rowcount
+
+    if not writes.run(update):
+        return archive.not_updated("appointments", appointment_id, "Appointment")
     return jsonify({"message": "Appointment updated"})
 
 
 # Billing management
+BILLING_FILTERS = {
+    "bill_id": ("int", "b.bill_id"),
+    "patient_id": ("int", "b.patient_id"),
+    "patient_name": ("name", ("p.first_name", "p.last_name")),
+    "status": ("code", ("b.payment_code", PAYMENT_STATUSES)),
+    "payment_method": ("eq", "b.payment_method"),
+    "date_from": ("since", "b.billed_at"),
+    "date_to": ("until", "b.billed_at"),
+    "amount_min": ("gte", "b.amount"),
+    "amount_max": ("lte", "b.amount"),
+}
+BILLING_SORTS = {
+    "date": ("b.billed_at", "b.bill_id"),
+    "amount": ("b.amount", "b.bill_id"),
+    "id": ("b.bill_id",),
+}
+
+
 @admin_bp.route("/admin/billing", methods=["GET"])
+@conditional("billing", "patients")
 def admin_list_billing():
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT b.*, p.first_name AS patient_first_name, p.last_name AS patient_last_name
-        FROM billing b
-        JOIN patients p ON b.patient_id = p.patient_id
-        ORDER BY b.bill_date DESC
-        """
-    ).fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    conn = get_db()
+    return list_rows(
+        conn,
+        request.args,
+        columns=f"{api_columns('billing', 'b')}, p.first_name AS patient_first_name, p.last_name AS patient_last_name",
+        from_clause=f"{archive.source('billing')} b JOIN patients p ON b.patient_id = p.patient_id",
+        filters=BILLING_FILTERS,
+        sort_keys=BILLING_SORTS,
+        default_sort=("date", "desc"),
+        aggregates={"total_amount": "COALESCE(SUM(b.amount), 0)"},
+    )
+
+
+@admin_bp.route("/admin/billing/summary", methods=["GET"])
+@conditional("billing")
+def admin_billing_summary():
+    month_start = date.today().replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    conn = get_db()
+    row = conn.execute(
+        f"""
+        SELECT COUNT(*) AS bill_count,
+               COALESCE(SUM(amount), 0) AS total_amount,
+               COALESCE(SUM(CASE WHEN payment_code = :paid THEN amount END), 0) AS paid_amount,
+               COALESCE(SUM(CASE WHEN payment_code = :paid
+                                  AND billed_at >= :month_start AND billed_at < :next_month THEN amount END), 0)
+                   AS month_paid_amount,
+               COALESCE(SUM(CASE WHEN payment_code != :paid THEN amount END), 0) AS pending_amount,
+               COALESCE(AVG(amount), 0) AS average_amount
+        FROM {archive.source("billing")}
+        """,
+        {"paid": PAYMENT_STATUSES["paid"], "month_start": day_start(month_start), "next_month": day_start(next_month)},
+    ).fetchone()
+    return jsonify(row_to_dict(row))
 
 
 @admin_bp.route("/admin/billing/<int:bill_id>", methods=["GET"])
+@conditional("billing", "patients")
 def admin_get_bill(bill_id: int):
-    conn = get_db_connection()
+    conn = get_db()
     row = conn.execute(
-        """
-        SELECT b.*, p.first_name AS patient_first_name, p.last_name AS patient_last_name
-        FROM billing b
+        f"""
+        SELECT {api_columns("billing", "b")}, p.first_name AS patient_first_name, p.last_name AS patient_last_name
+        FROM {archive.source("billing")} b
         JOIN patients p ON b.patient_id = p.patient_id
         WHERE b.bill_id = ?
         """,
         (bill_id,),
     ).fetchone()
-    conn.close()
     if not row:
         return jsonify({"error": "Bill not found"}), 404
     return jsonify(row_to_dict(row))
@@ -303,9 +426,7 @@ def admin_update_bill(bill_id: int):
     values = list(updates.values())
     values.append(bill_id)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE billing SET {set_clause} WHERE bill_id = ?", values)
-    conn.commit()
-    conn.close()
+    cursor = writes.execute(f"UPDATE billing SET {set_clause} WHERE bill_id = ?", values, group=True)
+    if not cursor.rowcount:
+        return archive.not_updated("billing", bill_id, "Bill")
     return jsonify({"message": "Bill updated"})
@@ -1,6 +1,14 @@
-from flask import Blueprint, jsonify, request
+import queue
+from itertools import islice
 
-from backend.db import get_db_connection
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from backend import archive, changes, writes
+from backend.availability import SlotConflict, appointment_minutes, check_slot, recheck_slot, to_minutes
+from backend.bulk import bulk_response, insert_many, parse_batch
+from backend.db import get_db, read_snapshot
+from backend.pagination import QueryError, page_limit
+from backend.utils import EVENT_STREAM_MIMETYPE
 
 appointments_bp = Blueprint("appointments", __name__)
 
@@ -17,28 +25,124 @@ def create_appointment():
             400,
         )
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, reason_for_visit, status)
-        VALUES (?, ?, ?, ?, ?, COALESCE(?, 'scheduled'))
-        """,
-        (
-            data.get("patient_id"),
-            data.get("doctor_id"),
-            data.get("appointment_date"),
-            data.get("appointment_time"),
-            data.get("reason_for_visit"),
-            data.get("status"),
-        ),
-    )
-    conn.commit()
-    appointment_id = cursor.lastrowid
-    conn.close()
+    def book(conn):
+        check_slot(
+            conn,
+            data["doctor_id"],
+            data["appointment_date"],
+            data["appointment_time"],
+            status=data.get("status"),
+        )
+        return conn.execute(
+            """
+            INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, reason_for_visit, status)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, 'scheduled'))
+            """,
+            (
+                data.get("patient_id"),
+                data.get("doctor_id"),
+                data.get("appointment_date"),
+                data.get("appointment_time"),
+                data.get("reason_for_visit"),
+                data.get("status"),
+            ),
+        ).lastrowid
+
+    appointment_id = writes.run(book)
     return jsonify({"appointment_id": appointment_id}), 201
 
 
+APPOINTMENT_COLUMNS = (
+    "patient_id",
+    "doctor_id",
+    "appointment_date",
+    "appointment_time",
+    "reason_for_visit",
+    "status",
+)
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _existing_ids(conn, table, key, ids):
+    ids = list({value for value in ids if value is not None})
+    if not ids:
+        return set()
+    rows = conn.execute(f"SELECT {key} FROM {table} WHERE {key} IN ({', '.join('?' * len(ids))})", ids)
+    return {row[0] for row in rows}
+
+
+@appointments_bp.route("/appointments/bulk", methods=["POST"])
+def create_appointments_bulk():
+    items, mode = parse_batch(request.get_json(silent=True))
+    required_fields = ["patient_id", "doctor_id", "appointment_date", "appointment_time"]
+    length = appointment_minutes()
+
+    # Validation reads the same snapshot the insert writes to, so neither a
+    # concurrent booking nor a deleted patient can slip in between.
+    def book_all(conn):
+        valid = [item for item in items if isinstance(item, dict)]
+        patients = _existing_ids(conn, "patients", "patient_id", [_as_id(item.get("patient_id")) for item in valid])
+        doctors = _existing_ids(conn, "doctors", "doctor_id", [_as_id(item.get("doctor_id")) for item in valid])
+
+        results = []
+        rows = []
+        batch_slots = {}  # (doctor_id, date) -> [(start minute, index)] accepted so far
+        for index, item in enumerate(items):
+            result = {"index": index}
+            results.append(result)
+            if not isinstance(item, dict):
+                result["error"] = "item must be an object"
+                continue
+            if not all(item.get(field) for field in required_fields):
+                result["error"] = "patient_id, doctor_id, appointment_date, appointment_time are required"
+                continue
+            if _as_id(item["patient_id"]) not in patients:
+                result["error"] = "Patient not found"
+                continue
+            if _as_id(item["doctor_id"]) not in doctors:
+                result["error"] = "Doctor not found"
+                continue
+            try:
+                check_slot(
+                    conn, item["doctor_id"], item["appointment_date"], item["appointment_time"], status=item.get("status")
+                )
+            except SlotConflict as conflict:
+                result["error"] = str(conflict)
+                result["conflicting_appointment_id"] = conflict.appointment_id
+                continue
+            except QueryError as error:
+                result["error"] = str(error)
+                continue
+
+            if str(item.get("status") or "").lower() != "cancelled":
+                start = to_minutes(item["appointment_time"])
+                taken = batch_slots.setdefault((_as_id(item["doctor_id"]), item["appointment_date"]), [])
+                clash = next((other for minute, other in taken if abs(minute - start) < length), None)
+                if clash is not None:
+                    result["error"] = f"doctor is already booked by item {clash} of this batch"
+                    continue
+                taken.append((start, index))
+
+            row = {column: item.get(column) for column in APPOINTMENT_COLUMNS}
+            row["status"] = row["status"] or "scheduled"
+            rows.append(tuple(row.values()))
+
+        if mode == "partial" or len(rows) == len(items):
+            ids = iter(insert_many(conn, "appointments", APPOINTMENT_COLUMNS, rows))
+            for result in results:
+                if "error" not in result:
+                    result["appointment_id"] = next(ids)
+        return results
+
+    return bulk_response(writes.run(book_all), mode)
+
+
 @appointments_bp.route("/appointments/<int:appointment_id>", methods=["PUT"])
 def update_appointment(appointment_id: int):
     data = request.get_json() or {}
@@ -57,24 +161,24 @@ def update_appointment(appointment_id: int):
     values = list(updates.values())
     values.append(appointment_id)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE appointments SET {set_clause} WHERE appointment_id = ?", values)
-    conn.commit()
-    conn.close()
+    def update(conn):
+        recheck_slot(conn, appointment_id, updates)
+        return conn.execute(f"UPDATE appointments SET {set_clause} WHERE appointment_id = ?", values).rowcount
+
+    if not writes.run(update):
+        return archive.not_updated("appointments", appointment_id, "Appointment")
     return jsonify({"message": "Appointment updated"})
 
 
 @appointments_bp.route("/appointments/<int:appointment_id>", methods=["DELETE"])
 def cancel_appointment(appointment_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = writes.execute(
         "UPDATE appointments SET status = 'cancelled' WHERE appointment_id = ?",
         (appointment_id,),
+        group=True,
     )
-    conn.commit()
-    conn.close()
+    if not cursor.rowcount:
+        return archive.not_updated("appointments", appointment_id, "Appointment")
     return jsonify({"message": "Appointment cancelled"})
 
 
@@ -85,12 +189,104 @@ def update_appointment_status(appointment_id: int):
     if not status:
         return jsonify({"error": "status is required"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = writes.execute(
         "UPDATE appointments SET status = ? WHERE appointment_id = ?",
         (status, appointment_id),
+        group=True,
     )
-    conn.commit()
-    conn.close()
+    if not cursor.rowcount:
+        return archive.not_updated("appointments", appointment_id, "Appointment")
     return jsonify({"message": "Status updated"})
+
+
+def _sse(dumps, event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {dumps(data)}\n\n"
+
+
+@appointments_bp.route("/appointments/changes", methods=["GET"])
+def appointment_changes():
+    """Appointment inserts, updates and cancellations as they are committed.
+
+    ``EventSource`` clients get a Server-Sent Events stream that resumes from
+    ``Last-Event-ID``; anything else gets one JSON page of the changes after
+    ``last_event_id``.
+    """
+
+    filters = changes.parse_filters(request.args)
+    resume_from = changes.parse_event_id(request.headers.get("Last-Event-ID") or request.args.get("last_event_id"))
+    dumps = current_app.json.dumps
+    conn = get_db()
+
+    if request.accept_mimetypes.best != EVENT_STREAM_MIMETYPE:
+        limit = page_limit(request.args)
+        with read_snapshot(conn):
+            last = changes.last_change_id(conn)
+            first = changes.first_change_id(conn)
+            position = last if resume_from is None else resume_from
+            # A position past the end predates a rebuilt or restored log: start from now.
+            reset = position > last or (first is not None and position < first - 1)
+            position = min(position, last)
+            rows = changes.changes_since(conn, position)
+            page = list(islice((row for row in rows if changes.matches(row, filters)), limit))
+            rows.close()
+        # A full page may have more after it; otherwise the whole log was read.
+        return jsonify(
+            {
+                "changes": [changes.to_event(row) for row in page],
+                "last_event_id": page[-1]["change_id"] if len(page) == limit else last,
+                "reset": reset,
+            }
+        )
+
+    # Subscribe before reading the backlog so nothing committed in between is
+    # lost; live events the backlog already covered are skipped below.
+    try:
+        subscription = changes.get_hub().subscribe(conn, filters)
+    except changes.TooManySubscribers as exc:
+        return jsonify({"error": str(exc)}), 503
+    try:
+        with read_snapshot(conn):
+            first = changes.first_change_id(conn)
+            last = changes.last_change_id(conn)
+            if resume_from is None or resume_from > last or (first is not None and resume_from < first - 1):
+                # No position, one older than the pruned log, or one past its end
+                # (the log was recreated or restored since): start from now.
+                event = "ready" if resume_from is None else "reset"
+                seen = last
+                backlog = [_sse(dumps, event, {"last_event_id": seen}, seen)]
+            else:
+                seen = resume_from
+                backlog = []
+                for row in changes.changes_since(conn, resume_from):
+                    seen = row["change_id"]
+                    if changes.matches(row, filters):
+                        backlog.append(_sse(dumps, row["op"], changes.to_event(row), seen))
+    except Exception:
+        subscription.close()
+        raise
+
+    heartbeat = float(current_app.config["CHANGE_FEED_HEARTBEAT_SECONDS"])
+
+    def generate():
+        # No database access from here on: the hub thread feeds the queue.
+        last_sent = seen
+        try:
+            yield from backlog
+            while True:
+                try:
+                    row = subscription.events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if row["change_id"] <= last_sent:
+                    continue
+                last_sent = row["change_id"]
+                yield _sse(dumps, row["op"], changes.to_event(row), last_sent)
+        finally:
+            subscription.close()
+
+    return Response(
+        generate(),
+        mimetype=EVENT_STREAM_MIMETYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
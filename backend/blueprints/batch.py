@@ -0,0 +1,120 @@
+"""``POST /batch``: several API calls in one round trip.
+
+Each sub-request is routed through the app's URL map and handled by the
+same view as a standalone call, on the batch's pooled connection. When every
+sub-request is a read, they all run inside one ``read_snapshot``, so the
+results are mutually consistent; a batch with writes runs its items in order
+and each write commits as it would on its own.
+"""
+
+from contextlib import nullcontext
+
+from flask import Blueprint, current_app, jsonify, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+from backend.db import get_db, read_snapshot
+from backend.pagination import QueryError
+from backend.utils import EVENT_STREAM_MIMETYPE, stream_format
+
+batch_bp = Blueprint("batch", __name__)
+
+DEFAULT_BATCH_MAX_REQUESTS = 50
+READ_METHODS = ("GET", "HEAD")
+STREAMED_ERROR = ({"error": "streamed responses are not available in a batch"}, 400)
+
+
+def parse_requests(data):
+    """Return ``[(method, path, body, headers), ...]`` from a batch body."""
+
+    items = data.get("requests") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise QueryError("requests must be a non-empty list")
+    max_requests = int(current_app.config.get("BATCH_MAX_REQUESTS", DEFAULT_BATCH_MAX_REQUESTS))
+    if len(items) > max_requests:
+        raise QueryError(f"at most {max_requests} requests per batch")
+
+    parsed = []
+    for index, item in enumerate(items):
+        path = item.get("path") if isinstance(item, dict) else None
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise QueryError(f"requests[{index}].path must start with /")
+        headers = item.get("headers") or {}
+        if not isinstance(headers, dict):
+            raise QueryError(f"requests[{index}].headers must be an object")
+        parsed.append((str(item.get("method") or "GET").upper(), path, item.get("body"), headers))
+    return parsed
+
+
+def _handle(app):
+    """Dispatch the current (sub-)request like ``full_dispatch_request`` minus the hooks."""
+
+    if request.path == "/batch":
+        return app.make_response(({"error": "batches cannot be nested"}, 400))
+    if stream_format() or request.accept_mimetypes.best == EVENT_STREAM_MIMETYPE:
+        return app.make_response(STREAMED_ERROR)
+    try:
+        rv = app.dispatch_request()
+    except HTTPException as exc:
+        rv = ({"error": exc.description}, exc.code)
+    except Exception as exc:
+        try:
+            # Registered handlers (QueryError, SlotConflict); anything else is re-raised.
+            rv = app.handle_user_exception(exc)
+        except Exception:
+            app.logger.exception("batch sub-request %s %s failed", request.method, request.full_path)
+            rv = ({"error": "Internal server error"}, 500)
+    response = app.make_response(rv)
+    if response.is_streamed:
+        # Its body could run for as long as it likes (an event stream never
+        # ends) while holding the batch's connection and snapshot.
+        response.close()
+        return app.make_response(STREAMED_ERROR)
+    return response
+
+
+def dispatch(conn, method, path, body, headers):
+    """Run one sub-request on ``conn`` and return its response."""
+
+    app = current_app._get_current_object()
+    builder = EnvironBuilder(
+        path=path, method=method, json=body, headers=headers, base_url=request.host_url
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    # A fresh app context keeps the sub-request's ``g`` apart from the batch's;
+    # it borrows the batch's connection and hands it back before tearing down.
+    app_ctx = app.app_context()
+    app_ctx.g.db = conn
+    with app_ctx:
+        try:
+            with app.request_context(environ):
+                return _handle(app)
+        finally:
+            app_ctx.g.pop("db", None)
+
+
+def _result(response):
+    result = {"status": response.status_code}
+    if response.headers.get("ETag"):
+        result["etag"] = response.headers["ETag"]
+    if not response.get_data():
+        result["body"] = None
+    elif response.is_json:
+        result["body"] = response.get_json()
+    else:
+        result["body"] = response.get_data(as_text=True)
+    return result
+
+
+@batch_bp.route("/batch", methods=["POST"])
+def batch():
+    items = parse_requests(request.get_json(silent=True))
+    conn = get_db()
+    read_only = all(method in READ_METHODS for method, _, _, _ in items)
+    with read_snapshot(conn) if read_only else nullcontext():
+        responses = [dispatch(conn, *item) for item in items]
+    return jsonify({"responses": [_result(response) for response in responses]})
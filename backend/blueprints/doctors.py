@@ -1,137 +1,287 @@
-from flask import Blueprint, jsonify
-from datetime import datetime
+from flask import Blueprint, jsonify, request
+from datetime import date, timedelta
 
-from backend.db import get_db_connection
-from backend.utils import row_to_dict
+from backend import archive, cache
+from backend.availability import availability, parse_window
+from backend.db import get_db, read_snapshot
+from backend.etag import conditional
+from backend.normalized import api_columns, day_start
+from backend.pagination import QueryError, decode_cursor, encode_cursor, page_limit
+from backend.utils import row_to_dict, rows_response, stream_format
 
 doctors_bp = Blueprint("doctors", __name__)
 
 
 @doctors_bp.route("/doctors", methods=["GET"])
+@conditional("doctors")
 def list_doctors():
-    conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM doctors").fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    if stream_format():
+        return rows_response(get_db().execute("SELECT * FROM doctors"))
+    return jsonify(cache.doctor_directory())
 
 
 # 获取单个医生信息
 @doctors_bp.route("/doctors/<int:doctor_id>", methods=["GET"])
+@conditional("doctor:{doctor_id}")
 def get_doctor(doctor_id: int):
-    conn = get_db_connection()
-    row = conn.execute(
-        "SELECT * FROM doctors WHERE doctor_id = ?", (doctor_id,)
-    ).fetchone()
-    conn.close()
-    
-    if not row:
+    doctor = cache.doctor(doctor_id)
+    if not doctor:
         return jsonify({"error": "Doctor not found"}), 404
     
-    return jsonify(row_to_dict(row))
+    return jsonify(doctor)
+
+
+# 医生可预约时段（可按专科、院区批量查询）
+@doctors_bp.route("/doctors/availability", methods=["GET"])
+@conditional("doctors", "appointments")
+def doctors_availability():
+    window = parse_window(request.args)
+    clauses = []
+    params = []
+    if request.args.get("specialization"):
+        clauses.append("specialization = ?")
+        params.append(request.args["specialization"])
+    if request.args.get("branch"):
+        clauses.append("hospital_branch = ?")
+        params.append(request.args["branch"])
+    where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    conn = get_db()
+    doctors = conn.execute(
+        f"""
+        SELECT doctor_id, first_name, last_name, specialization, hospital_branch
+        FROM doctors {where_sql}
+        ORDER BY doctor_id
+        """,
+        params,
+    ).fetchall()
+    free = availability(conn, [row["doctor_id"] for row in doctors], window)
+    return jsonify(
+        {
+            "from": window["days"][0].isoformat(),
+            "to": window["days"][-1].isoformat(),
+            "slot_minutes": window["slot"],
+            "doctors": [dict(row_to_dict(row), days=free[row["doctor_id"]]) for row in doctors],
+        }
+    )
+
+
+@doctors_bp.route("/doctors/<int:doctor_id>/availability", methods=["GET"])
+@conditional("doctor:{doctor_id}")
+def doctor_availability(doctor_id: int):
+    window = parse_window(request.args)
+    if not cache.doctor(doctor_id):
+        return jsonify({"error": "Doctor not found"}), 404
+
+    free = availability(get_db(), [doctor_id], window)
+    return jsonify(
+        {
+            "doctor_id": doctor_id,
+            "from": window["days"][0].isoformat(),
+            "to": window["days"][-1].isoformat(),
+            "slot_minutes": window["slot"],
+            "days": free[doctor_id],
+        }
+    )
 
 
 # 获取医生今日排班
 @doctors_bp.route("/doctors/<int:doctor_id>/schedule", methods=["GET"])
+@conditional("doctor:{doctor_id}")
 def doctor_schedule(doctor_id: int):
-    today = datetime.now().strftime("%Y-%m-%d")
+    today = date.today()
     
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT a.*, p.first_name AS patient_first_name, p.last_name AS patient_last_name,
-               p.contact_number AS patient_contact
+    conn = get_db()
+    cursor = conn.execute(
+        f"""
+        SELECT {api_columns("appointments", "a")}, p.first_name AS patient_first_name,
+               p.last_name AS patient_last_name, p.contact_number AS patient_contact
         FROM appointments a
         JOIN patients p ON a.patient_id = p.patient_id
-        WHERE a.doctor_id = ? AND a.appointment_date = ?
-        ORDER BY a.appointment_time ASC
+        WHERE a.doctor_id = ? AND a.starts_at >= ? AND a.starts_at < ?
+        ORDER BY a.starts_at ASC
         """,
-        (doctor_id, today),
-    ).fetchall()
-    conn.close()
+        (doctor_id, day_start(today), day_start(today + timedelta(days=1))),
+    )
     
-    return jsonify([row_to_dict(row) for row in rows])
+    return rows_response(cursor)
 
 
 # 添加：获取医生的所有预约（用于统计）
 @doctors_bp.route("/doctors/<int:doctor_id>/appointments", methods=["GET"])
+@conditional("doctor:{doctor_id}")
 def doctor_all_appointments(doctor_id: int):
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT a.*, p.first_name AS patient_first_name, p.last_name AS patient_last_name
-        FROM appointments a
+    conn = get_db()
+    cursor = conn.execute(
+        f"""
+        SELECT {api_columns("appointments", "a")}, p.first_name AS patient_first_name,
+               p.last_name AS patient_last_name
+        FROM {archive.source("appointments")} a
         JOIN patients p ON a.patient_id = p.patient_id
         WHERE a.doctor_id = ?
-        ORDER BY a.appointment_date DESC, a.appointment_time DESC
+        ORDER BY a.starts_at DESC
         """,
         (doctor_id,),
-    ).fetchall()
-    conn.close()
+    )
     
-    return jsonify([row_to_dict(row) for row in rows])
+    return rows_response(cursor)
 
 
 # 获取医生的所有患者
+PATIENT_FIELDS = (
+    "patient_id",
+    "first_name",
+    "last_name",
+    "gender",
+    "date_of_birth",
+    "contact_number",
+    "address",
+    "insurance_provider",
+    "insurance_number",
+    "email",
+)
+
+
 @doctors_bp.route("/doctors/<int:doctor_id>/patients", methods=["GET"])
+@conditional("doctor:{doctor_id}")
 def doctor_patients(doctor_id: int):
-    conn = get_db_connection()
-    rows = conn.execute(
+    """Patients seen by a doctor, most recent visit first, with their visits.
+
+    ``limit``/``cursor`` page by patient; ``max_appointments`` keeps only each
+    patient's newest visits (``appointment_count`` still counts all of them).
+    ``history=all`` includes archived visits.
+    """
+
+    args = request.args
+    paged = "limit" in args or "cursor" in args
+    max_appointments = args.get("max_appointments")
+    if max_appointments is not None:
+        try:
+            max_appointments = max(0, int(max_appointments))
+        except ValueError:
+            raise QueryError("max_appointments must be an integer")
+
+    appointments, treatments = archive.source("appointments"), archive.source("treatments")
+    conn = get_db()
+    with read_snapshot(conn):
+        # One row per patient: the visit summary is aggregated straight from the
+        # (doctor_id, patient_id, ...) index, then joined to the patient once.
+        visits = f"""
+            SELECT patient_id, MAX(starts_at) AS last_visit,
+                   COUNT(*) AS appointment_count
+            FROM {appointments}
+            WHERE doctor_id = ?
+            GROUP BY patient_id
         """
-        SELECT p.*, a.appointment_id, a.appointment_date, a.appointment_time, a.status,
-               t.treatment_id, t.treatment_type, t.description, t.cost, t.treatment_date
-        FROM appointments a
-        JOIN patients p ON a.patient_id = p.patient_id
-        LEFT JOIN treatments t ON a.appointment_id = t.appointment_id
-        WHERE a.doctor_id = ?
-        ORDER BY a.appointment_date DESC, a.appointment_time DESC
-        """,
-        (doctor_id,),
-    ).fetchall()
-    conn.close()
-
-    patients = {}
-    for row in rows:
-        patient_id = row["patient_id"]
-        if patient_id not in patients:
-            patients[patient_id] = {
-                "patient": {
-                    "patient_id": row["patient_id"],
-                    "first_name": row["first_name"],
-                    "last_name": row["last_name"],
-                    "gender": row["gender"],
-                    "date_of_birth": row["date_of_birth"],
-                    "contact_number": row["contact_number"],
-                    "address": row["address"],
-                    "insurance_provider": row["insurance_provider"],
-                    "insurance_number": row["insurance_number"],
-                    "email": row["email"],
-                },
+        patient_sql = f"""
+            SELECT {", ".join(f"p.{field}" for field in PATIENT_FIELDS)}, v.last_visit, v.appointment_count
+            FROM ({visits}) v
+            JOIN patients p ON p.patient_id = v.patient_id
+        """
+        params = [doctor_id]
+        total = None
+        if paged:
+            limit = page_limit(args)
+            if args.get("cursor"):
+                values = decode_cursor(args["cursor"])
+                # Shaped like list_rows' cursors: sort key and order, then the last row's keys.
+                if len(values) != 4 or values[:2] != ["last_visit", "desc"] or \
+                        not all(type(value) is int for value in values[2:]):
+                    raise QueryError("invalid cursor")
+                patient_sql += " WHERE (v.last_visit, v.patient_id) < (?, ?)"
+                params += values[2:]
+            else:
+                total = conn.execute(
+                    f"SELECT COUNT(DISTINCT patient_id) FROM {appointments} WHERE doctor_id = ?", (doctor_id,)
+                ).fetchone()[0]
+            patient_sql += " ORDER BY v.last_visit DESC, v.patient_id DESC LIMIT ?"
+            params.append(limit + 1)
+        else:
+            patient_sql += " ORDER BY v.last_visit DESC, v.patient_id DESC"
+        patient_rows = conn.execute(patient_sql, params).fetchall()
+
+        next_cursor = None
+        if paged and len(patient_rows) > limit:
+            patient_rows = patient_rows[:limit]
+            last = patient_rows[-1]
+            next_cursor = encode_cursor(["last_visit", "desc", last["last_visit"], last["patient_id"]])
+
+        patients = {}
+        for row in patient_rows:
+            patients[row["patient_id"]] = {
+                "patient": {field: row[field] for field in PATIENT_FIELDS},
+                "appointment_count": row["appointment_count"],
                 "appointments": [],
             }
 
-        appointment_entry = {
-            "appointment_id": row["appointment_id"],
-            "appointment_date": row["appointment_date"],
-            "appointment_time": row["appointment_time"],
-            "status": row["status"],
-            "treatments": [],
-        }
-        if row["treatment_id"]:
-            appointment_entry["treatments"].append(
-                {
-                    "treatment_id": row["treatment_id"],
-                    "treatment_type": row["treatment_type"],
-                    "description": row["description"],
-                    "cost": row["cost"],
-                    "treatment_date": row["treatment_date"],
-                }
+        if patients and max_appointments != 0:
+            where = "doctor_id = ?"
+            params = [doctor_id]
+            if paged:
+                where += f" AND patient_id IN ({', '.join('?' * len(patients))})"
+                params += list(patients)
+            cap = ""
+            if max_appointments is not None:
+                cap = "WHERE v.n <= ?"
+                params.append(max_appointments)
+            visits = f"""
+                WITH visits AS (
+                    SELECT appointment_id, patient_id, appointment_date, appointment_time, status,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY patient_id
+                               ORDER BY starts_at DESC, appointment_id DESC
+                           ) AS n
+                    FROM {appointments}
+                    WHERE {where}
+                )
+            """
+            # Visits arrive grouped by patient, newest first. Their treatments
+            # come from a second, inner-join query: with ?history=all both sides
+            # are union views, and SQLite can split an inner join across their
+            # halves but must scan the whole view for the right side of a LEFT JOIN.
+            rows = conn.execute(
+                visits + f"""
+                SELECT v.appointment_id, v.patient_id, v.appointment_date, v.appointment_time, v.status
+                FROM visits v
+                {cap}
+                ORDER BY v.patient_id, v.n
+                """,
+                params,
             )
+            visit_by_id = {}
+            for row in rows:
+                appointment = {
+                    "appointment_id": row["appointment_id"],
+                    "appointment_date": row["appointment_date"],
+                    "appointment_time": row["appointment_time"],
+                    "status": row["status"],
+                    "treatments": [],
+                }
+                patients[row["patient_id"]]["appointments"].append(appointment)
+                visit_by_id[row["appointment_id"]] = appointment
 
-        existing = patients[patient_id]["appointments"]
-        merged = next((a for a in existing if a["appointment_id"] == row["appointment_id"]), None)
-        if merged:
-            merged["treatments"].extend(appointment_entry["treatments"])
-        else:
-            patients[patient_id]["appointments"].append(appointment_entry)
+            rows = conn.execute(
+                visits + f"""
+                SELECT t.appointment_id, t.treatment_id, t.treatment_type, t.description, t.cost, t.treatment_date
+                FROM visits v
+                JOIN {treatments} t ON t.appointment_id = v.appointment_id
+                {cap}
+                ORDER BY t.treatment_id
+                """,
+                params,
+            )
+            for row in rows:
+                visit_by_id[row["appointment_id"]]["treatments"].append(
+                    {
+                        "treatment_id": row["treatment_id"],
+                        "treatment_type": row["treatment_type"],
+                        "description": row["description"],
+                        "cost": row["cost"],
+                        "treatment_date": row["treatment_date"],
+                    }
+                )
 
-    return jsonify(list(patients.values()))
\ No newline at end of file
+    items = list(patients.values())
+    if not paged:
+        return jsonify(items)
+    return jsonify({"items": items, "next_cursor": next_cursor, "total": total})
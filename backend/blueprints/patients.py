@@ -1,7 +1,12 @@
 from flask import Blueprint, jsonify, request
 
-from backend.db import get_db_connection
-from backend.utils import row_to_dict
+from backend import archive, cache, writes
+from backend.bulk import bulk_response, insert_many, parse_batch
+from backend.db import get_db, read_snapshot
+from backend.etag import conditional
+from backend.normalized import api_columns
+from backend.pagination import QueryError, build_filters
+from backend.utils import rows_response
 
 patients_bp = Blueprint("patients", __name__)
 
@@ -13,9 +18,7 @@ def register_patient():
     if not all(data.get(field) for field in required_fields):
         return jsonify({"error": "first_name and last_name are required"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = writes.execute(
         """
         INSERT INTO patients (
             first_name, last_name, gender, date_of_birth, contact_number, address,
@@ -34,73 +37,190 @@ def register_patient():
             data.get("email"),
         ),
     )
-    conn.commit()
     patient_id = cursor.lastrowid
-    conn.close()
     return jsonify({"patient_id": patient_id}), 201
 
 
+PATIENT_COLUMNS = (
+    "first_name",
+    "last_name",
+    "gender",
+    "date_of_birth",
+    "contact_number",
+    "address",
+    "insurance_provider",
+    "insurance_number",
+    "email",
+)
+
+
+@patients_bp.route("/patients/bulk", methods=["POST"])
+def register_patients_bulk():
+    items, mode = parse_batch(request.get_json(silent=True))
+
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"index": index, "error": "item must be an object"})
+        elif not all(item.get(field) for field in ("first_name", "last_name")):
+            results.append({"index": index, "error": "first_name and last_name are required"})
+        else:
+            results.append({"index": index})
+            rows.append(tuple(item.get(column) for column in PATIENT_COLUMNS))
+
+    if mode == "partial" or len(rows) == len(items):
+        ids = iter(writes.run(lambda conn: insert_many(conn, "patients", PATIENT_COLUMNS, rows)))
+        for result in results:
+            if "error" not in result:
+                result["patient_id"] = next(ids)
+    return bulk_response(results, mode)
+
+
 @patients_bp.route("/patients/<int:patient_id>/appointments", methods=["GET"])
+@conditional("patient:{patient_id}", "doctors")
 def patient_appointments(patient_id: int):
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT a.*, d.first_name AS doctor_first_name, d.last_name AS doctor_last_name, d.specialization
-        FROM appointments a
+    conn = get_db()
+    cursor = conn.execute(
+        f"""
+        SELECT {api_columns("appointments", "a")}, d.first_name AS doctor_first_name,
+               d.last_name AS doctor_last_name, d.specialization
+        FROM {archive.source("appointments")} a
         JOIN doctors d ON a.doctor_id = d.doctor_id
         WHERE a.patient_id = ?
-        ORDER BY a.appointment_date DESC, a.appointment_time DESC
+        ORDER BY a.starts_at DESC
         """,
         (patient_id,),
-    ).fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    )
+    return rows_response(cursor)
 
 
 @patients_bp.route("/patients/<int:patient_id>/treatments", methods=["GET"])
+@conditional("patient:{patient_id}")
 def patient_treatments(patient_id: int):
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT t.*
-        FROM treatments t
-        JOIN appointments a ON t.appointment_id = a.appointment_id
-        WHERE a.patient_id = ?
-        ORDER BY t.treatment_date DESC
+    conn = get_db()
+    cursor = conn.execute(
+        f"""
+        WITH rows AS MATERIALIZED (
+            SELECT t.*
+            FROM {archive.source("treatments")} t
+            JOIN {archive.source("appointments")} a ON t.appointment_id = a.appointment_id
+            WHERE a.patient_id = ?
+        )
+        SELECT {api_columns("treatments")} FROM rows
+        ORDER BY treated_at DESC
         """,
         (patient_id,),
-    ).fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    )
+    return rows_response(cursor)
 
 
 @patients_bp.route("/patients/<int:patient_id>/billing", methods=["GET"])
+@conditional("patient:{patient_id}")
 def patient_billing(patient_id: int):
-    conn = get_db_connection()
-    rows = conn.execute(
-        """
-        SELECT b.*
-        FROM billing b
+    conn = get_db()
+    cursor = conn.execute(
+        f"""
+        SELECT {api_columns("billing", "b")}
+        FROM {archive.source("billing")} b
         WHERE b.patient_id = ?
-        ORDER BY b.bill_date DESC
+        ORDER BY b.billed_at DESC
         """,
         (patient_id,),
-    ).fetchall()
-    conn.close()
-    return jsonify([row_to_dict(row) for row in rows])
+    )
+    return rows_response(cursor)
  # 在 patient_billing 函数后面添加以下代码：
 
 @patients_bp.route("/patients/<int:patient_id>", methods=["GET"])
+@conditional("patient:{patient_id}")
 def get_patient(patient_id: int):
     """获取单个患者信息"""
-    conn = get_db_connection()
-    row = conn.execute(
-        "SELECT * FROM patients WHERE patient_id = ?",
-        (patient_id,)
-    ).fetchone()
-    conn.close()
-    
-    if row is None:
+    patient = cache.patient(patient_id)
+    if patient is None:
         return jsonify({"error": "Patient not found"}), 404
     
-    return jsonify(row_to_dict(row))
+    return jsonify(patient)
+
+
+# section -> (query for one patient's rows, epoch-seconds date column, doctor column or None);
+# {appointments}, {treatments} and {billing} are filled in by archive.source().
+# Treatments are joined in a MATERIALIZED CTE because SQLite only splits a join
+# of two union views into per-database halves when the ORDER BY is on a result
+# column; sorting outside the CTE keeps treated_at out of the JSON.
+TIMELINE_SECTIONS = {
+    "appointments": (
+        f"""
+        SELECT {api_columns("appointments", "a")}, d.first_name AS doctor_first_name,
+               d.last_name AS doctor_last_name, d.specialization
+        FROM {{appointments}} a
+        JOIN doctors d ON a.doctor_id = d.doctor_id
+        WHERE a.patient_id = ? {{where}}
+        ORDER BY a.starts_at DESC
+        """,
+        "a.starts_at",
+        "a.doctor_id",
+    ),
+    "treatments": (
+        f"""
+        WITH rows AS MATERIALIZED (
+            SELECT t.*
+            FROM {{treatments}} t
+            JOIN {{appointments}} a ON t.appointment_id = a.appointment_id
+            WHERE a.patient_id = ? {{where}}
+        )
+        SELECT {api_columns("treatments")} FROM rows
+        ORDER BY treated_at DESC
+        """,
+        "t.treated_at",
+        "a.doctor_id",
+    ),
+    "billing": (
+        f"""
+        SELECT {api_columns("billing", "b")}
+        FROM {{billing}} b
+        WHERE b.patient_id = ? {{where}}
+        ORDER BY b.billed_at DESC
+        """,
+        "b.billed_at",
+        None,
+    ),
+}
+
+
+@patients_bp.route("/patients/<int:patient_id>/timeline", methods=["GET"])
+@conditional("patient:{patient_id}", "doctors")
+def patient_timeline(patient_id: int):
+    """A patient with their appointments, treatments and bills in one response.
+
+    ``sections`` picks some of the lists (all by default); ``from``/``to`` bound
+    every list by its own date and ``doctor_id`` keeps one doctor's visits and
+    treatments; ``history=all`` adds archived records. One query per section,
+    all on one snapshot.
+    """
+
+    args = request.args
+    sections = list(TIMELINE_SECTIONS)
+    if args.get("sections"):
+        sections = [section.strip() for section in args["sections"].split(",") if section.strip()]
+        unknown = [section for section in sections if section not in TIMELINE_SECTIONS]
+        if unknown:
+            raise QueryError(f"sections must be among: {', '.join(TIMELINE_SECTIONS)}")
+
+    tables = {table: archive.source(table) for table in archive.ARCHIVED_TABLES}
+    conn = get_db()
+    with read_snapshot(conn):
+        patient = conn.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
+        if patient is None:
+            return jsonify({"error": "Patient not found"}), 404
+
+        result = {"patient": dict(patient)}
+        for section in sections:
+            query, date_column, doctor_column = TIMELINE_SECTIONS[section]
+            filters = {"from": ("since", date_column), "to": ("until", date_column)}
+            if doctor_column:
+                filters["doctor_id"] = ("int", doctor_column)
+            clauses, params = build_filters(args, filters)
+            where = "".join(f" AND {clause}" for clause in clauses)
+            rows = conn.execute(query.format(where=where, **tables), (patient_id, *params))
+            result[section] = [dict(row) for row in rows]
+    return jsonify(result)
@@ -0,0 +1,78 @@
+import re
+
+from flask import Blueprint, jsonify, request
+
+from backend.db import get_db
+from backend.etag import conditional
+from backend.utils import row_to_dict
+
+search_bp = Blueprint("search", __name__)
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Column weights for bm25(), in FTS column order: names rank above contact details.
+SEARCH_TARGETS = {
+    "patients": (
+        "patients",
+        "patient_id",
+        "patients_fts",
+        "10.0, 10.0, 2.0, 2.0, 1.0, 1.0",
+    ),
+    "doctors": (
+        "doctors",
+        "doctor_id",
+        "doctors_fts",
+        "10.0, 10.0, 4.0, 2.0, 2.0, 2.0",
+    ),
+}
+
+
+def build_match_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match as a prefix.
+
+    Words are quoted so user input can never be parsed as FTS5 syntax.
+    """
+
+    words = re.findall(r"\w+", text, flags=re.UNICODE)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+@search_bp.route("/search", methods=["GET"])
+@conditional("patients", "doctors")
+def search():
+    match = build_match_query(request.args.get("q", ""))
+    if not match:
+        return jsonify({"error": "q is required"}), 400
+
+    search_type = request.args.get("type", "all")
+    if search_type == "all":
+        targets = list(SEARCH_TARGETS)
+    elif search_type in SEARCH_TARGETS:
+        targets = [search_type]
+    else:
+        return jsonify({"error": "type must be patients, doctors or all"}), 400
+
+    try:
+        limit = int(request.args.get("limit", DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    conn = get_db()
+    results = {}
+    for target in targets:
+        table, key, fts_table, weights = SEARCH_TARGETS[target]
+        rows = conn.execute(
+            f"""
+            SELECT t.*, bm25({fts_table}, {weights}) AS score
+            FROM {fts_table}
+            JOIN {table} t ON t.{key} = {fts_table}.rowid
+            WHERE {fts_table} MATCH ?
+            ORDER BY score
+            LIMIT ?
+            """,
+            (match, limit),
+        ).fetchall()
+        results[target] = [row_to_dict(row) for row in rows]
+    return jsonify(results)
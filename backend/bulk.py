@@ -0,0 +1,69 @@
+"""Shared plumbing for the ``/.../bulk`` endpoints.
+
+A batch is ``{"items": [...], "mode": "atomic" | "partial"}`` (a bare list is
+accepted too). Every item is validated first; in ``atomic`` mode one invalid
+item rejects the whole batch, in ``partial`` mode the valid items are still
+written. Valid items go in with a single ``executemany`` inside one
+transaction. ``BULK_MAX_ITEMS`` and the default ``BULK_MODE`` come from the
+app config.
+"""
+
+from flask import current_app, jsonify
+
+from backend.pagination import QueryError
+
+DEFAULT_BULK_MAX_ITEMS = 500
+DEFAULT_BULK_MODE = "atomic"
+BULK_MODES = ("atomic", "partial")
+
+
+def parse_batch(data):
+    """Return ``(items, mode)`` from a bulk request body."""
+
+    mode = current_app.config.get("BULK_MODE", DEFAULT_BULK_MODE)
+    if isinstance(data, dict):
+        mode = data.get("mode") or mode
+        items = data.get("items")
+    else:
+        items = data
+    if not isinstance(items, list) or not items:
+        raise QueryError("items must be a non-empty list")
+    if mode not in BULK_MODES:
+        raise QueryError(f"mode must be one of: {', '.join(BULK_MODES)}")
+
+    max_items = int(current_app.config.get("BULK_MAX_ITEMS", DEFAULT_BULK_MAX_ITEMS))
+    if len(items) > max_items:
+        raise QueryError(f"at most {max_items} items per batch")
+    return items, mode
+
+
+def insert_many(conn, table, columns, rows):
+    """``executemany`` an INSERT and return the new rowids in input order.
+
+    Must run inside a write transaction (``writes.run``): holding the write
+    lock means the batch gets consecutive rowids ending at ``last_insert_rowid()``.
+    """
+
+    if not rows:
+        return []
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        rows,
+    )
+    last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def bulk_response(results, mode):
+    """Per-item results plus a status: 201 all created, 207 partly, 400 rejected."""
+
+    errors = sum(1 for result in results if "error" in result)
+    created = len(results) - errors if mode == "partial" or not errors else 0
+    body = {"mode": mode, "created": created, "errors": errors, "results": results}
+    if not errors:
+        return jsonify(body), 201
+    if mode == "atomic":
+        # Nothing was written; only the failing items are worth reporting.
+        body["results"] = [result for result in results if "error" in result]
+        return jsonify(body), 400
+    return jsonify(body), 207 if created else 400
@@ -0,0 +1,228 @@
+"""In-process read-through cache for read-mostly lookups.
+
+The doctor directory and single doctor and patient records are read on every
+page load but change only through the admin routes. Each kind of lookup has
+a bounded LRU cache whose entries also expire ``CACHE_TTL`` seconds after
+they were loaded; the admin create, update and delete routes invalidate the
+entries they affect once their write has committed.
+
+Each worker process has its own cache. With several workers set
+``CACHE_SHARED = True``: a worker then also watches the ``doctors`` and
+``patients`` versions that the ``change_versions`` triggers bump on every
+write to those tables, whoever makes it, and drops the entries of a table
+whose version moved (all of them when the database epoch does). The versions
+are read at most every ``CACHE_SHARED_CHECK_SECONDS``, which bounds how long
+another worker's write can go unnoticed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from backend.db import get_db
+from backend.utils import row_to_dict
+
+DEFAULT_CACHE_SIZE = 1024  # entries per namespace
+DEFAULT_CACHE_TTL = 300.0  # seconds
+DEFAULT_CACHE_SHARED_CHECK_SECONDS = 1.0
+
+NAMESPACES = ("doctors", "doctor", "patient")
+# change_versions scope -> the namespaces its rows are cached in.
+STAMP_SCOPES = {"epoch": NAMESPACES, "doctors": ("doctors", "doctor"), "patients": ("patient",)}
+
+
+class LRUCache:
+    """Bounded mapping whose entries expire ``ttl`` seconds after they were stored."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        """Return ``(True, value)`` for a live entry, else ``(False, None)``."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, entry[1]
+                del self._entries[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["size"] = len(self._entries)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 4) if lookups else None
+        snapshot["maxsize"] = self.maxsize
+        snapshot["ttl"] = self.ttl
+        return snapshot
+
+
+class ReadThroughCache:
+    """One ``LRUCache`` per namespace, loaded on miss and invalidated explicitly."""
+
+    def __init__(self, namespaces=NAMESPACES, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL,
+                 shared=False, check_seconds=DEFAULT_CACHE_SHARED_CHECK_SECONDS):
+        self.caches = {namespace: LRUCache(maxsize, ttl) for namespace in namespaces}
+        self.shared = shared
+        self.check_seconds = float(check_seconds)
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; a load that started before one is not stored.
+        self._generation = 0
+        self._stamp = None
+        self._checked_at = float("-inf")
+
+    def lookup(self, conn, namespace, key, load):
+        """Return the cached value for ``key`` or store and return ``load()``.
+
+        ``None`` (not found) is returned but never cached.
+        """
+
+        if self.shared:
+            self._sync(conn)
+        cache = self.caches[namespace]
+        hit, value = cache.get(key)
+        if hit:
+            return value
+        generation = self._generation
+        value = load()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    cache.put(key, value)
+        return value
+
+    def invalidate(self, namespace, key=None):
+        """Drop ``key`` (or the whole namespace); call after the write has committed."""
+
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self.caches[namespace].clear()
+            else:
+                self.caches[namespace].discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            for cache in self.caches.values():
+                cache.clear()
+
+    def _read_stamp(self, conn):
+        rows = conn.execute(
+            f"SELECT scope, version FROM change_versions WHERE scope IN ({', '.join('?' * len(STAMP_SCOPES))})",
+            tuple(STAMP_SCOPES),
+        ).fetchall()
+        found = {row["scope"]: row["version"] for row in rows}
+        return {scope: found.get(scope, 0) for scope in STAMP_SCOPES}
+
+    def _sync(self, conn):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_seconds:
+            return
+        stamp = self._read_stamp(conn)
+        with self._lock:
+            self._checked_at = now
+            if stamp == self._stamp:
+                return
+            if self._stamp is not None:
+                self._generation += 1
+                for scope, version in stamp.items():
+                    if version != self._stamp[scope]:
+                        for namespace in STAMP_SCOPES[scope]:
+                            self.caches[namespace].clear()
+            self._stamp = stamp
+
+    def stats(self):
+        return {
+            "shared": self.shared,
+            "caches": {namespace: cache.stats() for namespace, cache in self.caches.items()},
+        }
+
+
+def get_cache():
+    return current_app.extensions.get("cache")
+
+
+def cached(namespace, key, load):
+    """``load()`` through the app's cache, or directly when caching is off."""
+
+    cache = get_cache()
+    if cache is None:
+        return load()
+    return cache.lookup(get_db(), namespace, key, load)
+
+
+def invalidate(namespace, key=None):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(namespace, key)
+
+
+def doctor_directory():
+    """Every doctor, as ``GET /doctors`` returns them."""
+
+    return cached(
+        "doctors", "all", lambda: [row_to_dict(row) for row in get_db().execute("SELECT * FROM doctors")]
+    )
+
+
+def doctor(doctor_id):
+    return cached(
+        "doctor",
+        doctor_id,
+        lambda: row_to_dict(get_db().execute("SELECT * FROM doctors WHERE doctor_id = ?", (doctor_id,)).fetchone()),
+    )
+
+
+def patient(patient_id):
+    return cached(
+        "patient",
+        patient_id,
+        lambda: row_to_dict(get_db().execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()),
+    )
+
+
+def init_app(app):
+    """Create the cache unless ``CACHE_ENABLED`` is false."""
+
+    app.config.setdefault("CACHE_ENABLED", True)
+    app.config.setdefault("CACHE_SIZE", DEFAULT_CACHE_SIZE)
+    app.config.setdefault("CACHE_TTL", DEFAULT_CACHE_TTL)
+    app.config.setdefault("CACHE_SHARED", False)
+    app.config.setdefault("CACHE_SHARED_CHECK_SECONDS", DEFAULT_CACHE_SHARED_CHECK_SECONDS)
+    if not app.config["CACHE_ENABLED"]:
+        return
+    app.extensions["cache"] = ReadThroughCache(
+        maxsize=int(app.config["CACHE_SIZE"]),
+        ttl=float(app.config["CACHE_TTL"]),
+        shared=bool(app.config["CACHE_SHARED"]),
+        check_seconds=float(app.config["CACHE_SHARED_CHECK_SECONDS"]),
+    )
@@ -0,0 +1,303 @@
+"""Appointment change log and the live feed behind ``/appointments/changes``.
+
+Triggers append a row to ``appointment_changes`` for every appointment
+insert, update, cancellation and delete, in the same transaction as the write, whichever
+route (or tool) made it. ``change_id`` only grows, so it doubles as the SSE
+event id a client resumes from.
+
+One ``ChangeHub`` thread per process serves every open feed. It runs only
+while someone is subscribed, and between changes it only reads ``PRAGMA
+data_version`` (answered from shared memory, no page reads); the log itself
+is queried once per commit and the rows fanned out to the subscribers whose
+filters match. Run ``python -m backend.changes --prune-days 7`` from cron to
+keep the log short.
+"""
+
+import argparse
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from flask import current_app
+
+from backend.db import DB_PATH, connect
+from backend.pagination import QueryError
+
+DEFAULT_CHANGE_FEED_POLL_SECONDS = 0.5
+DEFAULT_CHANGE_FEED_HEARTBEAT_SECONDS = 15.0
+DEFAULT_CHANGE_FEED_MAX_CLIENTS = 64
+
+EVENT_COLUMNS = ("appointment_id", "patient_id", "doctor_id", "appointment_date", "appointment_time", "status")
+# Fields clients can filter on; updates match on the old value too, so a
+# feed also hears about appointments moved away from it.
+FILTER_FIELDS = ("doctor_id", "patient_id", "appointment_date")
+
+CREATE_TABLES = (
+    f"""
+    CREATE TABLE IF NOT EXISTS appointment_changes (
+        change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        op TEXT NOT NULL,
+        {", ".join(EVENT_COLUMNS)},
+        {", ".join(f"old_{field}" for field in FILTER_FIELDS)},
+        changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Holds a row while a maintenance job (archiving) removes appointments
+    # that were not really deleted; see ``paused``.
+    "CREATE TABLE IF NOT EXISTS changes_paused (reason TEXT NOT NULL)",
+)
+
+
+def create_triggers(conn) -> None:
+    """(Re)create the triggers that append to ``appointment_changes``."""
+
+    columns = ", ".join(("op", *EVENT_COLUMNS, *(f"old_{field}" for field in FILTER_FIELDS)))
+    values = {
+        "insert": ("'insert'", *(f"new.{c}" for c in EVENT_COLUMNS), *("NULL" for _ in FILTER_FIELDS)),
+        "update": (
+            "CASE WHEN LOWER(new.status) = 'cancelled' AND LOWER(old.status) IS NOT 'cancelled' "
+            "THEN 'cancel' ELSE 'update' END",
+            *(f"new.{c}" for c in EVENT_COLUMNS),
+            *(f"old.{f}" for f in FILTER_FIELDS),
+        ),
+        "delete": ("'delete'", *(f"old.{c}" for c in EVENT_COLUMNS), *("NULL" for _ in FILTER_FIELDS)),
+    }
+    for event, row in values.items():
+        guard = " WHEN NOT EXISTS (SELECT 1 FROM changes_paused)" if event == "delete" else ""
+        conn.execute(f"DROP TRIGGER IF EXISTS appointments_changes_{event}")
+        conn.execute(
+            f"CREATE TRIGGER appointments_changes_{event} AFTER {event.upper()} ON appointments{guard} BEGIN "
+            f"INSERT INTO appointment_changes ({columns}) VALUES ({', '.join(row)}); END"
+        )
+
+
+@contextmanager
+def paused(conn, reason):
+    """Leave the deletes made inside the block out of the log.
+
+    Use inside the write transaction doing them: the marker row is gone
+    again before the commit (or with the rollback), so no other connection
+    ever sees it.
+    """
+
+    conn.execute("INSERT INTO changes_paused (reason) VALUES (?)", (reason,))
+    yield conn
+    conn.execute("DELETE FROM changes_paused")
+
+
+def parse_filters(args):
+    """``{field: value}`` from the ``doctor_id``, ``patient_id`` and ``date`` query parameters."""
+
+    filters = {}
+    for field in ("doctor_id", "patient_id"):
+        if args.get(field):
+            filters[field] = _int_param(field, args[field])
+    if args.get("date"):
+        try:
+            filters["appointment_date"] = date.fromisoformat(args["date"]).isoformat()
+        except ValueError:
+            raise QueryError("date must be a YYYY-MM-DD date")
+    return filters
+
+
+def parse_event_id(value):
+    """The change id a client resumes after, or ``None`` to start from now."""
+
+    return None if value is None else _int_param("last_event_id", value)
+
+
+def _int_param(name, value):
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f"{name} must be an integer")
+
+
+def to_event(row):
+    """The JSON payload of one change."""
+
+    event = {"change_id": row["change_id"], "op": row["op"], "changed_at": row["changed_at"]}
+    event.update({column: row[column] for column in EVENT_COLUMNS})
+    if row["op"] in ("update", "cancel"):
+        previous = {field: row[f"old_{field}"] for field in FILTER_FIELDS if row[f"old_{field}"] != row[field]}
+        if previous:
+            event["previous"] = previous
+    return event
+
+
+def matches(row, filters):
+    """Whether a change passes ``filters`` ({field: value}), old values included."""
+
+    return all(value in (row[field], row[f"old_{field}"]) for field, value in filters.items())
+
+
+def last_change_id(conn):
+    return conn.execute("SELECT IFNULL(MAX(change_id), 0) FROM appointment_changes").fetchone()[0]
+
+
+def first_change_id(conn):
+    return conn.execute("SELECT MIN(change_id) FROM appointment_changes").fetchone()[0]
+
+
+def restart_log(conn, after):
+    """Empty the log and continue its ids past ``after``; the caller commits.
+
+    For a database whose log was rewound (a restored snapshot): every
+    client resuming from a position it got before then receives a reset,
+    and none of those ids is handed out again.
+    """
+
+    conn.execute("DELETE FROM appointment_changes")
+    # One id is skipped, so a client that had seen the very last change resets too.
+    if not conn.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'appointment_changes'", (after + 1,)
+    ).rowcount:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('appointment_changes', ?)", (after + 1,))
+
+
+def changes_since(conn, change_id, batch_size=500):
+    """Yield logged changes after ``change_id`` in order, reading in batches."""
+
+    while True:
+        rows = conn.execute(
+            "SELECT * FROM appointment_changes WHERE change_id > ? ORDER BY change_id LIMIT ?",
+            (change_id, batch_size),
+        ).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        change_id = rows[-1]["change_id"]
+
+
+class TooManySubscribers(RuntimeError):
+    """Raised when ``CHANGE_FEED_MAX_CLIENTS`` feeds are already open."""
+
+
+class Subscription:
+    def __init__(self, hub, filters):
+        self.hub = hub
+        self.filters = filters
+        self.events = queue.SimpleQueue()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class ChangeHub:
+    """Fans new ``appointment_changes`` rows out to the open feeds of one process."""
+
+    def __init__(self, db_path=DB_PATH, poll_seconds=DEFAULT_CHANGE_FEED_POLL_SECONDS,
+                 max_subscribers=DEFAULT_CHANGE_FEED_MAX_CLIENTS):
+        self.db_path = db_path
+        self.poll_seconds = float(poll_seconds)
+        self.max_subscribers = int(max_subscribers)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_id = 0
+
+    def subscribe(self, conn, filters):
+        """Start receiving changes committed after this call.
+
+        ``conn`` is only used to find the current end of the log when the
+        watcher thread has to be started.
+        """
+
+        subscription = Subscription(self, filters)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers(f"at most {self.max_subscribers} change feeds per process")
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._last_id = last_change_id(conn)
+                self._thread = threading.Thread(target=self._watch, name="change-hub", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _watch(self):
+        conn = connect(self.db_path)
+        try:
+            version = None
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        return
+                # Changes whenever another connection commits; costs no I/O otherwise.
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current != version:
+                    version = current
+                    self._publish(changes_since(conn, self._last_id))
+                time.sleep(self.poll_seconds)
+        finally:
+            conn.close()
+
+    def _publish(self, rows):
+        for row in rows:
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                if matches(row, subscription.filters):
+                    subscription.events.put(row)
+            self._last_id = row["change_id"]
+
+
+def prune(conn, keep_days, now=None):
+    """Delete changes older than ``keep_days`` days; the caller commits."""
+
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=keep_days)
+    # The newest row always stays: resuming clients compare their last id
+    # with the oldest one left to tell whether they missed anything.
+    return conn.execute(
+        """
+        DELETE FROM appointment_changes
+        WHERE changed_at < ? AND change_id < (SELECT MAX(change_id) FROM appointment_changes)
+        """,
+        (cutoff.strftime("%Y-%m-%d %H:%M:%S"),),
+    ).rowcount
+
+
+def get_hub():
+    return current_app.extensions["change_hub"]
+
+
+def init_app(app):
+    app.config.setdefault("CHANGE_FEED_POLL_SECONDS", DEFAULT_CHANGE_FEED_POLL_SECONDS)
+    app.config.setdefault("CHANGE_FEED_HEARTBEAT_SECONDS", DEFAULT_CHANGE_FEED_HEARTBEAT_SECONDS)
+    app.config.setdefault("CHANGE_FEED_MAX_CLIENTS", DEFAULT_CHANGE_FEED_MAX_CLIENTS)
+    app.extensions["change_hub"] = ChangeHub(
+        app.config.get("DB_PATH", DB_PATH),
+        poll_seconds=float(app.config["CHANGE_FEED_POLL_SECONDS"]),
+        max_subscribers=int(app.config["CHANGE_FEED_MAX_CLIENTS"]),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or prune the appointment change log.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--prune-days", type=int, help="delete changes older than this many days")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        if args.prune_days is not None:
+            with conn:
+                print(f"pruned {prune(conn, args.prune_days)} changes")
+        first, last = first_change_id(conn), last_change_id(conn)
+        print(f"appointment_changes: ids {first or 0}..{last}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,283 @@
 import os
+import queue
+import random
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # backend/
 PROJECT_ROOT = os.path.dirname(BASE_DIR)              # project root
 DB_PATH = os.path.join(PROJECT_ROOT, "hospital.db")
 
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 5.0  # seconds a request waits for a free connection
+# After busy_timeout runs out, taking a write lock is retried for up to this
+# long, sleeping a jittered, doubling backoff (capped) in between.
+DEFAULT_BUSY_RETRY_SECONDS = 10.0
+DEFAULT_BUSY_BACKOFF_SECONDS = 0.001
+DEFAULT_BUSY_BACKOFF_CAP_SECONDS = 0.025
 
-def get_db_connection():
-    """Create a SQLite connection with foreign key support enabled."""
+# Applied once when a connection is opened, never per request.
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -16000;",      # negative = KiB, ~16 MB page cache
+    "PRAGMA mmap_size = 268435456;",    # 256 MB memory-mapped I/O
+    "PRAGMA busy_timeout = 5000;",      # ms
+    "PRAGMA temp_store = MEMORY;",
+    # Readers in other processes can hold a checkpoint back and let the WAL
+    # grow; it is cut back to 64 MB once a checkpoint gets through.
+    "PRAGMA journal_size_limit = 67108864;",
+)
+
+
+def connect(path=DB_PATH, check_same_thread=True, factory=sqlite3.Connection):
+    """Open a SQLite connection with row access by name and the tuned pragmas."""
 
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread, factory=factory)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
+
+
+def is_busy(error) -> bool:
+    """Whether ``error`` is a transient SQLITE_BUSY / SQLITE_LOCKED."""
+
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def retry_busy(operation, timeout=DEFAULT_BUSY_RETRY_SECONDS, backoff=DEFAULT_BUSY_BACKOFF_SECONDS,
+               on_retry=None):
+    """Call ``operation()``, retrying it for ``timeout`` seconds while the database is busy.
+
+    The sleeps are jittered so processes that collided do not retry in step.
+    ``on_retry`` is called before each retry.
+    """
+
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            return operation()
+        except sqlite3.OperationalError as error:
+            if not is_busy(error) or time.monotonic() >= deadline:
+                raise
+        if on_retry is not None:
+            on_retry()
+        delay = min(backoff * 2**attempt, DEFAULT_BUSY_BACKOFF_CAP_SECONDS)
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
+@contextmanager
+def write_transaction(conn, on_retry=None):
+    """Run a read-check-write sequence under SQLite's write lock.
+
+    ``BEGIN IMMEDIATE`` takes the lock up front, so no other writer can slip
+    in between the check and the write; commits on success, rolls back if the
+    block raises. Taking the lock and committing are retried while the
+    database is busy.
+    """
+
+    retry_busy(lambda: conn.execute("BEGIN IMMEDIATE"), on_retry=on_retry)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    retry_busy(conn.commit, on_retry=on_retry)
+
+
+@contextmanager
+def read_snapshot(conn):
+    """Run several SELECTs against one consistent view of the database.
+
+    In WAL mode a deferred transaction keeps the snapshot of its first read
+    until it ends, so writes committed in between stay invisible. Inside an
+    enclosing snapshot (e.g. a ``/batch``) the reads simply join it.
+    """
+
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.commit()
+
+
+def get_db_connection():
+    """Create a standalone SQLite connection (for scripts and CLI tools).
+
+    Request handlers should use ``get_db()`` so they reuse pooled connections.
+    """
+
+    return connect(DB_PATH)
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """Bounded pool of warm SQLite connections shared by the threads of one worker.
+
+    Connections are created lazily up to ``size``; once that many exist a
+    checkout waits up to ``timeout`` seconds for one to be returned. ``setup``,
+    if given, is called with every new connection (e.g. to attach databases).
+    """
+
+    def __init__(self, path=DB_PATH, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 factory=sqlite3.Connection, setup=None):
+        self.path = path
+        self.factory = factory
+        self.setup = setup
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "timeouts": 0, "wait_seconds": 0.0}
+
+    def _check_fork(self):
+        # Connections must not cross a fork; a child process starts with an empty pool.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            with self._lock:
+                self._stats["hits"] += 1
+            return conn
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+                self._stats["misses"] += 1
+        if can_create:
+            try:
+                conn = connect(self.path, check_same_thread=False, factory=self.factory)
+                if self.setup is not None:
+                    try:
+                        self.setup(conn)
+                    except Exception:
+                        conn.close()
+                        raise
+                return conn
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"no database connection available after {self.timeout}s")
+        with self._lock:
+            self._stats["waits"] += 1
+            self._stats["wait_seconds"] += time.perf_counter() - started
+        return conn
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped and replaced on a later checkout.
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def warm(self, count=None):
+        """Open up to ``count`` connections ahead of the first request."""
+
+        conns = [self.acquire() for _ in range(min(count or self.size, self.size))]
+        for conn in conns:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["wait_seconds"] = round(snapshot["wait_seconds"], 6)
+            snapshot["size"] = self.size
+            snapshot["open"] = self._created
+        snapshot["idle"] = self._idle.qsize()
+        snapshot["in_use"] = snapshot["open"] - snapshot["idle"]
+        return snapshot
+
+
+def init_app(app):
+    """Attach a connection pool to ``app`` and return connections on teardown."""
+
+    app.config.setdefault("DB_PATH", DB_PATH)
+    app.config.setdefault("DB_POOL_SIZE", DEFAULT_POOL_SIZE)
+    app.config.setdefault("DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)
+    app.config.setdefault("DB_CONNECTION_FACTORY", sqlite3.Connection)
+    app.config.setdefault("DB_CONNECTION_SETUP", None)
+    app.extensions["db_pool"] = ConnectionPool(
+        app.config["DB_PATH"],
+        size=app.config["DB_POOL_SIZE"],
+        timeout=app.config["DB_POOL_TIMEOUT"],
+        factory=app.config["DB_CONNECTION_FACTORY"],
+        setup=app.config["DB_CONNECTION_SETUP"],
+    )
+    app.teardown_appcontext(close_db)
+
+
+def get_pool():
+    return current_app.extensions["db_pool"]
+
+
+def get_db():
+    """Return the connection checked out for the current app context."""
+
+    if "db" not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        get_pool().release(conn)
@@ -0,0 +1,165 @@
+"""Change versions and conditional GETs.
+
+``change_versions`` holds one counter per *scope*: a table (``"doctors"``) or
+the data hanging off one patient or doctor (``"patient:42"``, ``"doctor:7"``:
+the row itself plus its appointments, treatments and bills). Triggers bump
+the counters in the same transaction as every insert, update and delete, so
+they can never lag behind the data.
+
+GET views decorated with ``@conditional(...)`` name the scopes they read. Their
+ETag hashes the request with those counters, so a matching ``If-None-Match``
+is answered ``304 Not Modified`` after a single primary-key lookup, without
+running the view. Tools that rewrite tables with the triggers dropped (the
+bulk loaders) call ``new_epoch`` afterwards, which invalidates every ETag.
+"""
+
+import hashlib
+from datetime import date
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from backend.db import get_db
+from backend.utils import stream_format
+
+EPOCH = "epoch"
+VERSIONED_TABLES = ("patients", "doctors", "appointments", "treatments", "billing")
+
+# table -> queries yielding the entity scopes a changed row belongs to.
+# ``{row}`` is ``new`` or ``old``.
+ROW_SCOPES = {
+    "patients": ("SELECT 'patient:' || {row}.patient_id AS scope",),
+    "doctors": ("SELECT 'doctor:' || {row}.doctor_id AS scope",),
+    "appointments": (
+        "SELECT 'patient:' || {row}.patient_id AS scope",
+        "SELECT 'doctor:' || {row}.doctor_id AS scope",
+    ),
+    "treatments": (
+        """
+        SELECT 'patient:' || patient_id AS scope FROM appointments WHERE appointment_id = {row}.appointment_id
+        UNION ALL
+        SELECT 'doctor:' || doctor_id FROM appointments WHERE appointment_id = {row}.appointment_id
+        """,
+    ),
+    "billing": ("SELECT 'patient:' || {row}.patient_id AS scope",),
+}
+
+# Updates that other entities' views show: a patient's name and contact
+# details appear in the schedules of every doctor they have seen.
+UPDATE_FANOUT = {
+    "patients": (
+        "SELECT DISTINCT 'doctor:' || doctor_id AS scope FROM appointments WHERE patient_id = new.patient_id",
+    ),
+}
+
+CREATE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS change_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    # Random, so a recreated database never reproduces the ETags of the old one.
+    "INSERT OR IGNORE INTO change_versions (scope, version) VALUES ('epoch', ABS(RANDOM()))",
+)
+
+
+def _bump_sql(sources) -> str:
+    # The WHERE clause is also what lets SQLite parse INSERT ... SELECT ... ON CONFLICT.
+    return f"""
+        INSERT INTO change_versions (scope, version)
+        SELECT scope, 1 FROM ({" UNION ALL ".join(sources)})
+        WHERE scope IS NOT NULL
+        ON CONFLICT (scope) DO UPDATE SET version = version + 1;
+    """
+
+
+def create_triggers(conn) -> None:
+    """(Re)create the triggers that bump the change versions."""
+
+    for table in VERSIONED_TABLES:
+        table_scope = f"SELECT '{table}' AS scope"
+        rows = {
+            "insert": [source.format(row="new") for source in ROW_SCOPES[table]],
+            "delete": [source.format(row="old") for source in ROW_SCOPES[table]],
+            "update": [
+                *(source.format(row="old") for source in ROW_SCOPES[table]),
+                *(source.format(row="new") for source in ROW_SCOPES[table]),
+                *UPDATE_FANOUT.get(table, ()),
+            ],
+        }
+        for event, sources in rows.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_versions_{event}")
+            conn.execute(
+                f"CREATE TRIGGER {table}_versions_{event} AFTER {event.upper()} ON {table} "
+                f"BEGIN {_bump_sql([table_scope, *sources])} END"
+            )
+
+
+def new_epoch(conn) -> None:
+    """Invalidate every ETag, after changes made with the triggers dropped.
+
+    The caller commits.
+    """
+
+    conn.execute(
+        """
+        INSERT INTO change_versions (scope, version) VALUES ('epoch', ABS(RANDOM()))
+        ON CONFLICT (scope) DO UPDATE SET version = excluded.version
+        """
+    )
+
+
+def versions(conn, scopes):
+    """Current version of each scope (0 if it never changed), epoch first."""
+
+    keys = [EPOCH, *scopes]
+    rows = conn.execute(
+        f"SELECT scope, version FROM change_versions WHERE scope IN ({', '.join('?' * len(keys))})",
+        keys,
+    )
+    found = {row["scope"]: row["version"] for row in rows}
+    return [found.get(key, 0) for key in keys]
+
+
+def current_etag(conn, scopes) -> str:
+    """ETag of the current request's response given the versions of ``scopes``.
+
+    Read before the view queries, so the body is never older than its tag. The
+    date is included because some views default to "today".
+    """
+
+    parts = [request.full_path, stream_format() or "", date.today().isoformat()]
+    parts += [str(version) for version in versions(conn, scopes)]
+    return hashlib.sha1("\0".join(parts).encode()).hexdigest()[:24]
+
+
+def conditional(*scopes):
+    """Tag the view's 200 responses and answer matching ``If-None-Match`` with 304.
+
+    ``scopes`` are formatted with the view arguments, e.g. ``"patient:{patient_id}"``.
+    ``ETAGS_ENABLED = False`` turns this off.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not current_app.config.get("ETAGS_ENABLED", True):
+                return view(**kwargs)
+
+            tag = current_etag(get_db(), [scope.format(**kwargs) for scope in scopes])
+            if request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak: the body is equivalent, not necessarily byte-identical.
+            response.set_etag(tag, weak=True)
+            # Cacheable, but revalidated on every use.
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
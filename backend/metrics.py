@@ -0,0 +1,383 @@
+"""Per-endpoint request and SQL metrics, exported at ``/metrics``.
+
+For every Flask endpoint this records a latency histogram, the number of SQL
+statements run, the time spent inside SQLite, rows fetched and response
+bytes, in Prometheus text format. Pooled connections are created with
+``InstrumentedConnection`` so statements are counted where they run; the
+totals of one request are folded into the registry once, at teardown.
+
+``METRICS_ENABLED = False`` (``HOSPITAL_METRICS_ENABLED=false``) turns all of it
+off at startup: no hooks, plain connections and no ``/metrics`` route.
+Counters are per process; with several workers, scrape each one.
+"""
+
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import Response, current_app, g, request
+
+from backend import slowlog
+from backend.db import get_pool
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, as in the Prometheus client defaults.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# [statements, seconds, rows] of the SQL run by the current request, if tracked.
+_request_sql = ContextVar("request_sql", default=None)
+
+
+def _record(seconds, statements=0, rows=0):
+    totals = _request_sql.get()
+    if totals is not None:
+        totals[0] += statements
+        totals[1] += seconds
+        totals[2] += rows
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that charges its statements, SQLite time and rows to the request.
+
+    Each statement is also timed from ``execute`` to its last fetched row and
+    handed to the slow-query log if it took longer than the threshold.
+    """
+
+    _statement = None  # (sql, parameters, executemany row count) being read
+    _elapsed = 0.0
+
+    def _start(self, sql, parameters, many, elapsed):
+        self._statement = (sql, parameters, many)
+        self._elapsed = elapsed
+        _record(elapsed, statements=1)
+        if self.description is None:
+            # No result set (writes, DDL): the statement is complete.
+            self._finish()
+
+    def _fetched(self, elapsed, rows, done):
+        self._elapsed += elapsed
+        _record(elapsed, rows=rows)
+        if done:
+            self._finish()
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        log = slowlog.current()
+        if log is not None and self._elapsed >= log.threshold:
+            sql, parameters, many = statement
+            log.record(sql, parameters, self._elapsed, many=many)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error:
+            _record(time.perf_counter() - started, statements=1)
+            raise
+        self._start(sql, parameters, 0, time.perf_counter() - started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error:
+            _record(time.perf_counter() - started, statements=1)
+            raise
+        self._start(sql, seq_of_parameters, len(seq_of_parameters), time.perf_counter() - started)
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(time.perf_counter() - started, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(time.perf_counter() - started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(time.perf_counter() - started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(time.perf_counter() - started, 0, True)
+            raise
+        self._fetched(time.perf_counter() - started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Single-row lookups are rarely read to the end; they finish here.
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including ``conn.execute``'s) are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(LATENCY_BUCKETS, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self):
+        snapshot = Histogram()
+        snapshot.counts = list(self.counts)
+        snapshot.count = self.count
+        snapshot.sum = self.sum
+        return snapshot
+
+
+class EndpointStats:
+    __slots__ = ("latency", "statements", "sql_seconds", "rows", "response_bytes")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.response_bytes = 0
+
+
+class Registry:
+    """Metrics of one process, updated once per request under a single lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.responses = {}  # (endpoint, method, status) -> count
+
+    def observe(self, endpoint, method, status, seconds, sql, response_bytes):
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(seconds)
+            stats.statements += sql[0]
+            stats.sql_seconds += sql[1]
+            stats.rows += sql[2]
+            stats.response_bytes += response_bytes
+            key = (endpoint, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def totals(self):
+        """``(requests, seconds)`` handled so far, over all endpoints."""
+
+        with self._lock:
+            stats = self.endpoints.values()
+            return sum(s.latency.count for s in stats), sum(s.latency.sum for s in stats)
+
+    def render(self, pool_stats=None, cache_stats=None, write_stats=None):
+        with self._lock:
+            endpoints = {name: _copy(stats) for name, stats in self.endpoints.items()}
+            responses = dict(self.responses)
+
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("hospital_http_requests_total", "counter", "Requests handled, by endpoint, method and status.")
+        for (endpoint, method, status), count in sorted(responses.items()):
+            lines.append(
+                f'hospital_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+            )
+
+        family("hospital_http_request_duration_seconds", "histogram", "Request latency, including streamed bodies.")
+        for endpoint, stats in sorted(endpoints.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.latency.counts):
+                cumulative += count
+                lines.append(
+                    f'hospital_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}'
+                )
+            label = f'{{endpoint="{endpoint}"}}'
+            lines.append(f'hospital_http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} '
+                         f"{stats.latency.count}")
+            lines.append(f"hospital_http_request_duration_seconds_sum{label} {stats.latency.sum:.6f}")
+            lines.append(f"hospital_http_request_duration_seconds_count{label} {stats.latency.count}")
+
+        for name, attribute, help_text in (
+            ("hospital_sql_statements_total", "statements", "SQL statements executed."),
+            ("hospital_sql_seconds_total", "sql_seconds", "Time spent executing statements and fetching rows."),
+            ("hospital_sql_rows_total", "rows", "Rows fetched from SQLite."),
+            ("hospital_http_response_bytes_total", "response_bytes", "Response body bytes sent."),
+        ):
+            family(name, "counter", help_text)
+            for endpoint, stats in sorted(endpoints.items()):
+                value = getattr(stats, attribute)
+                value = f"{value:.6f}" if isinstance(value, float) else value
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        if pool_stats:
+            family("hospital_db_pool_connections", "gauge", "Pooled SQLite connections by state.")
+            for state in ("open", "idle", "in_use"):
+                lines.append(f'hospital_db_pool_connections{{state="{state}"}} {pool_stats[state]}')
+            family("hospital_db_pool_checkouts_total", "counter", "Connection checkouts by outcome.")
+            for outcome in ("hits", "misses", "waits", "timeouts"):
+                lines.append(f'hospital_db_pool_checkouts_total{{outcome="{outcome}"}} {pool_stats[outcome]}')
+            family("hospital_db_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection.")
+            lines.append(f"hospital_db_pool_wait_seconds_total {pool_stats['wait_seconds']}")
+        if cache_stats:
+            family("hospital_cache_lookups_total", "counter", "Read-through cache lookups by cache and result.")
+            for name, stats in sorted(cache_stats["caches"].items()):
+                for result in ("hits", "misses"):
+                    lines.append(f'hospital_cache_lookups_total{{cache="{name}",result="{result}"}} {stats[result]}')
+            family("hospital_cache_entries", "gauge", "Entries held by each read-through cache.")
+            for name, stats in sorted(cache_stats["caches"].items()):
+                lines.append(f'hospital_cache_entries{{cache="{name}"}} {stats["size"]}')
+        if write_stats:
+            family("hospital_write_queue_depth", "gauge", "Writes waiting for the writer thread.")
+            lines.append(f"hospital_write_queue_depth {write_stats['depth']}")
+            family("hospital_write_jobs_total", "counter", "Writes run by the writer thread, by outcome.")
+            lines.append(f'hospital_write_jobs_total{{outcome="committed"}} {write_stats["jobs"] - write_stats["failed"]}')
+            lines.append(f'hospital_write_jobs_total{{outcome="failed"}} {write_stats["failed"]}')
+            family("hospital_write_transactions_total", "counter", "Write transactions (groups of writes) committed.")
+            lines.append(f"hospital_write_transactions_total {write_stats['transactions']}")
+            family("hospital_write_busy_retries_total", "counter", "Retries after SQLite reported the database busy.")
+            lines.append(f"hospital_write_busy_retries_total {write_stats['busy_retries']}")
+            for name, key, help_text in (
+                ("hospital_write_commit_duration_seconds", "commit_seconds",
+                 "Write transaction time, from taking the write lock to the commit."),
+                ("hospital_write_wait_duration_seconds", "wait_seconds", "Time from queueing a write to its commit."),
+            ):
+                family(name, "histogram", help_text)
+                histogram = write_stats[key]
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum {histogram.sum:.6f}")
+                lines.append(f"{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _copy(stats):
+    snapshot = EndpointStats()
+    snapshot.latency = stats.latency.copy()
+    snapshot.statements = stats.statements
+    snapshot.sql_seconds = stats.sql_seconds
+    snapshot.rows = stats.rows
+    snapshot.response_bytes = stats.response_bytes
+    return snapshot
+
+
+def _record_when_sent(chunks, finish):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        finish(sent)
+
+
+def get_registry():
+    return current_app.extensions.get("metrics")
+
+
+def init_app(app):
+    """Install the hooks and ``/metrics`` unless ``METRICS_ENABLED`` is false.
+
+    Call before ``db.init_app`` so the pool opens instrumented connections.
+    """
+
+    app.config.setdefault("METRICS_ENABLED", True)
+    if not app.config["METRICS_ENABLED"]:
+        return
+    registry = app.extensions["metrics"] = Registry()
+    app.config.setdefault("DB_CONNECTION_FACTORY", InstrumentedConnection)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql = [0, 0.0, 0]
+        _request_sql.set(g.metrics_sql)
+
+    def finisher(status):
+        endpoint, method = request.endpoint or "unmatched", request.method
+        started, sql = g.pop("metrics_started"), g.pop("metrics_sql")
+
+        def finish(response_bytes):
+            _request_sql.set(None)
+            registry.observe(endpoint, method, status, time.perf_counter() - started, sql, response_bytes)
+
+        return finish
+
+    @app.after_request
+    def count_response(response):
+        if "metrics_started" not in g:
+            return response
+        finish = finisher(response.status_code)
+        if response.is_streamed:
+            # The body is produced after teardown; record once the last chunk is out.
+            response.response = _record_when_sent(response.response, finish)
+        else:
+            finish(response.calculate_content_length() or 0)
+        return response
+
+    @app.teardown_request
+    def record_failure(exc=None):
+        # Only requests that never reached after_request (unhandled errors) are left.
+        if "metrics_started" in g:
+            finisher(500)(0)
+
+    @app.route("/metrics")
+    def metrics():
+        read_cache = app.extensions.get("cache")
+        write_queue = app.extensions.get("write_queue")
+        return Response(
+            registry.render(
+                get_pool().stats(),
+                read_cache.stats() if read_cache else None,
+                write_queue.stats() if write_queue else None,
+            ),
+            content_type=CONTENT_TYPE,
+        )
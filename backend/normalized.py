@@ -0,0 +1,94 @@
+"""Integer columns derived from the date, time and status text.
+
+The API reads and writes ``appointment_date`` / ``appointment_time``,
+``treatment_date`` and ``bill_date`` as text and keeps ``status`` and
+``payment_status`` in whatever case they were written ('Scheduled' from the
+CSVs, 'scheduled' from the API). Migration 11 adds virtual generated columns
+beside them and indexes those instead:
+
+* ``appointments.starts_at``, ``treatments.treated_at``, ``billing.billed_at``:
+  seconds since the epoch, the wall-clock time read as UTC (0 when the text
+  is not a date), so a date range is one integer range on one index;
+* ``appointments.status_code``, ``billing.payment_code``: the small integers
+  below (``OTHER_STATUS`` for anything else), so status filters need no
+  ``LOWER()`` and can lead an index.
+
+SQLite computes them from the text on every write, bulk loads included, so
+nothing has to keep them in step. They are not part of the JSON: views select
+``api_columns(...)`` rather than ``*``.
+"""
+
+import calendar
+from datetime import date
+
+OTHER_STATUS = 0
+APPOINTMENT_STATUSES = {"scheduled": 1, "completed": 2, "cancelled": 3, "no-show": 4, "rescheduled": 5}
+PAYMENT_STATUSES = {"unpaid": 1, "pending": 2, "paid": 3, "failed": 4}
+
+# The columns the API returns, in table order.
+API_COLUMNS = {
+    "appointments": (
+        "appointment_id",
+        "patient_id",
+        "doctor_id",
+        "appointment_date",
+        "appointment_time",
+        "reason_for_visit",
+        "status",
+    ),
+    "treatments": ("treatment_id", "appointment_id", "treatment_type", "description", "cost", "treatment_date"),
+    "billing": ("bill_id", "patient_id", "treatment_id", "bill_date", "amount", "payment_method", "payment_status"),
+}
+
+
+def _code_sql(column, codes):
+    cases = " ".join(f"WHEN '{name}' THEN {code}" for name, code in codes.items())
+    return f"CASE LOWER({column}) {cases} ELSE {OTHER_STATUS} END"
+
+
+def _epoch_sql(column):
+    return f"IFNULL(CAST(strftime('%s', {column}) AS INTEGER), 0)"
+
+
+# Hours and minutes are read the way ``availability.to_minutes`` reads them,
+# so '9:30' and '09:30:00' both work.
+_STARTS_AT_SQL = (
+    "IFNULL(CAST(strftime('%s', appointment_date) AS INTEGER)"
+    " + 3600 * CAST(appointment_time AS INTEGER)"
+    " + 60 * CAST(substr(appointment_time, instr(appointment_time, ':') + 1, 2) AS INTEGER), 0)"
+)
+
+GENERATED_COLUMNS = {
+    "appointments": (
+        ("starts_at", _STARTS_AT_SQL),
+        ("status_code", _code_sql("status", APPOINTMENT_STATUSES)),
+    ),
+    "treatments": (("treated_at", _epoch_sql("treatment_date")),),
+    "billing": (
+        ("billed_at", _epoch_sql("bill_date")),
+        ("payment_code", _code_sql("payment_status", PAYMENT_STATUSES)),
+    ),
+}
+
+
+def add_columns(conn) -> None:
+    """Add the generated columns that are missing (migration step)."""
+
+    for table, columns in GENERATED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+        for name, expr in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} INTEGER GENERATED ALWAYS AS ({expr}) VIRTUAL")
+
+
+def api_columns(table, alias=None) -> str:
+    """``table``'s API columns for a select list, qualified with ``alias``."""
+
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(f"{prefix}{column}" for column in API_COLUMNS[table])
+
+
+def day_start(day: date) -> int:
+    """``starts_at`` / ``treated_at`` / ``billed_at`` value of midnight on ``day``."""
+
+    return calendar.timegm(day.timetuple())
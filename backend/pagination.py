@@ -0,0 +1,245 @@
+"""Server-side filtering, sorting and keyset pagination for list endpoints.
+
+A list route describes its query once (columns, FROM clause, filters and sort
+keys) and ``list_rows`` turns the request's query string into SQL. Without
+``limit``/``cursor`` the full filtered list is returned as before (streamed
+when requested, see ``backend.utils.rows_response``); with them the response
+is a page ``{"items", "next_cursor", "total"}`` where ``total`` is only
+computed for the first page.
+"""
+
+import base64
+import json
+from datetime import date, timedelta
+
+from flask import jsonify
+
+from backend.normalized import day_start
+from backend.utils import row_to_dict, rows_response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class QueryError(ValueError):
+    """Invalid filter, sort or cursor parameter; reported to the client as 400."""
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise QueryError("invalid cursor")
+    if not isinstance(values, list):
+        raise QueryError("invalid cursor")
+    return values
+
+
+def _int_arg(name, value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"{name} must be an integer")
+
+
+def _float_arg(name, value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"{name} must be a number")
+
+
+def _date_arg(name, value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise QueryError(f"{name} must be a YYYY-MM-DD date")
+
+
+def page_limit(args):
+    """The requested page size, clamped to ``1..MAX_PAGE_SIZE``."""
+
+    limit = _int_arg("limit", args.get("limit", DEFAULT_PAGE_SIZE))
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _years_ago(years):
+    today = date.today()
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:  # 29 February
+        return today.replace(year=today.year - years, day=28)
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_filters(args, filters):
+    """Translate query parameters into WHERE clauses.
+
+    ``filters`` maps a parameter name to ``(kind, sql)``. Kinds:
+    ``eq`` / ``int`` exact match, ``contains`` case-insensitive substring,
+    ``name`` substring of ``first || ' ' || last`` (``sql`` is a pair),
+    ``gte`` / ``lte`` numeric bounds, ``after`` / ``before`` inclusive text
+    bounds (e.g. ``HH:MM`` times), ``from`` / ``to`` inclusive date bounds,
+    ``day`` a single calendar day, ``age_gte`` / ``age_lte`` bounds on an age
+    computed from a date-of-birth column, ``since`` / ``until`` inclusive date
+    bounds on an epoch-seconds column, ``code`` a status name looked up in a
+    ``{name: code}`` table (``sql`` is ``(column, codes)``).
+    """
+
+    clauses = []
+    params = []
+    for name, (kind, sql) in filters.items():
+        value = args.get(name)
+        if value is None or value == "":
+            continue
+        if kind == "eq":
+            clauses.append(f"{sql} = ?")
+            params.append(value)
+        elif kind == "int":
+            clauses.append(f"{sql} = ?")
+            params.append(_int_arg(name, value))
+        elif kind == "contains":
+            clauses.append(f"{sql} LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(value)}%")
+        elif kind == "name":
+            first, last = sql
+            clauses.append(f"(IFNULL({first}, '') || ' ' || IFNULL({last}, '')) LIKE ? ESCAPE '\\'")
+            params.append(f"%{_escape_like(value)}%")
+        elif kind == "gte":
+            clauses.append(f"{sql} >= ?")
+            params.append(_float_arg(name, value))
+        elif kind == "lte":
+            clauses.append(f"{sql} <= ?")
+            params.append(_float_arg(name, value))
+        elif kind == "after":
+            clauses.append(f"{sql} >= ?")
+            params.append(value)
+        elif kind == "before":
+            clauses.append(f"{sql} <= ?")
+            params.append(value)
+        elif kind == "from":
+            clauses.append(f"{sql} >= ?")
+            params.append(_date_arg(name, value).isoformat())
+        elif kind == "to":
+            # Timestamps such as '2024-06-01 10:00:00' still fall on the day.
+            clauses.append(f"{sql} < ?")
+            params.append((_date_arg(name, value) + timedelta(days=1)).isoformat())
+        elif kind == "day":
+            day = _date_arg(name, value)
+            clauses.append(f"{sql} >= ? AND {sql} < ?")
+            params.extend([day.isoformat(), (day + timedelta(days=1)).isoformat()])
+        elif kind == "since":
+            clauses.append(f"{sql} >= ?")
+            params.append(day_start(_date_arg(name, value)))
+        elif kind == "until":
+            clauses.append(f"{sql} < ?")
+            params.append(day_start(_date_arg(name, value) + timedelta(days=1)))
+        elif kind == "code":
+            column, codes = sql
+            if value.lower() not in codes:
+                raise QueryError(f"{name} must be one of: {', '.join(codes)}")
+            clauses.append(f"{column} = ?")
+            params.append(codes[value.lower()])
+        elif kind == "age_gte":
+            clauses.append(f"{sql} <= ?")
+            params.append(_years_ago(_int_arg(name, value)).isoformat())
+        elif kind == "age_lte":
+            clauses.append(f"{sql} > ?")
+            params.append(_years_ago(_int_arg(name, value) + 1).isoformat())
+        else:
+            raise ValueError(f"unknown filter kind {kind!r}")
+    return clauses, params
+
+
+def _resolve_sort(args, sort_keys, default_sort):
+    sort = args.get("sort") or default_sort[0]
+    order = (args.get("order") or default_sort[1]).lower()
+    if sort not in sort_keys:
+        raise QueryError(f"sort must be one of: {', '.join(sort_keys)}")
+    if order not in ("asc", "desc"):
+        raise QueryError("order must be asc or desc")
+    return sort, order
+
+
+def list_rows(
+    conn, args, *, columns, from_clause, filters, sort_keys, default_sort, where=None, aggregates=None
+):
+    """Run a filtered, sorted list query and return the JSON response.
+
+    ``sort_keys`` maps a sort name to a tuple of SQL expressions whose last
+    element is unique (the primary key), so every row has a distinct keyset
+    position. Each tuple should be backed by an index for cheap paging.
+    ``aggregates`` maps extra names to SQL aggregates computed together with
+    ``total`` over the whole filtered set.
+    """
+
+    clauses, params = build_filters(args, filters)
+    if where:
+        clauses.insert(0, where[0])
+        params[:0] = where[1]
+    sort, order = _resolve_sort(args, sort_keys, default_sort)
+    keys = sort_keys[sort]
+    direction = "DESC" if order == "desc" else "ASC"
+    order_by = ", ".join(f"{key} {direction}" for key in keys)
+
+    paged = "limit" in args or "cursor" in args
+    if not paged:
+        where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = conn.execute(
+            f"SELECT {columns} FROM {from_clause} {where_sql} ORDER BY {order_by}", params
+        )
+        return rows_response(cursor)
+
+    limit = page_limit(args)
+
+    totals = {"total": None}
+    totals.update(dict.fromkeys(aggregates or {}))
+    cursor = args.get("cursor")
+    if not cursor:
+        where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        selects = ["COUNT(*) AS total"] + [f"{sql} AS {name}" for name, sql in (aggregates or {}).items()]
+        totals = row_to_dict(
+            conn.execute(f"SELECT {', '.join(selects)} FROM {from_clause} {where_sql}", params).fetchone()
+        )
+        page_clauses, page_params = clauses, params
+    else:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys) + 2 or values[:2] != [sort, order]:
+            raise QueryError("cursor does not match sort order")
+        values = values[2:]
+        op = "<" if order == "desc" else ">"
+        # The leading-column bound lets SQLite seek the index; the row-value
+        # comparison then resolves ties exactly.
+        seek = f"{keys[0]} {op}= ? AND ({', '.join(keys)}) {op} ({', '.join('?' * len(keys))})"
+        page_clauses = clauses + [seek]
+        page_params = params + [values[0]] + values
+
+    where_sql = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ""
+    key_columns = ", ".join(f"{key} AS _k{i}" for i, key in enumerate(keys))
+    rows = conn.execute(
+        f"SELECT {columns}, {key_columns} FROM {from_clause} {where_sql} ORDER BY {order_by} LIMIT ?",
+        page_params + [limit + 1],
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([sort, order] + [last[f"_k{i}"] for i in range(len(keys))])
+
+    items = []
+    for row in rows:
+        item = row_to_dict(row)
+        for i in range(len(keys)):
+            del item[f"_k{i}"]
+        items.append(item)
+    return jsonify({"items": items, "next_cursor": next_cursor, **totals})
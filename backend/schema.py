@@ -0,0 +1,356 @@
+"""Single source of truth for the database schema.
+
+Migrations are numbered and applied in order; ``schema_version`` records the
+ones already applied, so starting the app on an up-to-date database costs a
+single lookup. Run ``python -m backend.schema`` to migrate without the app.
+"""
+
+import argparse
+import sqlite3
+
+from backend import changes, etag, normalized, stats
+from backend.db import DB_PATH, connect
+
+# Each migration is (version, description, steps). A step is a single SQL
+# statement or a callable taking the connection. All steps of one migration
+# run in one transaction together with its schema_version row.
+MIGRATIONS = [
+    (
+        1,
+        "base tables",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS doctors (
+                doctor_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                first_name TEXT NOT NULL,
+                last_name TEXT NOT NULL,
+                specialization TEXT,
+                phone_number TEXT,
+                years_experience INTEGER,
+                hospital_branch TEXT,
+                email TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS patients (
+                patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                first_name TEXT NOT NULL,
+                last_name TEXT NOT NULL,
+                gender TEXT,
+                date_of_birth TEXT,
+                contact_number TEXT,
+                address TEXT,
+                registration_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                insurance_provider TEXT,
+                insurance_number TEXT,
+                email TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS appointments (
+                appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER NOT NULL,
+                doctor_id INTEGER NOT NULL,
+                appointment_date TEXT NOT NULL,
+                appointment_time TEXT NOT NULL,
+                reason_for_visit TEXT,
+                status TEXT DEFAULT 'scheduled',
+                FOREIGN KEY(patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
+                FOREIGN KEY(doctor_id) REFERENCES doctors(doctor_id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS treatments (
+                treatment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                appointment_id INTEGER NOT NULL,
+                treatment_type TEXT,
+                description TEXT,
+                cost REAL,
+                treatment_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(appointment_id) REFERENCES appointments(appointment_id) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS billing (
+                bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER NOT NULL,
+                treatment_id INTEGER,
+                bill_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                amount REAL NOT NULL,
+                payment_method TEXT,
+                payment_status TEXT DEFAULT 'unpaid',
+                FOREIGN KEY(patient_id) REFERENCES patients(patient_id) ON DELETE CASCADE,
+                FOREIGN KEY(treatment_id) REFERENCES treatments(treatment_id) ON DELETE SET NULL
+            )
+            """,
+        ),
+    ),
+    (
+        2,
+        "secondary indexes from dataset/init_db.py",
+        (
+            "CREATE INDEX IF NOT EXISTS idx_appointment_date ON appointments(appointment_date)",
+            "CREATE INDEX IF NOT EXISTS idx_appointment_patient ON appointments(patient_id)",
+            "CREATE INDEX IF NOT EXISTS idx_billing_status ON billing(payment_status)",
+            "CREATE INDEX IF NOT EXISTS idx_doctor_name ON doctors(last_name, first_name)",
+        ),
+    ),
+    (
+        3,
+        "indexes backing admin list sort keys",
+        (
+            # Sort expressions must match backend/blueprints/admin.py exactly.
+            "CREATE INDEX IF NOT EXISTS idx_appointment_datetime ON appointments(appointment_date, appointment_time)",
+            "DROP INDEX IF EXISTS idx_appointment_date",
+            "CREATE INDEX IF NOT EXISTS idx_patient_name ON patients(last_name, first_name)",
+            "CREATE INDEX IF NOT EXISTS idx_patient_registration ON patients(IFNULL(registration_date, ''))",
+            "CREATE INDEX IF NOT EXISTS idx_patient_dob ON patients(IFNULL(date_of_birth, ''))",
+            "CREATE INDEX IF NOT EXISTS idx_billing_date ON billing(IFNULL(bill_date, ''))",
+            "CREATE INDEX IF NOT EXISTS idx_billing_amount ON billing(amount)",
+        ),
+    ),
+    (
+        4,
+        "FTS5 search over patients and doctors",
+        (
+            # External-content tables: the text lives in patients/doctors and
+            # the triggers below keep the inverted index in step with it.
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                first_name, last_name, email, contact_number, address, insurance_provider,
+                content='patients', content_rowid='patient_id'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+                INSERT INTO patients_fts (rowid, first_name, last_name, email, contact_number, address, insurance_provider)
+                VALUES (new.patient_id, new.first_name, new.last_name, new.email, new.contact_number, new.address,
+                        new.insurance_provider);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+                INSERT INTO patients_fts (patients_fts, rowid, first_name, last_name, email, contact_number, address,
+                                          insurance_provider)
+                VALUES ('delete', old.patient_id, old.first_name, old.last_name, old.email, old.contact_number,
+                        old.address, old.insurance_provider);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS patients_fts_update AFTER UPDATE ON patients BEGIN
+                INSERT INTO patients_fts (patients_fts, rowid, first_name, last_name, email, contact_number, address,
+                                          insurance_provider)
+                VALUES ('delete', old.patient_id, old.first_name, old.last_name, old.email, old.contact_number,
+                        old.address, old.insurance_provider);
+                INSERT INTO patients_fts (rowid, first_name, last_name, email, contact_number, address, insurance_provider)
+                VALUES (new.patient_id, new.first_name, new.last_name, new.email, new.contact_number, new.address,
+                        new.insurance_provider);
+            END
+            """,
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS doctors_fts USING fts5(
+                first_name, last_name, specialization, hospital_branch, email, phone_number,
+                content='doctors', content_rowid='doctor_id'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS doctors_fts_insert AFTER INSERT ON doctors BEGIN
+                INSERT INTO doctors_fts (rowid, first_name, last_name, specialization, hospital_branch, email, phone_number)
+                VALUES (new.doctor_id, new.first_name, new.last_name, new.specialization, new.hospital_branch, new.email,
+                        new.phone_number);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS doctors_fts_delete AFTER DELETE ON doctors BEGIN
+                INSERT INTO doctors_fts (doctors_fts, rowid, first_name, last_name, specialization, hospital_branch, email,
+                                         phone_number)
+                VALUES ('delete', old.doctor_id, old.first_name, old.last_name, old.specialization, old.hospital_branch,
+                        old.email, old.phone_number);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS doctors_fts_update AFTER UPDATE ON doctors BEGIN
+                INSERT INTO doctors_fts (doctors_fts, rowid, first_name, last_name, specialization, hospital_branch, email,
+                                         phone_number)
+                VALUES ('delete', old.doctor_id, old.first_name, old.last_name, old.specialization, old.hospital_branch,
+                        old.email, old.phone_number);
+                INSERT INTO doctors_fts (rowid, first_name, last_name, specialization, hospital_branch, email, phone_number)
+                VALUES (new.doctor_id, new.first_name, new.last_name, new.specialization, new.hospital_branch, new.email,
+                        new.phone_number);
+            END
+            """,
+            # Index rows that existed before this migration.
+            "INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')",
+            "INSERT INTO doctors_fts (doctors_fts) VALUES ('rebuild')",
+        ),
+    ),
+    (
+        5,
+        "materialized dashboard counters and daily rollups",
+        (*stats.CREATE_TABLES, stats.create_triggers, stats.rebuild),
+    ),
+    (
+        6,
+        "indexes for the doctor's patient history",
+        (
+            # Covers grouping a doctor's visits by patient and reading each
+            # patient's visits newest first without touching the table.
+            """
+            CREATE INDEX IF NOT EXISTS idx_appointment_doctor_patient
+            ON appointments(doctor_id, patient_id, appointment_date, appointment_time)
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_treatment_appointment ON treatments(appointment_id)",
+        ),
+    ),
+    (
+        7,
+        "index for doctor availability and double-booking checks",
+        (
+            """
+            CREATE INDEX IF NOT EXISTS idx_appointment_doctor_datetime
+            ON appointments(doctor_id, appointment_date, appointment_time)
+            """,
+        ),
+    ),
+    (
+        8,
+        "indexes proposed by the index advisor",
+        (
+            # A patient's bills, newest first, and the cascade when a patient is deleted.
+            "CREATE INDEX IF NOT EXISTS idx_billing_patient_bill_date ON billing(patient_id, bill_date)",
+            # ON DELETE SET NULL from treatments.
+            "CREATE INDEX IF NOT EXISTS idx_billing_treatment ON billing(treatment_id)",
+        ),
+    ),
+    (
+        9,
+        "change versions behind ETags",
+        (*etag.CREATE_TABLES, etag.create_triggers),
+    ),
+    (
+        10,
+        "appointment change log for the live feed",
+        (*changes.CREATE_TABLES, changes.create_triggers),
+    ),
+    (
+        11,
+        "integer start times and status codes",
+        (
+            normalized.add_columns,
+            # Replace the text-keyed indexes with ones on the generated columns;
+            # building them computes the columns for every existing row.
+            "CREATE INDEX IF NOT EXISTS idx_appointment_starts ON appointments(starts_at)",
+            "DROP INDEX IF EXISTS idx_appointment_datetime",
+            "CREATE INDEX IF NOT EXISTS idx_appointment_status_starts ON appointments(status_code, starts_at)",
+            "CREATE INDEX IF NOT EXISTS idx_appointment_patient_starts ON appointments(patient_id, starts_at)",
+            "DROP INDEX IF EXISTS idx_appointment_patient",
+            "CREATE INDEX IF NOT EXISTS idx_appointment_doctor_starts ON appointments(doctor_id, starts_at)",
+            "DROP INDEX IF EXISTS idx_appointment_doctor_datetime",
+            """
+            CREATE INDEX IF NOT EXISTS idx_appointment_doctor_patient_starts
+            ON appointments(doctor_id, patient_id, starts_at)
+            """,
+            "DROP INDEX IF EXISTS idx_appointment_doctor_patient",
+            "CREATE INDEX IF NOT EXISTS idx_billing_billed ON billing(billed_at)",
+            "DROP INDEX IF EXISTS idx_billing_date",
+            "CREATE INDEX IF NOT EXISTS idx_billing_payment_billed ON billing(payment_code, billed_at)",
+            "DROP INDEX IF EXISTS idx_billing_status",
+            "CREATE INDEX IF NOT EXISTS idx_billing_patient_billed ON billing(patient_id, billed_at)",
+            "DROP INDEX IF EXISTS idx_billing_patient_bill_date",
+        ),
+    ),
+    (
+        12,
+        "keep archiving out of the appointment change log",
+        (*changes.CREATE_TABLES, changes.create_triggers),
+    ),
+    (
+        13,
+        "keep archiving out of the dashboard counters",
+        # Databases archived before this lost the moved rows from the counters;
+        # `python -m backend.stats --rebuild` counts them again.
+        (stats.create_triggers,),
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = LATEST_VERSION) -> int:
+    """Apply pending migrations up to ``target`` and return the resulting version."""
+
+    version = current_version(conn)
+    if version >= target:
+        return version
+
+    for version, description, steps in MIGRATIONS:
+        if version > target:
+            break
+        # BEGIN IMMEDIATE takes the write lock, so concurrent workers starting
+        # together apply each migration exactly once.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return current_version(conn)
+
+
+def init_db(path: str = DB_PATH) -> int:
+    """Bring the database at ``path`` up to date; called once at process start."""
+
+    conn = connect(path)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply hospital database migrations.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--status", action="store_true", help="only print the current version")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        conn = connect(args.db)
+        version = current_version(conn)
+        conn.close()
+    else:
+        version = init_db(args.db)
+    print(f"{args.db}: schema version {version} (latest {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
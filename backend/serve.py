@@ -0,0 +1,400 @@
+"""Production server: pre-forked worker processes with a thread pool each.
+
+    python -m backend.serve --bind 0.0.0.0:5000 --workers 4 --threads 8
+
+``TERM`` stops gracefully and ``HUP`` replaces the workers; see the README.
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import select
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from backend import archive, schema
+from backend.db import DB_PATH, DEFAULT_POOL_SIZE, connect
+
+DEFAULT_BIND = "127.0.0.1:5000"
+DEFAULT_APP = "backend.app:create_app()"
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_THREADS = DEFAULT_POOL_SIZE  # one pooled connection per thread, no pool waits
+DEFAULT_GRACEFUL_TIMEOUT = 30.0
+DEFAULT_BACKLOG = 2048
+POLL_SECONDS = 0.5
+RESPAWN_DELAY_SECONDS = 1.0  # before replacing a worker that died right after starting
+KILL_DELAY_SECONDS = 2.0  # past --graceful-timeout, for a worker that has not exited
+
+logger = logging.getLogger(__name__)
+
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection: an idle keep-alive client would hold a thread.
+    protocol_version = "HTTP/1.0"
+
+
+class ThreadPoolServer(BaseWSGIServer):
+    """Serves a socket inherited from the master with at most ``threads`` requests at once."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, fd, threads):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.threads = max(1, int(threads))
+        self._slots = threading.BoundedSemaphore(self.threads)
+        self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="request")
+        self._stopping = threading.Event()
+
+    def serve(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ)
+        while not self._stopping.is_set():
+            # Only accept with a thread free, so waiting connections go to other workers.
+            if not self._slots.acquire(timeout=POLL_SECONDS):
+                continue
+            try:
+                if not selector.select(POLL_SECONDS):
+                    raise BlockingIOError
+                request, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                # Nothing waiting, or another worker accepted it first.
+                self._slots.release()
+                continue
+            except BaseException:
+                self._slots.release()
+                raise
+            self._executor.submit(self._handle, request, address)
+        selector.close()
+
+    def _handle(self, request, address):
+        try:
+            self.finish_request(request, address)
+        except Exception:
+            self.handle_error(request, address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def stop(self):
+        self._stopping.set()
+
+    def drain(self, timeout):
+        """Wait up to ``timeout`` seconds for the requests in flight; True if all finished."""
+
+        deadline = time.monotonic() + timeout
+        for _ in range(self.threads):
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                return False
+        return True
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(":")
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def load_app(spec):
+    """``module:attribute`` names an app; ``module:factory()`` one to call for it."""
+
+    module, _, attr = spec.partition(":")
+    attr = attr or "app"
+    if attr.endswith("()"):
+        return getattr(importlib.import_module(module), attr[:-2])()
+    return getattr(importlib.import_module(module), attr)
+
+
+def worker_environment(index, workers, threads):
+    """``HOSPITAL_*`` defaults for worker ``index``; variables already set win."""
+
+    defaults = {
+        "HOSPITAL_DB_AUTO_MIGRATE": "false",  # the master migrated before forking
+        "HOSPITAL_DB_POOL_SIZE": str(threads),
+    }
+    if workers > 1:
+        defaults["HOSPITAL_CACHE_SHARED"] = "true"
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # Each open change feed holds a thread; keep at least one for everything else.
+    feeds = int(os.environ.get("HOSPITAL_CHANGE_FEED_MAX_CLIENTS", threads // 2))
+    os.environ["HOSPITAL_CHANGE_FEED_MAX_CLIENTS"] = str(max(0, min(feeds, threads - 1)))
+    if index:
+        # Background jobs run in worker 0 only; the others just serve.
+        os.environ["HOSPITAL_ARCHIVE_INTERVAL_SECONDS"] = "0"
+        os.environ["HOSPITAL_BACKUP_INTERVAL_SECONDS"] = "0"
+
+
+def warm(app, threads):
+    """Open the worker's connections and start its background jobs before the first request."""
+
+    pool = app.extensions.get("db_pool")
+    if pool is not None:
+        pool.warm(threads)
+    write_queue = app.extensions.get("write_queue")
+    if write_queue is not None:
+        write_queue.warm()
+    for name in ("archive_worker", "backup_worker"):
+        if name in app.extensions:
+            app.extensions[name].ensure_running()
+
+
+def run_worker(listener, index, args, ready_fd):
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the master, which sends TERM
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    if not args.access_log:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    worker_environment(index, args.workers, args.threads)
+    app = load_app(args.app)
+    warm(app, args.threads)
+    host, port = parse_bind(args.bind)
+    server = ThreadPoolServer(host, port, app, listener.fileno(), args.threads)
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+
+    serving = threading.Thread(target=server.serve, name="accept", daemon=True)
+    serving.start()
+    while not stopping.wait(POLL_SECONDS):
+        if not serving.is_alive():
+            return 1
+    server.stop()
+    serving.join()
+    if not server.drain(args.graceful_timeout):
+        logger.warning("worker %s: requests still running after %ss", index, args.graceful_timeout)
+    return 0
+
+
+class Worker:
+    __slots__ = ("pid", "index", "ready_fd", "started", "ready")
+
+    def __init__(self, pid, index, ready_fd):
+        self.pid = pid
+        self.index = index
+        self.ready_fd = ready_fd
+        self.started = time.monotonic()
+        self.ready = False
+
+
+class Master:
+    """Forks the workers, replaces dead ones and handles TERM / INT / HUP."""
+
+    def __init__(self, args, listener):
+        self.args = args
+        self.listener = listener
+        self.workers = {}  # pid -> Worker serving now
+        self.retiring = {}  # pid -> deadline for workers sent TERM
+        self.pending = []  # workers of a reload that are not ready yet
+        self._signals = []
+        self._respawn_at = {}  # index -> earliest restart after a crash
+
+    def spawn(self, index):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read_fd)
+                for worker in (*self.workers.values(), *self.pending):
+                    if worker.ready_fd is not None:
+                        os.close(worker.ready_fd)
+                status = run_worker(self.listener, index, self.args, write_fd)
+            except BaseException:
+                logger.exception("worker %s failed", index)
+            finally:
+                logging.shutdown()
+                os._exit(status)
+        os.close(write_fd)
+        logger.info("worker %s started (pid %s)", index, pid)
+        return Worker(pid, index, read_fd)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        for index in range(self.args.workers):
+            worker = self.spawn(index)
+            self.workers[worker.pid] = worker
+
+        while True:
+            self._wait_ready()
+            self._reap()
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    self.stop()
+                    return 0
+            self._retire_overdue()
+            self._replace_missing()
+
+    def _wait_ready(self):
+        starting = {
+            worker.ready_fd: worker for worker in (*self.workers.values(), *self.pending) if worker.ready_fd is not None
+        }
+        try:
+            readable, _, _ = select.select(list(starting), [], [], POLL_SECONDS)
+        except InterruptedError:
+            return
+        for fd in readable:
+            worker = starting[fd]
+            # Empty if the worker exited before it was ready; it is reaped below.
+            worker.ready = os.read(fd, 1) == b"1"
+            os.close(fd)
+            worker.ready_fd = None
+            if worker.ready:
+                logger.info("worker %s ready (pid %s)", worker.index, worker.pid)
+        if self.pending and all(worker.ready for worker in self.pending):
+            self._retire(list(self.workers))
+            self.workers = {worker.pid: worker for worker in self.pending}
+            self.pending = []
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            pending = {worker.pid: worker for worker in self.pending}
+            worker = self.workers.pop(pid, None) or pending.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            if pid in {worker.pid for worker in self.pending}:
+                # The old workers keep serving until a reload fully succeeds.
+                logger.error("new worker %s exited with status %s; reload abandoned",
+                             worker.index, os.waitstatus_to_exitcode(status))
+                self._retire(list(pending))
+                self.pending = []
+                continue
+            logger.error("worker %s (pid %s) exited with status %s",
+                         worker.index, pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - worker.started < RESPAWN_DELAY_SECONDS:
+                self._respawn_at[worker.index] = time.monotonic() + RESPAWN_DELAY_SECONDS
+
+    def _replace_missing(self):
+        serving = {worker.index for worker in self.workers.values()}
+        for index in range(self.args.workers):
+            if index not in serving and time.monotonic() >= self._respawn_at.get(index, 0):
+                worker = self.spawn(index)
+                self.workers[worker.pid] = worker
+
+    def _retire(self, pids):
+        deadline = time.monotonic() + self.args.graceful_timeout + KILL_DELAY_SECONDS
+        for pid in pids:
+            self.retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _retire_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now >= deadline:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def reload(self):
+        if self.pending:
+            return
+        logger.info("reloading %s workers", self.args.workers)
+        self.pending = [self.spawn(index) for index in range(self.args.workers)]
+
+    def stop(self):
+        logger.info("stopping")
+        self._retire([*self.workers, *(worker.pid for worker in self.pending)])
+        self.workers = {}
+        self.pending = []
+        while self.retiring:
+            self._reap()
+            self._retire_overdue()
+            time.sleep(0.05)
+        self.listener.close()
+
+
+def _env_flag(name, default=True):
+    # Parsed like Flask's from_prefixed_env, which the workers use.
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return bool(json.loads(value))
+    except ValueError:
+        return bool(value)
+
+
+def prepare_database():
+    """Migrate (switching to WAL) and create the archive before any worker starts.
+
+    Changing the journal mode or creating tables needs the write lock; done
+    here once, no worker ever races another for it at startup.
+    """
+
+    path = os.environ.get("HOSPITAL_DB_PATH", DB_PATH)
+    if _env_flag("HOSPITAL_DB_AUTO_MIGRATE"):
+        schema.init_db(path)
+    if _env_flag("HOSPITAL_ARCHIVE_ENABLED"):
+        conn = connect(path)
+        try:
+            archive.attach(conn, os.environ.get("HOSPITAL_ARCHIVE_PATH") or archive.archive_path(path))
+        finally:
+            conn.close()
+
+
+def listen(bind, backlog):
+    host, port = parse_bind(bind)
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listener = socket.create_server((host, port), family=family, backlog=backlog)
+    # Every worker polls the same socket; whoever accepts first serves the connection.
+    listener.setblocking(False)
+    return listener
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the hospital API with pre-forked worker processes.")
+    parser.add_argument("--bind", default=DEFAULT_BIND, help="host:port to listen on")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="worker processes (default: CPUs)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="request threads per worker")
+    parser.add_argument("--app", default=DEFAULT_APP, help="module:attribute of the WSGI app, or module:factory() to call")
+    parser.add_argument("--graceful-timeout", type=float, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help="seconds requests in flight get to finish on stop or reload")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG, help="listen queue length")
+    parser.add_argument("--pid-file", help="write the master's pid here (for kill -HUP)")
+    parser.add_argument("--access-log", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    prepare_database()
+    listener = listen(args.bind, args.backlog)
+    if args.pid_file:
+        with open(args.pid_file, "w") as handle:
+            handle.write(f"{os.getpid()}\n")
+    logger.info("listening on %s with %s workers x %s threads", args.bind, args.workers, args.threads)
+    try:
+        return Master(args, listener).run()
+    finally:
+        if args.pid_file and os.path.exists(args.pid_file):
+            os.remove(args.pid_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""Slow-query log with ``EXPLAIN QUERY PLAN`` capture.
+
+Statements run on pooled connections are timed from ``execute`` until their
+last row is fetched (see ``backend.metrics.InstrumentedCursor``). Those that
+take at least ``SLOW_QUERY_MS`` are written as JSON lines to a rotating file,
+with the shapes of their bound parameters and their query plan; plans that
+``SCAN`` a table or build a temporary b-tree are flagged.
+
+The plan is taken on a separate connection, so logging never touches the
+request's own transaction. ``GET /admin/db/slow-queries`` reads the log back.
+"""
+
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import current_app, has_app_context, has_request_context, request
+
+from backend.db import DB_PATH, PROJECT_ROOT, connect
+from backend.pagination import QueryError, page_limit
+
+DEFAULT_SLOW_QUERY_MS = 100
+DEFAULT_SLOW_QUERY_LOG = os.path.join(PROJECT_ROOT, "logs", "slow_queries.log")
+DEFAULT_SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_SLOW_QUERY_LOG_BACKUPS = 3
+
+# Statements whose plan says nothing useful.
+UNPLANNED_PREFIXES = ("BEGIN", "COMMIT", "END", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA", "EXPLAIN")
+
+_current = ContextVar("slow_query_log", default=None)
+
+
+def current():
+    """The slow-query log of the app serving this request, if enabled."""
+
+    return _current.get()
+
+
+def param_shapes(parameters):
+    """Type names of bound parameters; never their values."""
+
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def plan_flags(plan):
+    """Tables read by full scan, and whether a temporary b-tree is built."""
+
+    scans = []
+    for detail in plan:
+        # "SCAN t", "SCAN t USING COVERING INDEX i"; FTS lookups and constant rows are not scans.
+        if detail.startswith("SCAN ") and "VIRTUAL TABLE INDEX" not in detail and detail != "SCAN CONSTANT ROW":
+            scans.append(detail.split()[1])
+    return scans, any("TEMP B-TREE" in detail for detail in plan)
+
+
+class SlowQueryLog:
+    def __init__(self, db_path, threshold_ms, path, max_bytes, backups):
+        self.db_path = db_path
+        self.threshold = threshold_ms / 1000
+        self.path = path
+        self.backups = backups
+        self._explain_conn = None
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger = logging.getLogger(f"hospital.slow_queries.{path}")
+        self.logger.handlers[:] = [handler]
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def explain(self, sql, parameters):
+        if sql.lstrip().upper().startswith(UNPLANNED_PREFIXES):
+            return []
+        with self._lock:
+            if self._explain_conn is None:
+                conn = connect(self.db_path, check_same_thread=False)
+                # Same attached databases and temp views as pooled connections.
+                setup = current_app.config.get("DB_CONNECTION_SETUP") if has_app_context() else None
+                if setup is not None:
+                    setup(conn)
+                self._explain_conn = conn
+            rows = self._explain_conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        return [row["detail"] for row in rows]
+
+    def record(self, sql, parameters, seconds, many=0):
+        """Log one statement that took ``seconds`` (already known to be slow)."""
+
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ms": round(seconds * 1000, 3),
+            "endpoint": request.endpoint if has_request_context() else None,
+            "sql": " ".join(sql.split()),
+        }
+        try:
+            if many:
+                entry["rows"] = many
+                entry["params"] = param_shapes(parameters[0]) if parameters else []
+                plan = self.explain(sql, parameters[0]) if parameters else []
+            else:
+                entry["params"] = param_shapes(parameters)
+                plan = self.explain(sql, parameters)
+        except (sqlite3.Error, TypeError, ValueError) as exc:
+            entry["plan_error"] = str(exc)
+            plan = []
+        entry["plan"] = plan
+        entry["scans"], entry["temp_btree"] = plan_flags(plan)
+        entry["scan"] = bool(entry["scans"])
+        self.logger.info(json.dumps(entry))
+
+    def entries(self):
+        """Logged entries, newest first, across the rotated files."""
+
+        for index in range(self.backups + 1):
+            path = self.path if index == 0 else f"{self.path}.{index}"
+            try:
+                with open(path) as handle:
+                    lines = handle.readlines()
+            except FileNotFoundError:
+                continue
+            for line in reversed(lines):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def search(log, args):
+    """Filter logged entries by ``endpoint``, ``min_ms`` and ``scan``.
+
+    ``group=sql`` aggregates matches per statement, slowest total first.
+    """
+
+    min_ms = args.get("min_ms")
+    try:
+        min_ms = float(min_ms) if min_ms else 0.0
+    except ValueError:
+        raise QueryError("min_ms must be a number")
+    scan_only = args.get("scan", "").lower() in ("1", "true")
+    endpoint = args.get("endpoint")
+    limit = page_limit(args)
+
+    matches = (
+        entry
+        for entry in log.entries()
+        if entry["ms"] >= min_ms and (not scan_only or entry["scan"]) and (not endpoint or entry["endpoint"] == endpoint)
+    )
+    if args.get("group") != "sql":
+        return {"threshold_ms": log.threshold * 1000, "items": list(itertools.islice(matches, limit))}
+
+    groups = {}
+    for entry in matches:
+        group = groups.get(entry["sql"])
+        if group is None:
+            group = groups[entry["sql"]] = {
+                "sql": entry["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0, "endpoints": [],
+                "plan": entry["plan"], "scans": entry["scans"], "temp_btree": entry["temp_btree"],
+                "last_seen": entry["ts"],
+            }
+        group["count"] += 1
+        group["total_ms"] = round(group["total_ms"] + entry["ms"], 3)
+        group["max_ms"] = max(group["max_ms"], entry["ms"])
+        if entry["endpoint"] not in group["endpoints"]:
+            group["endpoints"].append(entry["endpoint"])
+    items = sorted(groups.values(), key=lambda group: group["total_ms"], reverse=True)
+    return {"threshold_ms": log.threshold * 1000, "items": items[:limit]}
+
+
+def get_log():
+    return current_app.extensions.get("slow_query_log")
+
+
+def init_app(app):
+    """Enable the log unless ``SLOW_QUERY_ENABLED`` is false.
+
+    Call before ``db.init_app`` so the pool opens instrumented connections.
+    """
+
+    app.config.setdefault("SLOW_QUERY_ENABLED", True)
+    app.config.setdefault("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)
+    app.config.setdefault("SLOW_QUERY_LOG", DEFAULT_SLOW_QUERY_LOG)
+    app.config.setdefault("SLOW_QUERY_LOG_MAX_BYTES", DEFAULT_SLOW_QUERY_LOG_MAX_BYTES)
+    app.config.setdefault("SLOW_QUERY_LOG_BACKUPS", DEFAULT_SLOW_QUERY_LOG_BACKUPS)
+    if not app.config["SLOW_QUERY_ENABLED"]:
+        return
+
+    from backend.metrics import InstrumentedConnection
+
+    app.config.setdefault("DB_CONNECTION_FACTORY", InstrumentedConnection)
+    app.extensions["slow_query_log"] = SlowQueryLog(
+        app.config.get("DB_PATH", DB_PATH),
+        float(app.config["SLOW_QUERY_MS"]),
+        app.config["SLOW_QUERY_LOG"],
+        int(app.config["SLOW_QUERY_LOG_MAX_BYTES"]),
+        int(app.config["SLOW_QUERY_LOG_BACKUPS"]),
+    )
+
+    @app.before_request
+    def bind_slow_query_log():
+        # Looked up per request so tools can swap in their own recorder.
+        _current.set(app.extensions["slow_query_log"])
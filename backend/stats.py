@@ -0,0 +1,216 @@
+"""Materialized counters and daily rollups behind ``/admin/dashboard``.
+
+Row counts live in ``stats_counters`` and per-day figures in ``stats_daily``;
+triggers on the base tables keep both up to date on every insert, update and
+delete, so the dashboard reads a handful of rows however large the tables
+grow. Archived rows (``backend.archive``) still count: moving them out of
+the main tables happens with ``changes_paused`` set, which the delete
+triggers skip, and purging them from the archive subtracts them
+(``subtract``). Run ``python -m backend.stats --rebuild`` to recompute them
+from the base tables and the archive if they ever drift (e.g. after the
+database was edited by a tool that dropped the triggers).
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+from datetime import date, timedelta
+
+from backend.db import DB_PATH, connect
+
+COUNTED_TABLES = ("patients", "doctors", "appointments", "treatments", "billing")
+
+# metric -> (table, day, value, condition). ``{row}`` is ``new``/``old`` inside
+# triggers and the table itself when rebuilding.
+DAILY_METRICS = {
+    "new_patients": ("patients", "date({row}.registration_date)", "1", "1"),
+    "appointments": ("appointments", "date({row}.appointment_date)", "1", "1"),
+    "appointments_completed": (
+        "appointments",
+        "date({row}.appointment_date)",
+        "1",
+        "LOWER({row}.status) = 'completed'",
+    ),
+    "paid_amount": (
+        "billing",
+        "date({row}.bill_date)",
+        "IFNULL({row}.amount, 0)",
+        "LOWER({row}.payment_status) = 'paid'",
+    ),
+}
+
+CREATE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        metric TEXT NOT NULL,
+        day TEXT NOT NULL,
+        value REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (metric, day)
+    ) WITHOUT ROWID
+    """,
+)
+
+
+def _rollup_sql(metric: str, row: str, sign: str) -> str:
+    table, day, value, condition = DAILY_METRICS[metric]
+    day, value, condition = (expr.format(row=row) for expr in (day, value, condition))
+    # The WHERE clause is also what lets SQLite parse INSERT ... SELECT ... ON CONFLICT.
+    return f"""
+        INSERT INTO stats_daily (metric, day, value)
+        SELECT '{metric}', {day}, {sign}{value}
+        WHERE {day} IS NOT NULL AND {condition}
+        ON CONFLICT (metric, day) DO UPDATE SET value = value + excluded.value;
+    """
+
+
+def _paused_table_exists(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes_paused'").fetchone()
+    return row is not None
+
+
+def create_triggers(conn: sqlite3.Connection) -> None:
+    """(Re)create the triggers that maintain the counters and rollups."""
+
+    # Deletes made while ``changes.paused`` is active are moves to the archive.
+    guard = " WHEN NOT EXISTS (SELECT 1 FROM changes_paused)" if _paused_table_exists(conn) else ""
+    for table in COUNTED_TABLES:
+        metrics = [metric for metric, spec in DAILY_METRICS.items() if spec[0] == table]
+        for event in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {table}_stats_{event}")
+
+        body = f"UPDATE stats_counters SET value = value + 1 WHERE name = '{table}';"
+        body += "".join(_rollup_sql(metric, "new", "") for metric in metrics)
+        conn.execute(f"CREATE TRIGGER {table}_stats_insert AFTER INSERT ON {table} BEGIN {body} END")
+
+        body = f"UPDATE stats_counters SET value = value - 1 WHERE name = '{table}';"
+        body += "".join(_rollup_sql(metric, "old", "-") for metric in metrics)
+        conn.execute(f"CREATE TRIGGER {table}_stats_delete AFTER DELETE ON {table}{guard} BEGIN {body} END")
+
+        if metrics:
+            # Only updates touching a column the rollups read need to move them.
+            exprs = " ".join(" ".join(DAILY_METRICS[metric][1:]) for metric in metrics)
+            columns = sorted(set(re.findall(r"\{row\}\.(\w+)", exprs)))
+            body = "".join(_rollup_sql(metric, "old", "-") + _rollup_sql(metric, "new", "") for metric in metrics)
+            conn.execute(
+                f"CREATE TRIGGER {table}_stats_update AFTER UPDATE OF {', '.join(columns)} ON {table} BEGIN {body} END"
+            )
+
+
+def _add(conn: sqlite3.Connection, table: str, source: str, parameters=(), sign: str = "") -> None:
+    """Add (``sign=""``) or subtract (``"-"``) the rows of ``source`` to ``table``'s figures."""
+
+    conn.execute(
+        f"UPDATE stats_counters SET value = value {sign or '+'} (SELECT COUNT(*) FROM {source}) WHERE name = ?",
+        (*parameters, table),
+    )
+    for metric, (metric_table, day, value, condition) in DAILY_METRICS.items():
+        if metric_table != table:
+            continue
+        day, value, condition = (expr.format(row="source") for expr in (day, value, condition))
+        conn.execute(
+            f"""
+            INSERT INTO stats_daily (metric, day, value)
+            SELECT '{metric}', {day}, {sign}SUM({value})
+            FROM {source} AS source
+            WHERE {day} IS NOT NULL AND {condition}
+            GROUP BY {day}
+            ON CONFLICT (metric, day) DO UPDATE SET value = value + excluded.value
+            """,
+            parameters,
+        )
+
+
+def subtract(conn: sqlite3.Connection, table: str, source: str, parameters=()) -> None:
+    """Take rows counted under ``table`` out of the figures before deleting them untracked.
+
+    ``source`` is a table name or parenthesized subquery reading them, e.g.
+    archived rows, which no trigger sees.
+    """
+
+    _add(conn, table, source, parameters, sign="-")
+
+
+def rebuild(conn: sqlite3.Connection, sources=None) -> None:
+    """Recompute every counter and rollup from the base tables.
+
+    ``sources`` maps a table to more of its rows to count (a parenthesized
+    subquery), e.g. ``archive.stats_sources`` for archived rows. The caller
+    commits; the migration runs this inside its own transaction.
+    """
+
+    conn.execute("DELETE FROM stats_counters")
+    conn.execute("DELETE FROM stats_daily")
+    for table in COUNTED_TABLES:
+        conn.execute("INSERT INTO stats_counters (name, value) VALUES (?, 0)", (table,))
+        _add(conn, table, f"main.{table}")
+        if sources and table in sources:
+            _add(conn, table, sources[table])
+
+
+def dashboard(conn: sqlite3.Connection, today: date = None) -> dict:
+    """Totals plus today's and this month's figures, read from the rollups."""
+
+    today = today or date.today()
+    result = {
+        row["name"]: row["value"]
+        for row in conn.execute("SELECT name, value FROM stats_counters")
+    }
+
+    daily = {
+        row["metric"]: row["value"]
+        for row in conn.execute(
+            f"SELECT metric, value FROM stats_daily WHERE metric IN ({', '.join('?' * len(DAILY_METRICS))}) AND day = ?",
+            (*DAILY_METRICS, today.isoformat()),
+        )
+    }
+    result["today"] = {
+        "date": today.isoformat(),
+        "appointments": int(daily.get("appointments", 0)),
+        "completed_appointments": int(daily.get("appointments_completed", 0)),
+        "new_patients": int(daily.get("new_patients", 0)),
+        "income": round(daily.get("paid_amount", 0.0), 2),
+    }
+
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    month_revenue = conn.execute(
+        """
+        SELECT IFNULL(SUM(value), 0) FROM stats_daily
+        WHERE metric = 'paid_amount' AND day >= ? AND day < ?
+        """,
+        (month_start.isoformat(), next_month.isoformat()),
+    ).fetchone()[0]
+    result["month_revenue"] = round(month_revenue, 2)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or rebuild the dashboard rollups.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--rebuild", action="store_true", help="recompute rollups from the base tables")
+    args = parser.parse_args(argv)
+
+    from backend import archive
+
+    conn = connect(args.db)
+    try:
+        if args.rebuild:
+            if os.path.exists(archive.archive_path(args.db)):
+                archive.attach(conn, archive.archive_path(args.db))
+            with conn:
+                rebuild(conn, archive.stats_sources(conn))
+        for name, value in dashboard(conn).items():
+            print(f"{name}: {value}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
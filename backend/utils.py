@@ -1,6 +1,76 @@
 from typing import Optional
 import sqlite3
 
+from flask import Response, current_app, g, jsonify, request, stream_with_context
+
+from backend.db import get_pool
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+EVENT_STREAM_MIMETYPE = "text/event-stream"
+STREAM_BATCH_SIZE = 500
+
 
 def row_to_dict(row: Optional[sqlite3.Row]):
     return dict(row) if row else None
+
+
+def stream_format():
+    """Return 'ndjson', 'array' or None for the current request.
+
+    ``?stream=1`` (or ``ndjson``) and ``Accept: application/x-ndjson`` select
+    NDJSON; ``?stream=array`` selects a chunked JSON array.
+    """
+
+    stream = request.args.get("stream", "").lower()
+    if stream == "array":
+        return "array"
+    if stream in ("1", "true", "ndjson"):
+        return "ndjson"
+    if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return "ndjson"
+    return None
+
+
+def stream_rows(cursor: sqlite3.Cursor, fmt: str = "ndjson", batch_size: int = STREAM_BATCH_SIZE):
+    """Stream a cursor's rows, encoding ``batch_size`` rows per chunk.
+
+    Memory stays bounded by one batch. Flask tears the request down before the
+    body is sent, so the pooled connection is detached from it here and only
+    returned to the pool once the response is closed.
+    """
+
+    dumps = current_app.json.dumps
+
+    def generate():
+        first = True
+        if fmt == "array":
+            yield "["
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            encoded = [dumps(dict(row)) for row in rows]
+            if fmt == "array":
+                yield ("" if first else ",") + ",".join(encoded)
+            else:
+                yield "\n".join(encoded) + "\n"
+            first = False
+        if fmt == "array":
+            yield "]"
+
+    mimetype = "application/json" if fmt == "array" else NDJSON_MIMETYPE
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    conn = g.pop("db", None)
+    if conn is not None:
+        pool = get_pool()
+        response.call_on_close(lambda: pool.release(conn))
+    return response
+
+
+def rows_response(cursor: sqlite3.Cursor):
+    """Respond with every row of ``cursor``, streaming if the client asked for it."""
+
+    fmt = stream_format()
+    if fmt:
+        return stream_rows(cursor, fmt)
+    return jsonify([row_to_dict(row) for row in cursor.fetchall()])
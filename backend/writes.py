@@ -0,0 +1,237 @@
+"""Single-writer queue with group commit for the request handlers' writes.
+
+Each process commits through one connection; ``run`` hands it a write and
+returns its result (or raises its exception) in the submitting request.
+"""
+
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from backend.db import DB_PATH, connect, get_db, retry_busy, write_transaction
+from backend.metrics import Histogram
+
+DEFAULT_WRITE_GROUP_MAX = 64
+DEFAULT_WRITE_GROUP_WAIT_SECONDS = 0  # group only what is already queued
+# SQLite's own busy handler backs off to 100 ms sleeps, long enough to miss
+# another process's commit; the writer polls briefly and then retries itself.
+WRITER_BUSY_TIMEOUT_MS = 20
+
+
+class Job:
+    __slots__ = ("fn", "group", "future", "submitted", "context")
+
+    def __init__(self, fn, group):
+        self.fn = fn
+        self.group = group
+        self.future = Future()
+        self.submitted = time.monotonic()
+        # The submitting request's context: its statements are charged to it
+        # (metrics, slow-query log) whichever thread runs them.
+        self.context = contextvars.copy_context()
+
+
+class WriteQueue:
+    """Serializes the writes of one process on one connection.
+
+    The writer's connection is opened with ``factory`` and passed to
+    ``setup``, like the pool's.
+    """
+
+    def __init__(self, db_path=DB_PATH, setup=None, group_max=DEFAULT_WRITE_GROUP_MAX,
+                 group_wait=DEFAULT_WRITE_GROUP_WAIT_SECONDS, factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.setup = setup
+        self.factory = factory
+        self.group_max = max(1, int(group_max))
+        self.group_wait = float(group_wait)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Lock()  # held by the thread running writes
+        self._conn = None
+        self._next = None  # a job taken while grouping that has to run alone
+        self._stats = {"jobs": 0, "failed": 0, "transactions": 0, "busy_retries": 0}
+        self._commit_seconds = Histogram()
+        self._wait_seconds = Histogram()
+
+    def _check_fork(self):
+        # The connection must not cross a fork; a child starts with an empty queue.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def run(self, fn, group=False):
+        """Run ``fn(conn)`` in a write transaction; returns its result once committed."""
+
+        self._check_fork()
+        job = Job(fn, group)
+        self._queue.put(job)
+        with self._writer:
+            self._drain(job)
+        return job.future.result()
+
+    def warm(self):
+        """Open the writer's connection ahead of the first write."""
+
+        self._check_fork()
+        with self._writer:
+            self._open()
+
+    def _open(self):
+        if self._conn is None:
+            self._conn = connect(self.db_path, check_same_thread=False, factory=self.factory)
+            self._conn.execute(f"PRAGMA busy_timeout = {WRITER_BUSY_TIMEOUT_MS}")
+            if self.setup is not None:
+                self.setup(self._conn)
+
+    def _drain(self, job):
+        # Until ``job`` is done (whoever held the writer before may have run
+        # it already). Every job still queued has its thread waiting for the
+        # writer, so stopping here leaves none behind, and a steady stream of
+        # writes cannot keep this request busy with other requests' writes.
+        self._open()
+        while not job.future.done():
+            jobs = self._take()
+            if not jobs:
+                return
+            started = time.perf_counter()
+            try:
+                if len(jobs) == 1 and not jobs[0].group:
+                    results = self._run_alone(jobs[0])
+                else:
+                    results = self._run_group(jobs)
+            except BaseException as error:
+                results = [(False, error)] * len(jobs)
+            self._finish(jobs, results, time.perf_counter() - started)
+
+    def _take(self):
+        job, self._next = self._next, None
+        if job is None:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return []
+        jobs = [job]
+        if not job.group:
+            return jobs
+        deadline = job.submitted + self.group_wait
+        while len(jobs) < self.group_max:
+            try:
+                job = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if not job.group:
+                self._next = job
+                break
+            jobs.append(job)
+        return jobs
+
+    def _retried(self):
+        with self._lock:
+            self._stats["busy_retries"] += 1
+
+    def _run_alone(self, job):
+        return [job.context.run(self._transaction, job.fn)]
+
+    def _transaction(self, fn):
+        try:
+            with write_transaction(self._conn, on_retry=self._retried):
+                return True, fn(self._conn)
+        except Exception as error:
+            return False, error
+
+    def _run_group(self, jobs):
+        conn = self._conn
+        results = []
+        retry_busy(lambda: conn.execute("BEGIN IMMEDIATE"), on_retry=self._retried)
+        try:
+            for job in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((True, job.context.run(job.fn, conn)))
+                except Exception as error:
+                    conn.execute("ROLLBACK TO job")
+                    results.append((False, error))
+                conn.execute("RELEASE job")
+            retry_busy(conn.commit, on_retry=self._retried)
+        except BaseException:
+            conn.rollback()
+            raise
+        return results
+
+    def _finish(self, jobs, results, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._stats["transactions"] += 1
+            self._commit_seconds.observe(seconds)
+            for job, (ok, _) in zip(jobs, results):
+                self._stats["jobs"] += 1
+                self._stats["failed"] += not ok
+                self._wait_seconds.observe(now - job.submitted)
+        for job, (ok, value) in zip(jobs, results):
+            if ok:
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["depth"] = self._queue.qsize() + (self._next is not None)
+            snapshot["commit_seconds"] = self._commit_seconds.copy()
+            snapshot["wait_seconds"] = self._wait_seconds.copy()
+        return snapshot
+
+
+def get_queue():
+    return current_app.extensions.get("write_queue")
+
+
+def run(fn, group=False):
+    """Run ``fn(conn)`` in a write transaction and return its result.
+
+    Through the app's ``WriteQueue``, or on the request's connection when the
+    queue is off. ``fn`` must not commit; ``group=True`` lets it share a
+    transaction with other small writes.
+    """
+
+    write_queue = get_queue()
+    if write_queue is None:
+        conn = get_db()
+        with write_transaction(conn):
+            return fn(conn)
+    return write_queue.run(fn, group)
+
+
+def execute(sql, parameters=(), group=False):
+    """``run`` one statement; returns its cursor (``lastrowid``, ``rowcount``)."""
+
+    return run(lambda conn: conn.execute(sql, parameters), group)
+
+
+def init_app(app):
+    """Create the write queue; call after ``db.init_app``."""
+
+    app.config.setdefault("WRITE_QUEUE_ENABLED", True)
+    app.config.setdefault("WRITE_GROUP_MAX", DEFAULT_WRITE_GROUP_MAX)
+    app.config.setdefault("WRITE_GROUP_WAIT_SECONDS", DEFAULT_WRITE_GROUP_WAIT_SECONDS)
+    if not app.config["WRITE_QUEUE_ENABLED"]:
+        return
+    app.extensions["write_queue"] = WriteQueue(
+        app.config.get("DB_PATH", DB_PATH),
+        setup=app.config.get("DB_CONNECTION_SETUP"),
+        group_max=int(app.config["WRITE_GROUP_MAX"]),
+        group_wait=float(app.config["WRITE_GROUP_WAIT_SECONDS"]),
+        factory=app.config["DB_CONNECTION_FACTORY"],
+    )
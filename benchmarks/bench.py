@@ -0,0 +1,610 @@
+"""Reproducible HTTP benchmark for every backend route.
+
+Seeds a database with ``dataset/generate.py`` (or reuses ``--db``), then
+replays a weighted mix of page loads — the requests ``doctor.html``,
+``patient.html`` and ``admin.html`` issue — through Flask's test client.
+Per route it reports p50/p95/p99 latency, throughput and peak RSS, writes the
+results as JSON and, given ``--baseline``, exits non-zero on regressions.
+
+    python benchmarks/bench.py --appointments 200000 --requests 3000 --output now.json
+    python benchmarks/bench.py ... --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "dataset"))
+
+from backend.app import create_app  # noqa: E402
+
+BLUEPRINTS = ("patients", "doctors", "appointments", "admin", "search", "batch")
+TODAY = "2025-06-01"  # fixed so seeded statuses and "today" views are reproducible
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident set size in bytes (Linux), falling back to the peak elsewhere."""
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class RssSampler(threading.Thread):
+    """Samples RSS every few ms and tracks the peak of each open window."""
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss = current_rss()
+            with self.lock:
+                for token, peak in self.windows.items():
+                    if rss > peak:
+                        self.windows[token] = rss
+
+    def open(self):
+        token = object()
+        with self.lock:
+            self.windows[token] = current_rss()
+        return token
+
+    def close(self, token):
+        rss = current_rss()
+        with self.lock:
+            return max(self.windows.pop(token), rss)
+
+
+# ================= Workload =================
+class Workload:
+    """Page loads drawn from ids that exist in the seeded database."""
+
+    def __init__(self, db_path, rng):
+        self.rng = rng
+        # Kept open (read-only) to check drawn ids; each Workload is used by one thread.
+        conn = self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.doctors = [row[0] for row in conn.execute("SELECT doctor_id FROM doctors ORDER BY doctor_id")]
+        self.patients = conn.execute("SELECT MIN(patient_id), MAX(patient_id) FROM patients").fetchone()
+        self.appointments = conn.execute("SELECT MIN(appointment_id), MAX(appointment_id) FROM appointments").fetchone()
+        self.bills = conn.execute("SELECT MIN(bill_id), MAX(bill_id) FROM billing").fetchone()
+        self.specialties = [
+            tuple(row) for row in conn.execute("SELECT DISTINCT specialization, hospital_branch FROM doctors")
+        ]
+        self.surnames = [row[0] for row in conn.execute("SELECT DISTINCT last_name FROM patients LIMIT 50")]
+        self.created = 0
+
+    def doctor(self):
+        # Same skew as the generator: a few doctors see most traffic.
+        return self.doctors[min(len(self.doctors) - 1, int(len(self.doctors) * self.rng.random() ** 3))]
+
+    def _between(self, bounds):
+        low, high = bounds
+        return self.rng.randint(low, high) if low is not None else 1
+
+    def patient(self):
+        # Earlier runs against the same --db delete some of the patients they create.
+        while True:
+            patient_id = self._between(self.patients)
+            if self.conn.execute("SELECT 1 FROM patients WHERE patient_id = ?", (patient_id,)).fetchone():
+                return patient_id
+
+    def appointment(self):
+        return self._between(self.appointments)
+
+    def bill(self):
+        return self._between(self.bills)
+
+    def future_day(self):
+        return (date.fromisoformat(TODAY) + timedelta(days=self.rng.randint(1, 30))).isoformat()
+
+    def new_patient(self):
+        self.created += 1
+        return {"first_name": f"Bench{self.created}", "last_name": self.rng.choice(self.surnames or ["Smith"])}
+
+    # Each action returns a list of (label, method, url, json) requests; a
+    # callable entry receives the previous response and builds the next request.
+    def doctor_dashboard(self):
+        d = self.doctor()
+        return [
+            ("GET /doctors/<int:doctor_id>", "GET", f"/doctors/{d}", None),
+            ("GET /doctors/<int:doctor_id>/schedule", "GET", f"/doctors/{d}/schedule", None),
+            ("GET /doctors/<int:doctor_id>/appointments", "GET", f"/doctors/{d}/appointments", None),
+            ("GET /doctors/<int:doctor_id>/patients", "GET", f"/doctors/{d}/patients?limit=4&max_appointments=1", None),
+        ]
+
+    def doctor_dashboard_batched(self):
+        # The same page load as doctor_dashboard, in one round trip.
+        d = self.doctor()
+        paths = [f"/doctors/{d}", f"/doctors/{d}/schedule", f"/doctors/{d}/appointments",
+                 f"/doctors/{d}/patients?limit=4&max_appointments=1"]
+        return [("POST /batch", "POST", "/batch", {"requests": [{"path": path} for path in paths]})]
+
+    def doctor_my_patients(self):
+        d = self.doctor()
+
+        def open_patient(response):
+            # The page opens one of the listed patients in a modal.
+            listed = response.get_json() or []
+            p = self.rng.choice(listed)["patient"]["patient_id"] if listed else self.patient()
+            url = f"/patients/{p}/timeline?sections=appointments,billing&doctor_id={d}"
+            return ("GET /patients/<int:patient_id>/timeline", "GET", url, None)
+
+        return [("GET /doctors/<int:doctor_id>/patients", "GET", f"/doctors/{d}/patients?max_appointments=1", None),
+                open_patient]
+
+    def doctor_changes(self):
+        # A dashboard without EventSource: catch up on the change log, then poll once more.
+        d = self.doctor()
+
+        def poll_again(response):
+            position = (response.get_json() or {}).get("last_event_id", 0)
+            url = f"/appointments/changes?doctor_id={d}&last_event_id={position}"
+            return ("GET /appointments/changes", "GET", url, None)
+
+        return [("GET /appointments/changes", "GET", f"/appointments/changes?doctor_id={d}&last_event_id=0&limit=20", None),
+                poll_again]
+
+    def patient_dashboard(self):
+        p = self.patient()
+        return [
+            ("GET /patients/<int:patient_id>", "GET", f"/patients/{p}", None),
+            ("GET /patients/<int:patient_id>/appointments", "GET", f"/patients/{p}/appointments", None),
+            ("GET /patients/<int:patient_id>/billing", "GET", f"/patients/{p}/billing", None),
+        ]
+
+    def patient_treatments(self):
+        p = self.patient()
+        return [("GET /patients/<int:patient_id>/treatments", "GET", f"/patients/{p}/treatments", None)]
+
+    def book_appointment(self):
+        d, p, day = self.doctor(), self.patient(), self.future_day()
+
+        def book(response):
+            days = (response.get_json() or {}).get("days") or [{"slots": []}]
+            slots = days[0]["slots"] or ["09:00"]
+            body = {"patient_id": p, "doctor_id": d, "appointment_date": day,
+                    "appointment_time": self.rng.choice(slots), "reason_for_visit": "Checkup"}
+            return ("POST /appointments", "POST", "/appointments", body)
+
+        return [
+            ("GET /doctors/<int:doctor_id>/availability", "GET", f"/doctors/{d}/availability?from={day}&to={day}", None),
+            book,
+        ]
+
+    def browse_availability(self):
+        specialization, branch = self.rng.choice(self.specialties)
+        query = f"specialization={specialization}&branch={branch}&from={TODAY}"
+        return [("GET /doctors/availability", "GET", f"/doctors/availability?{query}", None),
+                ("GET /doctors", "GET", "/doctors", None)]
+
+    def update_appointment(self):
+        a = self.appointment()
+        return [
+            ("PUT /appointments/<int:appointment_id>/status", "PUT", f"/appointments/{a}/status", {"status": "Completed"}),
+            ("PUT /appointments/<int:appointment_id>", "PUT", f"/appointments/{a}", {"reason_for_visit": "Follow-up"}),
+        ]
+
+    def cancel_appointment(self):
+        return [("DELETE /appointments/<int:appointment_id>", "DELETE", f"/appointments/{self.appointment()}", None)]
+
+    def register(self):
+        return [("POST /patients/register", "POST", "/patients/register", self.new_patient())]
+
+    def bulk_intake(self):
+        patients = [self.new_patient() for _ in range(50)]
+        day = self.future_day()
+        visits = [
+            {"patient_id": self.patient(), "doctor_id": self.doctor(), "appointment_date": day,
+             "appointment_time": f"{self.rng.randint(8, 16):02d}:{self.rng.choice(['00', '30'])}"}
+            for _ in range(20)
+        ]
+        return [
+            ("POST /patients/bulk", "POST", "/patients/bulk", {"items": patients}),
+            ("POST /appointments/bulk", "POST", "/appointments/bulk", {"mode": "partial", "items": visits}),
+        ]
+
+    def quick_search(self):
+        term = self.rng.choice(self.surnames or ["smith"])[: self.rng.randint(2, 5)]
+        return [("GET /search", "GET", f"/search?q={term}&limit=10", None)]
+
+    def admin_dashboard(self):
+        return [
+            ("GET /admin/dashboard", "GET", "/admin/dashboard", None),
+            ("GET /admin/billing/summary", "GET", "/admin/billing/summary", None),
+            ("GET /admin/db/pool", "GET", "/admin/db/pool", None),
+            ("GET /admin/db/cache", "GET", "/admin/db/cache", None),
+            ("GET /admin/db/slow-queries", "GET", "/admin/db/slow-queries?group=sql", None),
+        ]
+
+    def admin_lists(self):
+        def next_page(label, url):
+            def follow(response):
+                cursor = (response.get_json() or {}).get("next_cursor")
+                return (label, "GET", f"{url}&cursor={cursor}" if cursor else url, None)
+            return follow
+
+        lists = [
+            ("GET /admin/patients", "/admin/patients?limit=10&sort=name"),
+            ("GET /admin/doctors", "/admin/doctors?limit=10"),
+            ("GET /admin/appointments", "/admin/appointments?limit=10&status=Scheduled"),
+            ("GET /admin/billing", "/admin/billing?limit=10&status=Pending"),
+        ]
+        # Each tab's first page, then scroll one of them (loaded last, so its page is the one followed).
+        label, url = lists.pop(self.rng.randrange(len(lists)))
+        return [(tab, "GET", tab_url, None) for tab, tab_url in lists + [(label, url)]] + [next_page(label, url)]
+
+    def admin_details(self):
+        return [
+            ("GET /admin/patients/<int:patient_id>", "GET", f"/admin/patients/{self.patient()}", None),
+            ("GET /admin/doctors/<int:doctor_id>", "GET", f"/admin/doctors/{self.doctor()}", None),
+            ("GET /admin/appointments/<int:appointment_id>", "GET", f"/admin/appointments/{self.appointment()}", None),
+            ("GET /admin/billing/<int:bill_id>", "GET", f"/admin/billing/{self.bill()}", None),
+        ]
+
+    def admin_edits(self):
+        return [
+            ("PUT /admin/patients/<int:patient_id>", "PUT", f"/admin/patients/{self.patient()}",
+             {"address": f"{self.rng.randint(1, 999)} Bench St"}),
+            ("PUT /admin/doctors/<int:doctor_id>", "PUT", f"/admin/doctors/{self.doctor()}",
+             {"years_experience": self.rng.randint(1, 35)}),
+            ("PUT /admin/appointments/<int:appointment_id>", "PUT", f"/admin/appointments/{self.appointment()}",
+             {"reason_for_visit": "Consultation"}),
+            ("PUT /admin/billing/<int:bill_id>", "PUT", f"/admin/billing/{self.bill()}", {"payment_status": "Paid"}),
+        ]
+
+    def admin_create_delete(self):
+        def delete(kind, key):
+            def follow(response):
+                new_id = (response.get_json() or {}).get(key, 0)
+                return (f"DELETE /admin/{kind}/<int:{key}>", "DELETE", f"/admin/{kind}/{new_id}", None)
+            return follow
+
+        doctor = {"first_name": "Bench", "last_name": "Doctor", "specialization": "Pediatrics"}
+        return [
+            ("POST /admin/patients", "POST", "/admin/patients", self.new_patient()),
+            delete("patients", "patient_id"),
+            ("POST /admin/doctors", "POST", "/admin/doctors", doctor),
+            delete("doctors", "doctor_id"),
+        ]
+
+
+# Relative weights of each page load in the mix (reads dominate, as in practice).
+MIX = {
+    "patient_dashboard": 25,
+    "doctor_dashboard": 20,
+    "doctor_dashboard_batched": 2,
+    "book_appointment": 8,
+    "quick_search": 6,
+    "doctor_my_patients": 5,
+    "admin_dashboard": 5,
+    "update_appointment": 4,
+    "patient_treatments": 3,
+    "register": 3,
+    "admin_lists": 3,
+    "admin_details": 3,
+    "admin_edits": 3,
+    "browse_availability": 2,
+    "doctor_changes": 2,
+    "cancel_appointment": 2,
+    "bulk_intake": 1,
+    "admin_create_delete": 1,
+}
+
+
+# ================= Runner =================
+def seed_database(args):
+    import generate  # dataset/generate.py
+
+    path = os.path.join(tempfile.mkdtemp(prefix="hospital-bench-"), "bench.db")
+    generate.main([
+        "--db", path, "--seed", str(args.seed), "--today", TODAY, "--workers", str(args.workers),
+        "--doctors", str(args.doctors), "--patients", str(args.patients), "--appointments", str(args.appointments),
+    ])
+    return path
+
+
+def run_actions(app, workload, actions, sampler, samples, lock, revalidate=False, timeline=None):
+    """Replay ``actions`` with one client; ``revalidate`` resends ETags like a browser cache.
+
+    ``timeline``, if given, collects ``(started, elapsed)`` of every request.
+    """
+
+    client = app.test_client()
+    etags = {}  # url -> last response carrying an ETag
+    for action in actions:
+        previous = None
+        for step in getattr(workload, action)():
+            label, method, url, body = step(previous) if callable(step) else step
+            cached = etags.get(url) if revalidate and method == "GET" else None
+            headers = {"If-None-Match": cached.headers["ETag"]} if cached else {}
+            token = sampler.open()
+            started = time.perf_counter()
+            response = client.open(url, method=method, json=body, headers=headers)
+            elapsed = time.perf_counter() - started
+            peak = sampler.close(token)
+            with lock:
+                samples.setdefault(label, []).append((elapsed, response.status_code, peak))
+                if timeline is not None:
+                    timeline.append((started, elapsed))
+            if revalidate and response.headers.get("ETag"):
+                etags[url] = response
+            # Like a browser, later steps read the cached body of a 304.
+            previous = cached if response.status_code == 304 else response
+
+
+class BackupRunner(threading.Thread):
+    """Takes a snapshot with ``backend.backup`` every ``every`` seconds until stopped."""
+
+    def __init__(self, db_path, every, pages, sleep_seconds):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.every = every
+        self.options = {"pages": pages, "sleep_seconds": sleep_seconds}
+        self.directory = tempfile.mkdtemp(prefix="hospital-bench-backups-")
+        # (started, finished) of each snapshot, checksums and verification included
+        self.windows = []
+        self.manifests = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        from backend import backup
+
+        while not self.stopped.wait(self.every):
+            started = time.perf_counter()
+            self.manifests.append(backup.snapshot(self.db_path, self.directory, keep=1, **self.options))
+            self.windows.append((started, time.perf_counter()))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def backup_impact(runner, timeline, wall_seconds):
+    """Latency and throughput of the requests started during snapshots vs. the rest."""
+
+    def stats(entries, seconds):
+        latencies = [elapsed * 1000 for _, elapsed in entries]
+        if not latencies:
+            return {"requests": 0}
+        return {
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / max(seconds, 1e-9), 1),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+        }
+
+    during = [entry for entry in timeline if any(start <= entry[0] < end for start, end in runner.windows)]
+    between = [entry for entry in timeline if not any(start <= entry[0] < end for start, end in runner.windows)]
+    copying = sum(end - start for start, end in runner.windows)
+    seconds = [manifest["seconds"] for manifest in runner.manifests]
+    return {
+        "snapshots": len(runner.manifests),
+        "step_pages": runner.options["pages"],
+        "step_sleep_seconds": runner.options["sleep_seconds"],
+        "mean_seconds": round(statistics.fmean(seconds), 3) if seconds else None,
+        "max_seconds": round(max(seconds), 3) if seconds else None,
+        "mb_per_second": round(statistics.fmean(m["mb_per_second"] for m in runner.manifests), 1) if seconds else None,
+        "during": stats(during, copying),
+        "between": stats(between, wall_seconds - copying),
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(samples, wall_seconds):
+    routes = {}
+    for label, entries in sorted(samples.items()):
+        latencies = [elapsed * 1000 for elapsed, _, _ in entries]
+        routes[label] = {
+            "count": len(entries),
+            "errors": sum(1 for _, status, _ in entries if status >= 500),
+            "statuses": dict(sorted(Counter(str(status) for _, status, _ in entries).items())),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "max_ms": round(max(latencies), 3),
+            # Serial capacity: requests per second of time spent in this route.
+            "throughput_rps": round(len(entries) / max(sum(latencies) / 1000, 1e-9), 1),
+            "peak_rss_mb": round(max(peak for _, _, peak in entries) / 2**20, 1),
+        }
+    total = sum(route["count"] for route in routes.values())
+    overall = {
+        "requests": total,
+        "errors": sum(route["errors"] for route in routes.values()),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(total / max(wall_seconds, 1e-9), 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1),
+    }
+    return overall, routes
+
+
+def uncovered_routes(app, samples):
+    expected = {
+        f"{method} {rule.rule}"
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint.split(".")[0] in BLUEPRINTS
+        for method in rule.methods - {"HEAD", "OPTIONS"}
+    }
+    return sorted(expected - set(samples))
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Regression messages: slower percentiles, lower throughput, more memory, new errors."""
+
+    problems = []
+    for label, base in baseline["routes"].items():
+        current = results["routes"].get(label)
+        if current is None:
+            problems.append(f"{label}: missing from this run")
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if current[key] > base[key] * (1 + tolerance) and current[key] - base[key] > min_ms:
+                problems.append(f"{label}: {key} {base[key]} -> {current[key]}")
+        if current["throughput_rps"] < base["throughput_rps"] / (1 + tolerance):
+            problems.append(f"{label}: throughput {base['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if current["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            problems.append(f"{label}: peak RSS {base['peak_rss_mb']} -> {current['peak_rss_mb']} MB")
+        if current["errors"] > base["errors"]:
+            problems.append(f"{label}: {current['errors']} server errors (baseline {base['errors']})")
+    return problems
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every backend route with a realistic request mix.")
+    parser.add_argument("--db", help="benchmark an existing database (writes to it) instead of seeding one")
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=50_000)
+    parser.add_argument("--appointments", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=2000, help="page loads to replay (each is 1-4 requests)")
+    parser.add_argument("--warmup", type=int, default=100, help="page loads replayed before measuring")
+    parser.add_argument("--threads", type=int, default=1, help="concurrent clients")
+    parser.add_argument("--no-revalidate", action="store_true",
+                        help="never send If-None-Match (clients without an HTTP cache)")
+    parser.add_argument("--seed", type=int, default=5003)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes used for seeding")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="JSON results to compare against; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="ignore latency changes smaller than this")
+    parser.add_argument("--backup-every", type=float, default=0,
+                        help="take an online backup every this many seconds while measuring (0 = never)")
+    parser.add_argument("--backup-pages", type=int, default=1024, help="pages copied per backup step")
+    parser.add_argument("--backup-sleep", type=float, default=0.02, help="seconds between backup steps")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or seed_database(args)
+
+    app = create_app({"DB_PATH": db_path, "DB_POOL_SIZE": max(8, args.threads)})
+    rng = random.Random(args.seed)
+    workload = Workload(db_path, rng)
+    names, weights = zip(*MIX.items())
+
+    sampler = RssSampler()
+    sampler.start()
+    lock = threading.Lock()
+    revalidate = not args.no_revalidate
+    run_actions(app, workload, rng.choices(names, weights, k=args.warmup), sampler, {}, lock, revalidate)
+
+    # Every page type runs at least once so each route gets a sample.
+    actions = list(names) + rng.choices(names, weights, k=max(0, args.requests - len(names)))
+    rng.shuffle(actions)
+    samples = {}
+    backups = BackupRunner(db_path, args.backup_every, args.backup_pages, args.backup_sleep) if args.backup_every > 0 else None
+    timeline = [] if backups else None
+    started = time.perf_counter()
+    if backups:
+        backups.start()
+    threads = [
+        threading.Thread(
+            target=run_actions,
+            args=(app, Workload(db_path, random.Random(f"{args.seed}:{n}")), actions[n::args.threads], sampler,
+                  samples, lock, revalidate, timeline),
+        )
+        for n in range(max(1, args.threads))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    sampler.stopped.set()
+    if backups:
+        backups.stop()
+
+    overall, routes = summarize(samples, wall_seconds)
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "seed": args.seed,
+            "scale": {"doctors": args.doctors, "patients": args.patients, "appointments": args.appointments}
+            if not args.db else {"db": args.db},
+            "requests": args.requests,
+            "threads": args.threads,
+        },
+        "overall": overall,
+        "routes": routes,
+    }
+    if backups:
+        results["backup"] = backup_impact(backups, timeline, wall_seconds)
+    with open(args.output, "w") as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+
+    print(f"{'route':<52} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>9} {'rss MB':>7}")
+    for label, route in routes.items():
+        print(f"{label:<52} {route['count']:>6} {route['p50_ms']:>8.2f} {route['p95_ms']:>8.2f} "
+              f"{route['p99_ms']:>8.2f} {route['throughput_rps']:>9.1f} {route['peak_rss_mb']:>7.1f}")
+    print(f"overall: {overall['requests']} requests in {overall['wall_seconds']}s = {overall['throughput_rps']} req/s, "
+          f"{overall['errors']} errors, peak RSS {overall['peak_rss_mb']} MB -> {args.output}")
+    if backups:
+        backup = results["backup"]
+        print(f"backups: {backup['snapshots']} of {backup['mean_seconds']}s at {backup['mb_per_second']} MB/s "
+              f"({backup['step_pages']} pages/step, {backup['step_sleep_seconds']}s sleep); "
+              f"during {backup['during']}, between {backup['between']}")
+
+    if not args.db:
+        shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+
+    failed = False
+    missing = uncovered_routes(app, samples)
+    if missing:
+        print("NOT COVERED: " + ", ".join(missing))
+        failed = True
+    if overall["errors"]:
+        print(f"SERVER ERRORS: {overall['errors']}")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as handle:
+            problems = compare(results, json.load(handle), args.tolerance, args.min_ms)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        failed = failed or bool(problems)
+        if not problems:
+            print(f"no regressions against {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
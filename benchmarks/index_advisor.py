@@ -0,0 +1,473 @@
+"""Audit the SQL behind every route and propose indexes for it.
+
+Replays the benchmark request mix (see ``bench.py``) against a scratch copy of
+a seeded database and records every statement the blueprints run, with real
+parameters. Each statement's ``EXPLAIN QUERY PLAN`` is checked for full scans
+and temporary sort b-trees, and so is every foreign key whose child column no
+index leads with (cascades scan the child table otherwise). For each finding a
+composite index is derived from the statement's equality, range and ORDER BY
+columns, then tried for real. It is kept only if the planner uses it and the
+statements get faster, and it becomes covering when that pays off further.
+The result is a report with before/after timings and a migration entry for
+``backend/schema.py``.
+
+    python benchmarks/index_advisor.py --appointments 200000 --migration index_migration.py
+"""
+
+import argparse
+import os
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+from flask import has_request_context, request
+
+import bench
+from backend import schema
+from backend.app import create_app
+from backend.slowlog import UNPLANNED_PREFIXES, SlowQueryLog, plan_flags
+
+MAX_INDEX_COLUMNS = 6
+SQL_KEYWORDS = {
+    "WHERE", "JOIN", "LEFT", "INNER", "CROSS", "OUTER", "ON", "GROUP", "ORDER", "LIMIT",
+    "USING", "NATURAL", "UNION", "SET", "VALUES", "AS", "HAVING", "WINDOW",
+}
+
+ALIAS_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+PREDICATE_RE = re.compile(r"(?:\b(\w+)\.)?\b(\w+)\s*(==|=|<=|>=|<|>|\bIN\b|\bBETWEEN\b|\bIS\b)", re.I)
+JOIN_RE = re.compile(r"\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)")
+ORDER_RE = re.compile(r"\bORDER\s+BY\s+(.+?)(?:\bLIMIT\b|\)|$)", re.I)
+ORDER_TERM_RE = re.compile(r"^(?:(\w+)\.)?(\w+)(?:\s+(?:ASC|DESC))?$", re.I)
+SELECT_RE = re.compile(r"^\s*SELECT\s+(.+?)\s+FROM\s", re.I)
+PLACEHOLDER_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+# ================= Capture =================
+class StatementCapture(SlowQueryLog):
+    """Slow-query log stand-in that keeps every statement with its parameters."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.threshold = 0.0
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def record(self, sql, parameters, seconds, many=0):
+        sql = " ".join(sql.split())
+        if many or sql.upper().startswith(UNPLANNED_PREFIXES):
+            return
+        # IN (?, ?, ...) lists of any length are one statement.
+        key = PLACEHOLDER_LIST_RE.sub("(?...)", sql)
+        endpoint = request.endpoint if has_request_context() else None
+        with self._lock:
+            statement = self.statements.get(key)
+            if statement is None:
+                statement = self.statements[key] = {
+                    "sql": sql, "params": parameters, "calls": 0, "endpoints": set()
+                }
+            statement["calls"] += 1
+            statement["endpoints"].add(endpoint)
+
+    def entries(self):
+        return iter(())
+
+
+def capture_statements(db_path, seed, rounds):
+    app = create_app({"DB_PATH": db_path, "METRICS_ENABLED": False, "SLOW_QUERY_ENABLED": True,
+                      "SLOW_QUERY_LOG": os.path.join(os.path.dirname(db_path), "slow.log")})
+    capture = app.extensions["slow_query_log"] = StatementCapture(db_path)
+    workload = bench.Workload(db_path, random.Random(seed))
+    actions = [name for name in bench.MIX for _ in range(rounds)]
+    samples = {}
+    bench.run_actions(app, workload, actions, bench.RssSampler(), samples, threading.Lock())
+    missing = bench.uncovered_routes(app, samples)
+    if missing:
+        print("warning: routes not exercised: " + ", ".join(missing))
+    return capture.statements
+
+
+# ================= Schema =================
+class Schema:
+    def __init__(self, conn):
+        self.columns = {}
+        self.indexes = {}  # name -> (table, [columns]); expression columns are None
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%'"
+            " AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '%_fts%'"
+        )]
+        self.rowid_keys = {}
+        for table in tables:
+            info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+            self.columns[table] = [row[1] for row in info]
+            keys = [row for row in info if row[5]]
+            if len(keys) == 1 and keys[0][2].upper() == "INTEGER":
+                # INTEGER PRIMARY KEY is the rowid: already the best possible index.
+                self.rowid_keys[table] = keys[0][1]
+            for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+                columns = [row[2] for row in conn.execute(f"PRAGMA index_info({index[1]})")]
+                self.indexes[index[1]] = (table, columns)
+        self.foreign_keys = [
+            (table, row[3], row[2], row[4])  # child table, child column, parent table, parent column
+            for table in tables
+            for row in conn.execute(f"PRAGMA foreign_key_list({table})")
+        ]
+
+    def covered(self, table, columns):
+        """True if an existing index (or the rowid) already starts with ``columns``."""
+
+        if columns and columns[0] == self.rowid_keys.get(table):
+            return True
+        return any(
+            indexed == table and index_columns[: len(columns)] == list(columns)
+            for indexed, index_columns in self.indexes.values()
+        )
+
+    def index_name(self, table, columns, taken):
+        singular = table if table == "billing" else table.rstrip("s")
+        parts = [column[:-3] if column.endswith("_id") else column for column in columns[:3]]
+        base = name = "idx_" + "_".join([singular, *parts])
+        suffix = 2
+        while name in self.indexes or name in taken:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        taken.add(name)
+        return name
+
+
+def create_sql(name, table, columns):
+    return f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)})"
+
+
+# ================= Analysis =================
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def aliases(sql, schema_info):
+    found = {}
+    for table, alias in ALIAS_RE.findall(sql):
+        if table not in schema_info.columns:
+            continue
+        found[table] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            found[alias] = table
+    return found
+
+
+def owner(qualifier, column, names, schema_info):
+    if qualifier:
+        table = names.get(qualifier)
+        return table if table and column in schema_info.columns[table] else None
+    tables = {table for table in names.values() if column in schema_info.columns[table]}
+    return tables.pop() if len(tables) == 1 else None
+
+
+def candidate_columns(sql, table, names, schema_info):
+    """(equality, range, order, selected) columns of ``table`` in ``sql``."""
+
+    equality, ranges = [], []
+    for qualifier, column, operator in PREDICATE_RE.findall(sql):
+        if owner(qualifier, column, names, schema_info) != table:
+            continue
+        target = equality if operator.upper() in ("=", "==", "IN", "IS") else ranges
+        if column not in target:
+            target.append(column)
+    for left_alias, left, right_alias, right in JOIN_RE.findall(sql):
+        for qualifier, column in ((left_alias, left), (right_alias, right)):
+            if owner(qualifier, column, names, schema_info) == table and column not in equality:
+                equality.append(column)
+
+    order = []
+    match = ORDER_RE.search(sql)
+    if match:
+        for term in match.group(1).split(","):
+            term_match = ORDER_TERM_RE.match(term.strip())
+            if not term_match or owner(*term_match.groups(), names, schema_info) != table:
+                order = []  # only a single-table ORDER BY can be read off an index
+                break
+            order.append(term_match.group(2))
+
+    selected = []
+    match = SELECT_RE.match(sql)
+    if match:
+        for term in match.group(1).split(","):
+            term = term.strip().split()[0] if term.strip() else ""
+            qualifier, _, column = term.rpartition(".")
+            if column == "*" and (not qualifier or names.get(qualifier) == table):
+                selected = None
+                break
+            if owner(qualifier, column, names, schema_info) == table:
+                selected.append(column)
+    return equality, ranges, order, selected
+
+
+def flagged(plan):
+    scans, temp_btree = plan_flags(plan)
+    return bool(scans or temp_btree)
+
+
+def propose(statements, conn, schema_info):
+    """Candidate indexes keyed by (table, columns), each with the statements it targets."""
+
+    candidates = {}
+    for key, statement in statements.items():
+        try:
+            plan = explain(conn, statement["sql"], statement["params"])
+        except sqlite3.Error as exc:
+            statement["error"] = str(exc)
+            continue
+        statement["plan_before"] = plan
+        scans, temp_btree = plan_flags(plan)
+        if not scans and not temp_btree:
+            continue
+        names = aliases(statement["sql"], schema_info)
+        targets = {names[alias] for alias in scans if alias in names}
+        if temp_btree:
+            targets.update(set(names.values()))
+        for table in targets:
+            equality, ranges, order, selected = candidate_columns(statement["sql"], table, names, schema_info)
+            columns = list(equality)
+            for column in order or ranges[:1]:
+                if column not in columns:
+                    columns.append(column)
+            columns = columns[:MAX_INDEX_COLUMNS]
+            if not columns or schema_info.covered(table, columns):
+                continue
+            candidate = candidates.setdefault((table, tuple(columns)), {"statements": set(), "selected": set()})
+            candidate["statements"].add(key)
+            if selected is not None:
+                candidate["selected"].update(selected)
+    return candidates
+
+
+def propose_foreign_keys(conn, schema_info):
+    """Unindexed foreign-key columns, each with a parent DELETE that cascades through it."""
+
+    candidates = {}
+    for child, column, parent, parent_column in schema_info.foreign_keys:
+        if schema_info.covered(child, [column]):
+            continue
+        row = conn.execute(f"SELECT MAX({parent_column}) FROM {parent}").fetchone()
+        if row[0] is None:
+            continue
+        key = f"DELETE FROM {parent} WHERE {parent_column} = ? -- cascades to {child}.{column}"
+        statement = {"sql": f"DELETE FROM {parent} WHERE {parent_column} = ?", "params": (row[0],),
+                     "calls": 1, "endpoints": {"(foreign key)"}, "foreign_key": True}
+        candidates[(child, (column,))] = {"statement": (key, statement)}
+    return candidates
+
+
+# ================= Measurement =================
+def time_statement(conn, sql, params, repeat):
+    """Median seconds to run and fully read ``sql``; writes are rolled back."""
+
+    samples = []
+    for _ in range(repeat + 1):
+        conn.execute("SAVEPOINT advisor")
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - started)
+        conn.execute("ROLLBACK TO advisor")
+        conn.execute("RELEASE advisor")
+    # The first run only warms the page cache.
+    return statistics.median(samples[1:])
+
+
+def measure(conn, statements, keys, repeat):
+    timings = {}
+    for key in keys:
+        statement = statements[key]
+        timings[key] = (time_statement(conn, statement["sql"], statement["params"], repeat),
+                        explain(conn, statement["sql"], statement["params"]))
+    return timings
+
+
+def uses(plan, name):
+    return any(re.search(rf"\bINDEX {name}\b", detail) for detail in plan)
+
+
+def improves(plan_before, plan_after):
+    """Fewer full scans or sort b-trees; a narrower full scan does not count."""
+
+    scans_before, sort_before = plan_flags(plan_before)
+    scans_after, sort_after = plan_flags(plan_after)
+    return len(scans_after) < len(scans_before) or (sort_before and not sort_after)
+
+
+def pays_off(was, now, min_gain, min_saved):
+    return was / max(now, 1e-9) >= min_gain and was - now >= min_saved
+
+
+def evaluate(conn, statements, candidates, schema_info, repeat, min_gain, min_saved):
+    """Try each candidate on its own; keep the ones that are used and pay off.
+
+    Where a kept index is then made covering (with the columns its statements
+    select) and that is faster again by ``min_gain``, the covering one is kept.
+    """
+
+    keys = sorted({key for candidate in candidates.values() for key in candidate["statements"]})
+    before = measure(conn, statements, keys, repeat)
+    taken = set()
+    kept = {}
+    for (table, columns), candidate in candidates.items():
+        name = schema_info.index_name(table, columns, taken)
+        conn.execute(create_sql(name, table, columns))
+        after = measure(conn, statements, candidate["statements"], repeat)
+        conn.execute(f"DROP INDEX {name}")
+        helped = [
+            key for key in candidate["statements"]
+            # Cascades do not show in EXPLAIN QUERY PLAN; only the timing can tell.
+            if (statements[key].get("foreign_key") or (uses(after[key][1], name)
+                                                        and improves(before[key][1], after[key][1])))
+            and pays_off(before[key][0], after[key][0], min_gain, min_saved)
+        ]
+        if not helped:
+            continue
+
+        extra = [column for column in sorted(candidate["selected"]) if column not in columns]
+        if extra and len(columns) + len(extra) <= MAX_INDEX_COLUMNS:
+            covering = (*columns, *extra)
+            covering_name = schema_info.index_name(table, covering, taken) + "_covering"
+            conn.execute(create_sql(covering_name, table, covering))
+            faster = measure(conn, statements, helped, repeat)
+            conn.execute(f"DROP INDEX {covering_name}")
+            if all(
+                uses(faster[key][1], covering_name) and pays_off(after[key][0], faster[key][0], min_gain, min_saved)
+                for key in helped
+            ):
+                name, columns = covering_name, covering
+        kept[(table, columns)] = {"name": name, "helped": helped}
+    return before, kept
+
+
+def redundant_indexes(schema_info):
+    """Existing indexes whose columns lead another index on the same table."""
+
+    found = []
+    for name, (table, columns) in schema_info.indexes.items():
+        if name.startswith("sqlite_autoindex") or None in columns:
+            continue
+        for other, (other_table, other_columns) in schema_info.indexes.items():
+            if other != name and other_table == table and len(other_columns) > len(columns) \
+                    and other_columns[: len(columns)] == columns:
+                found.append((name, other))
+                break
+    return found
+
+
+# ================= Output =================
+def write_migration(path, kept, scale):
+    version = schema.LATEST_VERSION + 1
+    lines = [
+        f"# Generated by benchmarks/index_advisor.py on {date.today().isoformat()} ({scale}).",
+        "# Review, then append to MIGRATIONS in backend/schema.py.",
+        "    (",
+        f"        {version},",
+        '        "indexes proposed by the index advisor",',
+        "        (",
+    ]
+    for (table, columns), candidate in sorted(kept.items()):
+        lines.append(f'            "{create_sql(candidate["name"], table, columns)}",')
+    lines += ["        ),", "    ),", ""]
+    with open(path, "w") as handle:
+        handle.write("\n".join(lines))
+
+
+def shorten(sql, width=100):
+    return sql if len(sql) <= width else sql[: width - 3] + "..."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Propose indexes for the SQL run by every route.")
+    parser.add_argument("--db", help="audit a copy of this database instead of seeding one")
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=50_000)
+    parser.add_argument("--appointments", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=5003)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes used for seeding")
+    parser.add_argument("--rounds", type=int, default=5, help="times each page load of the mix is replayed")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per statement (median is used)")
+    parser.add_argument("--min-gain", type=float, default=1.2, help="speedup an index must give to be kept")
+    parser.add_argument("--min-saved-ms", type=float, default=0.05, help="and the time it must save per call")
+    parser.add_argument("--migration", help="write the proposed migration entry to this file")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        scratch = os.path.join(tempfile.mkdtemp(prefix="hospital-advisor-"), "advisor.db")
+        source, target = sqlite3.connect(args.db), sqlite3.connect(scratch)
+        source.backup(target)
+        source.close()
+        target.close()
+        scale = f"copy of {args.db}"
+    else:
+        scratch = bench.seed_database(args)
+        scale = f"{args.doctors} doctors, {args.patients} patients, {args.appointments} appointments"
+
+    statements = capture_statements(scratch, args.seed, args.rounds)
+    conn = sqlite3.connect(scratch, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys = ON")
+    schema_info = Schema(conn)
+    print(f"captured {len(statements)} distinct statements from {args.rounds} rounds of the request mix")
+
+    candidates = propose(statements, conn, schema_info)
+    for table_columns, candidate in propose_foreign_keys(conn, schema_info).items():
+        key, statement = candidate["statement"]
+        statements[key] = statement
+        table, (column,) = table_columns
+        # A composite candidate leading with the same column serves the cascade too.
+        leading = [other for other in candidates if other[0] == table and other[1][0] == column]
+        existing = candidates.setdefault(leading[0] if leading else table_columns,
+                                         {"statements": set(), "selected": set()})
+        existing["statements"].add(key)
+
+    flagged_keys = [key for key, statement in statements.items() if flagged(statement.get("plan_before", []))]
+    print(f"{len(flagged_keys)} statements scan a table or sort in a temp b-tree; {len(candidates)} candidate indexes")
+    for key in flagged_keys:
+        statement = statements[key]
+        print(f"  [{', '.join(sorted(map(str, statement['endpoints'])))}] {shorten(statement['sql'])}")
+        print(f"      {' | '.join(statement['plan_before'])}")
+
+    pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+    min_saved = args.min_saved_ms / 1000
+    before, kept = evaluate(conn, statements, candidates, schema_info, args.repeat, args.min_gain, min_saved)
+    for (table, columns), candidate in kept.items():
+        conn.execute(create_sql(candidate["name"], table, columns))
+    keys = sorted({key for candidate in kept.values() for key in candidate["helped"]})
+    after = measure(conn, statements, keys, args.repeat)
+    pages_added = conn.execute("PRAGMA page_count").fetchone()[0] - pages_before
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+
+    print()
+    if not kept:
+        print("no index paid off; the current index set covers the request mix")
+    for (table, columns), candidate in sorted(kept.items()):
+        print(create_sql(candidate["name"], table, columns))
+        for key in candidate["helped"]:
+            was, now = before[key][0] * 1000, after[key][0] * 1000
+            calls = statements[key]["calls"]
+            print(f"  {was:9.3f} ms -> {now:8.3f} ms ({was / max(now, 1e-6):6.1f}x, {calls} calls)  "
+                  f"{shorten(statements[key]['sql'], 80)}")
+            print(f"      now: {' | '.join(after[key][1])}")
+    if kept:
+        print(f"index size: ~{pages_added * page_size / 2**20:.1f} MB on this dataset")
+
+    for name, other in redundant_indexes(schema_info):
+        print(f"note: {name} is a prefix of {other} and may be redundant")
+
+    if args.migration and kept:
+        write_migration(args.migration, kept, scale)
+        print(f"migration written to {args.migration}")
+    conn.close()
+    shutil.rmtree(os.path.dirname(scratch), ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
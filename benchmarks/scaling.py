@@ -0,0 +1,261 @@
+"""How throughput scales with the number of server worker processes.
+
+Seeds a database like ``bench.py`` (or copies ``--db``). Then, for each
+worker count, it starts ``python -m backend.serve`` on a fresh copy of that
+database and replays the same page-load mix over HTTP from several client
+processes. It reports throughput, latency percentiles and server memory per
+worker count, and the speedup over the first count.
+
+    python benchmarks/scaling.py --appointments 200000 --server-workers 1,2,4,8 --output scaling.json
+
+The clients run on the same machine and use CPU as well. Give them enough
+processes to keep every server thread busy (``--clients``). Beyond half the
+cores, the clients start competing with the server.
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from json import dump, dumps, loads
+from urllib.parse import quote
+
+import bench  # benchmarks/bench.py
+
+from backend.serve import DEFAULT_THREADS
+
+
+class HttpResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def get_json(self):
+        try:
+            return loads(self.body)
+        except ValueError:
+            return None
+
+
+class HttpClient:
+    """The slice of Flask's test client that ``bench.run_actions`` uses, over real HTTP."""
+
+    def __init__(self, port):
+        self.port = port
+
+    def open(self, url, method="GET", json=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if json is not None:
+            body = dumps(json).encode()
+            headers["Content-Type"] = "application/json"
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            # Like the test client, which quotes the spaces in e.g. ?branch=Eastside Clinic.
+            conn.request(method, quote(url, safe="/?&=:,;%+"), body=body, headers=headers)
+            response = conn.getresponse()
+            return HttpResponse(response.status, response.headers, response.read())
+        finally:
+            conn.close()
+
+
+class HttpServer:
+    def __init__(self, port):
+        self.port = port
+
+    def test_client(self):
+        return HttpClient(self.port)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path, port, workers, threads):
+    env = dict(os.environ, HOSPITAL_DB_PATH=db_path, PYTHONPATH=bench.ROOT_DIR)
+    command = [sys.executable, "-m", "backend.serve", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--threads", str(threads)]
+    server = subprocess.Popen(command, cwd=bench.ROOT_DIR, env=env, stderr=subprocess.DEVNULL)
+    client = HttpClient(port)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if client.open("/doctors").status_code == 200:
+                return server
+        except OSError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"server with {workers} workers did not start")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def tree_rss_mb(pid):
+    """RSS of ``pid`` and its children in MB (Linux), or None."""
+
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as handle:
+            pids = [pid, *map(int, handle.read().split())]
+        total = 0
+        for each in pids:
+            with open(f"/proc/{each}/statm") as statm:
+                total += int(statm.read().split()[1]) * bench._PAGE_SIZE
+        return round(total / 2**20, 1)
+    except OSError:
+        return None
+
+
+def run_client(job):
+    """One client process: ``threads`` clients replaying their share of ``actions``."""
+
+    port, db_path, seed, actions, threads, revalidate = job
+    server = HttpServer(port)
+    sampler = bench.RssSampler()  # not started: open/close still read the RSS of this client
+    samples = {}
+    lock = threading.Lock()
+    workers = [
+        threading.Thread(
+            target=bench.run_actions,
+            args=(server, bench.Workload(db_path, random.Random(f"{seed}:{n}")), actions[n::threads], sampler,
+                  samples, lock, revalidate),
+        )
+        for n in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return samples
+
+
+def replay(pool, port, db_path, seed, actions, clients, threads, revalidate):
+    jobs = [(port, db_path, f"{seed}:{n}", actions[n::clients], threads, revalidate) for n in range(clients)]
+    started = time.perf_counter()
+    samples = {}
+    for part in pool.map(run_client, jobs):
+        for label, entries in part.items():
+            samples.setdefault(label, []).extend(entries)
+    return samples, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure throughput against the number of server workers.")
+    parser.add_argument("--db", help="copy this database for every step instead of seeding one")
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=50_000)
+    parser.add_argument("--appointments", type=int, default=200_000)
+    parser.add_argument("--server-workers", default="1,2,4,8", help="comma-separated worker counts to measure")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="request threads per server worker")
+    parser.add_argument("--clients", type=int, default=max(2, (os.cpu_count() or 1) // 2), help="client processes")
+    parser.add_argument("--client-threads", type=int, default=8, help="concurrent clients in each client process")
+    parser.add_argument("--requests", type=int, default=3000, help="page loads per step (each is 1-4 requests)")
+    parser.add_argument("--warmup", type=int, default=200, help="page loads replayed before each step")
+    parser.add_argument("--no-revalidate", action="store_true", help="never send If-None-Match")
+    parser.add_argument("--seed", type=int, default=5003)
+    parser.add_argument("--seed-workers", type=int, default=os.cpu_count() or 1, help="processes used for seeding")
+    parser.add_argument("--output", default="scaling_results.json", help="where to write the JSON results")
+    args = parser.parse_args(argv)
+    counts = [int(count) for count in args.server_workers.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="hospital-scaling-")
+    if args.db:
+        source = args.db
+    else:
+        seed_args = argparse.Namespace(**vars(args), workers=args.seed_workers)
+        source = bench.seed_database(seed_args)
+    names, weights = zip(*bench.MIX.items())
+    rng = random.Random(args.seed)
+    warmup = rng.choices(names, weights, k=args.warmup)
+    actions = rng.choices(names, weights, k=args.requests)
+    revalidate = not args.no_revalidate
+
+    steps = []
+    pool = multiprocessing.get_context("fork").Pool(args.clients)
+    try:
+        for workers in counts:
+            db_path = os.path.join(workdir, f"workers-{workers}.db")
+            shutil.copyfile(source, db_path)
+            port = free_port()
+            server = start_server(db_path, port, workers, args.threads)
+            try:
+                replay(pool, port, db_path, args.seed, warmup, args.clients, args.client_threads, revalidate)
+                samples, wall_seconds = replay(pool, port, db_path, args.seed, actions, args.clients,
+                                               args.client_threads, revalidate)
+                rss = tree_rss_mb(server.pid)
+            finally:
+                stop_server(server)
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(db_path + suffix):
+                        os.remove(db_path + suffix)
+            latencies = [elapsed * 1000 for entries in samples.values() for elapsed, _, _ in entries]
+            step = {
+                "workers": workers,
+                "requests": len(latencies),
+                "errors": sum(1 for entries in samples.values() for _, status, _ in entries if status >= 500),
+                "wall_seconds": round(wall_seconds, 3),
+                "throughput_rps": round(len(latencies) / max(wall_seconds, 1e-9), 1),
+                "p50_ms": round(bench.percentile(latencies, 0.50), 3),
+                "p95_ms": round(bench.percentile(latencies, 0.95), 3),
+                "p99_ms": round(bench.percentile(latencies, 0.99), 3),
+                "server_rss_mb": rss,
+            }
+            step["speedup"] = round(step["throughput_rps"] / steps[0]["throughput_rps"], 2) if steps else 1.0
+            steps.append(step)
+            print(f"{workers:>3} workers: {step['throughput_rps']:>8.1f} req/s (x{step['speedup']}), "
+                  f"p50 {step['p50_ms']:.1f} ms, p99 {step['p99_ms']:.1f} ms, {step['errors']} errors, "
+                  f"server RSS {rss} MB")
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+        if not args.db:
+            shutil.rmtree(os.path.dirname(source), ignore_errors=True)
+
+    results = {
+        "meta": {
+            "revision": bench.git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "scale": {"doctors": args.doctors, "patients": args.patients, "appointments": args.appointments}
+            if not args.db else {"db": args.db},
+            "requests": args.requests,
+            "threads_per_worker": args.threads,
+            "clients": args.clients,
+            "client_threads": args.client_threads,
+        },
+        "steps": steps,
+    }
+    with open(args.output, "w") as handle:
+        dump(results, handle, indent=2, sort_keys=True)
+    print(f"-> {args.output}")
+    return 1 if any(step["errors"] for step in steps) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""生成任意规模的模拟数据，用于压测查询计划和内存占用。
+
+示例:
+    python dataset/generate.py --patients 1000000 --appointments 10000000 --out /tmp/big
+    python dataset/init_db.py --data-dir /tmp/big
+    python dataset/generate.py --appointments 5000000 --db big.db   # 直接写入 SQLite
+
+数据按块生成，每块由独立的随机数种子 (seed, 表, 块号) 决定，因此多进程
+并行生成的结果与单进程完全一致。预约、治疗和账单在同一块内一起生成:
+第 i 个治疗对应第 i 个预约按比例映射后的预约，账单同理，保证外键和病人一致。
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, CURRENT_DIR)
+
+from init_db import (  # noqa: E402
+    RAW_DATA_DIR,
+    begin_bulk_load,
+    connect,
+    finish_bulk_load,
+    prepare_rebuild,
+    report_rate,
+    reset_database,
+)
+from backend import backup  # noqa: E402  (init_db 已把项目根目录加入 sys.path)
+
+CHUNK_ROWS = 50_000
+
+# 与 raw_data 中的 CSV 表头一致
+HEADERS = {
+    "doctors": ["doctor_id", "first_name", "last_name", "specialization", "phone_number",
+                "years_experience", "hospital_branch", "email"],
+    "patients": ["patient_id", "first_name", "last_name", "gender", "date_of_birth", "contact_number",
+                 "address", "registration_date", "insurance_provider", "insurance_number", "email"],
+    "appointments": ["appointment_id", "patient_id", "doctor_id", "appointment_date", "appointment_time",
+                     "reason_for_visit", "status"],
+    "treatments": ["treatment_id", "appointment_id", "treatment_type", "description", "cost", "treatment_date"],
+    "billing": ["bill_id", "patient_id", "treatment_id", "bill_date", "amount", "payment_method", "payment_status"],
+}
+# CSV 中各 id 列的前缀 (D001 / P001 / A001 / T001 / B001)
+ID_PREFIXES = {"doctor_id": "D", "patient_id": "P", "appointment_id": "A", "treatment_id": "T", "bill_id": "B"}
+
+FIRST_NAMES = ["David", "Emily", "Michael", "Sarah", "James", "Linda", "Robert", "Jane", "William", "Alex",
+               "Laura", "Daniel", "Sophia", "Wei", "Mei", "Chen", "Olivia", "Ethan", "Priya", "Arjun"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Taylor", "Davis", "Wilson", "Moore", "Wang",
+              "Li", "Zhang", "Garcia", "Miller", "Patel", "Khan", "Lee", "Martin", "Clark", "Lewis"]
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Maple Dr", "Cedar Ln", "Elm St", "Lake Rd", "Hill St"]
+SPECIALIZATIONS = ["Pediatrics", "Dermatology", "Oncology", "Cardiology", "Orthopedics", "Neurology"]
+BRANCHES = ["Central Hospital", "Westside Clinic", "Eastside Clinic"]
+INSURERS = ["MedCare Plus", "WellnessCorp", "PulseSecure", "HealthIndia"]
+REASONS = (["Checkup", "Consultation", "Therapy", "Follow-up", "Emergency"], [45, 43, 42, 41, 29])
+TREATMENTS = {"Chemotherapy": 4000.0, "X-Ray": 300.0, "ECG": 250.0, "Physiotherapy": 600.0, "MRI": 1500.0}
+TREATMENT_TYPES = list(TREATMENTS)
+DESCRIPTIONS = ["Standard procedure", "Advanced protocol", "Basic screening"]
+PAYMENT_METHODS = (["Credit Card", "Insurance", "Cash"], [38, 32, 30])
+# 过去的预约大多已完成；未来的预约都是 Scheduled
+PAST_STATUSES = (["Completed", "Cancelled", "No-show", "Scheduled"], [62, 15, 10, 13])
+PAYMENT_STATUSES = (["Paid", "Pending", "Failed"], [70, 22, 8])
+# 季节性: 冬季呼吸道高峰、夏季低谷；周末门诊量低
+MONTH_WEIGHTS = [1.30, 1.25, 1.10, 0.95, 0.90, 0.85, 0.80, 0.85, 0.95, 1.05, 1.15, 1.30]
+WEEKDAY_WEIGHTS = [1.2, 1.1, 1.1, 1.0, 1.0, 0.45, 0.25]
+# 上午高峰的 15 分钟号源
+SLOTS = [f"{minute // 60:02d}:{minute % 60:02d}:00" for minute in range(8 * 60, 18 * 60, 15)]
+SLOT_WEIGHTS = [1.6 if minute < 12 * 60 else 1.0 for minute in range(8 * 60, 18 * 60, 15)]
+
+
+# ================= 偏斜分布 =================
+def skewed_id(rng, count, skew):
+    """1..count 之间的 id，skew 越大越集中在小号 (热门医生 / 常客)。"""
+
+    return min(count, int(count * rng.random() ** skew) + 1)
+
+
+def evenly_mapped(index, numerator, denominator):
+    """把 index 按 numerator/denominator 的比例映射；不命中时返回 None。
+
+    用于"第 i 个预约是否有治疗、治疗编号是多少"，不依赖其它块的结果。
+    """
+
+    current = index * numerator // denominator
+    previous = (index - 1) * numerator // denominator
+    return current if current > previous else None
+
+
+def weighted_days(start, end):
+    days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+    weights = [MONTH_WEIGHTS[day.month - 1] * WEEKDAY_WEIGHTS[day.weekday()] for day in days]
+    return [day.isoformat() for day in days], weights
+
+
+def chunk_rng(seed, table, chunk):
+    return random.Random(f"{seed}:{table}:{chunk}")
+
+
+# ================= 各表生成 (在工作进程中运行) =================
+def gen_doctors(config, chunk, first, last):
+    rng = chunk_rng(config["seed"], "doctors", chunk)
+    rows = []
+    for doctor_id in range(first, last + 1):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        rows.append((
+            doctor_id, first_name, last_name, rng.choice(SPECIALIZATIONS),
+            str(rng.randrange(6_000_000_000, 10_000_000_000)), rng.randint(1, 35), rng.choice(BRANCHES),
+            f"dr.{first_name.lower()}.{last_name.lower()}{doctor_id}@hospital.com",
+        ))
+    return {"doctors": rows}
+
+
+def gen_patients(config, chunk, first, last):
+    rng = chunk_rng(config["seed"], "patients", chunk)
+    end = date.fromisoformat(config["end"])
+    rows = []
+    for patient_id in range(first, last + 1):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        birth = date(1940, 1, 1) + timedelta(days=rng.randrange(80 * 365))
+        registered = end - timedelta(days=rng.randrange(10 * 365))
+        rows.append((
+            patient_id, first_name, last_name, rng.choice("MF"), birth.isoformat(),
+            str(rng.randrange(6_000_000_000, 10_000_000_000)),
+            f"{rng.randint(1, 999)} {rng.choice(STREETS)}", registered.isoformat(), rng.choice(INSURERS),
+            f"INS{rng.randrange(100_000, 1_000_000)}", f"{first_name.lower()}.{last_name.lower()}{patient_id}@mail.com",
+        ))
+    return {"patients": rows}
+
+
+def gen_visits(config, chunk, first, last):
+    """一块预约，连同落在这块预约上的治疗和账单。"""
+
+    rng = chunk_rng(config["seed"], "appointments", chunk)
+    days, day_weights = weighted_days(date.fromisoformat(config["start"]), date.fromisoformat(config["end"]))
+    today = config["today"]
+    past_days = [day for day in days if day < today]
+    past_cum_weights = list(itertools.accumulate(day_weights[:len(past_days)]))
+    counts = config["counts"]
+    size = last - first + 1
+
+    visit_days = rng.choices(days, day_weights, k=size)
+    times = rng.choices(SLOTS, SLOT_WEIGHTS, k=size)
+    reasons = rng.choices(*REASONS, k=size)
+    past_statuses = rng.choices(*PAST_STATUSES, k=size)
+
+    appointments, treatments, bills = [], [], []
+    for n, appointment_id in enumerate(range(first, last + 1)):
+        patient_id = skewed_id(rng, counts["patients"], config["patient_skew"])
+        day = visit_days[n]
+        status = past_statuses[n] if day < today else "Scheduled"
+
+        # 有治疗的预约一定已经完成，日期改抽过去的某天
+        treatment_id = evenly_mapped(appointment_id, counts["treatments"], counts["appointments"])
+        if treatment_id is not None:
+            status = "Completed"
+            if day >= today and past_days:
+                day = rng.choices(past_days, cum_weights=past_cum_weights)[0]
+        appointments.append((
+            appointment_id, patient_id, skewed_id(rng, counts["doctors"], config["doctor_skew"]),
+            day, times[n], reasons[n], status,
+        ))
+        if treatment_id is None:
+            continue
+
+        treatment_type = rng.choice(TREATMENT_TYPES)
+        cost = round(TREATMENTS[treatment_type] * rng.lognormvariate(0, 0.35), 2)
+        treatments.append((treatment_id, appointment_id, treatment_type, rng.choice(DESCRIPTIONS), cost, day))
+
+        bill_id = evenly_mapped(treatment_id, counts["billing"], counts["treatments"])
+        if bill_id is not None:
+            bills.append((
+                bill_id, patient_id, treatment_id, day, cost,
+                rng.choices(*PAYMENT_METHODS)[0], rng.choices(*PAYMENT_STATUSES)[0],
+            ))
+    return {"appointments": appointments, "treatments": treatments, "billing": bills}
+
+
+def run_job(job):
+    generator, config, chunk, first, last = job
+    tables = generator(config, chunk, first, last)
+    if config["format"] == "csv":
+        return {table: to_csv(table, rows, config["id_width"]) for table, rows in tables.items()}
+    return tables
+
+
+# ================= 输出 =================
+def to_csv(table, rows, id_width):
+    """按 raw_data 的格式编码一块数据 (id 带前缀并补零)。"""
+
+    prefixes = [ID_PREFIXES.get(column) for column in HEADERS[table]]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow([
+            value if prefix is None or value is None else f"{prefix}{value:0{id_width}d}"
+            for prefix, value in zip(prefixes, row)
+        ])
+    return buffer.getvalue()
+
+
+def jobs_for(config, chunk_rows):
+    counts = config["counts"]
+    for generator, table in ((gen_doctors, "doctors"), (gen_patients, "patients"), (gen_visits, "appointments")):
+        for chunk, first in enumerate(range(1, counts[table] + 1, chunk_rows)):
+            yield generator, config, chunk, first, min(first + chunk_rows - 1, counts[table])
+
+
+def generate(config, workers, chunk_rows, out_dir=None, db_path=None, backup_dir=backup.DEFAULT_BACKUP_DIR):
+    written = dict.fromkeys(HEADERS, 0)
+    started = time.perf_counter()
+
+    if db_path:
+        prepare_rebuild(db_path, backup_dir)
+        conn = connect(db_path)
+        reset_database(conn)
+        deferred = begin_bulk_load(conn)
+        inserts = {
+            table: f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            for table, columns in HEADERS.items()
+        }
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        files = {table: open(os.path.join(out_dir, f"{table}.csv"), "w", newline="", encoding="utf-8")
+                 for table in HEADERS}
+        for table, handle in files.items():
+            handle.write(",".join(HEADERS[table]) + "\n")
+
+    # imap 保持块的顺序，所以输出与进程数无关
+    with multiprocessing.Pool(workers) as pool:
+        for tables in pool.imap(run_job, jobs_for(config, chunk_rows)):
+            for table, data in tables.items():
+                if db_path:
+                    conn.executemany(inserts[table], data)
+                    written[table] += len(data)
+                else:
+                    files[table].write(data)
+                    written[table] += data.count("\n")
+            if db_path:
+                conn.commit()
+
+    elapsed = time.perf_counter() - started
+    for table, rows in written.items():
+        print(f" {table}: {rows} 行")
+    report_rate("生成完成", sum(written.values()), elapsed)
+
+    if db_path:
+        finish_bulk_load(conn, deferred)
+        conn.close()
+    else:
+        for handle in files.values():
+            handle.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic hospital dataset of any size.")
+    parser.add_argument("--doctors", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--appointments", type=int, default=1_000_000)
+    parser.add_argument("--treatments", type=int, help="default: 60%% of appointments (at most one per appointment)")
+    parser.add_argument("--bills", type=int, help="default: 90%% of treatments (at most one per treatment)")
+    parser.add_argument("--seed", type=int, default=5003)
+    parser.add_argument("--start", default="2022-01-01", help="first appointment date")
+    parser.add_argument("--end", default="2025-12-31", help="last appointment date")
+    parser.add_argument("--today", default=date.today().isoformat(),
+                        help="visits before this date are past (completed, cancelled, ...); fix it for reproducible output")
+    parser.add_argument("--doctor-skew", type=float, default=3.0, help="higher = a few doctors get most visits")
+    parser.add_argument("--patient-skew", type=float, default=1.5, help="higher = more repeat patients")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--out", help=f"directory for the CSV files (e.g. {RAW_DATA_DIR})")
+    target.add_argument("--db", help="write straight into this SQLite database instead (drops existing data)")
+    parser.add_argument("--backup-dir", default=backup.DEFAULT_BACKUP_DIR,
+                        help="with --db: where to snapshot the existing database before replacing it")
+    parser.add_argument("--no-backup", action="store_true", help="with --db: replace it without a snapshot")
+    args = parser.parse_args(argv)
+
+    treatments = args.treatments if args.treatments is not None else args.appointments * 6 // 10
+    bills = args.bills if args.bills is not None else treatments * 9 // 10
+    if min(args.doctors, args.patients) < 1 and args.appointments:
+        parser.error("appointments need at least one doctor and one patient")
+    if treatments > args.appointments or bills > treatments:
+        parser.error("need bills <= treatments <= appointments")
+    if date.fromisoformat(args.end) < date.fromisoformat(args.start):
+        parser.error("--end must not be before --start")
+    if not args.out and not args.db:
+        parser.error("one of --out or --db is required")
+
+    counts = {
+        "doctors": args.doctors,
+        "patients": args.patients,
+        "appointments": args.appointments,
+        "treatments": treatments,
+        "billing": bills,
+    }
+    config = {
+        "seed": args.seed,
+        "start": args.start,
+        "end": args.end,
+        "today": args.today,
+        "counts": counts,
+        "doctor_skew": args.doctor_skew,
+        "patient_skew": args.patient_skew,
+        "format": "db" if args.db else "csv",
+        "id_width": max(3, int(math.log10(max(counts.values()) or 1)) + 1),
+    }
+    generate(config, max(1, args.workers), args.chunk_rows, out_dir=args.out, db_path=args.db,
+             backup_dir=None if args.no_backup else args.backup_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,123 @@
-import sqlite3
-import pandas as pd
+import argparse
+import csv
+import itertools
 import os
+import re
+import string
+import sys
+import time
 
 # ================= 配置路径 =================
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(CURRENT_DIR))  # 使 backend 包可被导入
+
+from backend import backup, etag, stats  # noqa: E402
+from backend.archive import archive_path  # noqa: E402
+from backend.db import connect  # noqa: E402
+from backend.schema import migrate  # noqa: E402
+
 DB_PATH = os.path.join(os.path.dirname(CURRENT_DIR), 'hospital.db')
 RAW_DATA_DIR = os.path.join(CURRENT_DIR, 'raw_data')
 
+# 按外键依赖顺序导入
+CSV_FILES = [
+    ('doctors.csv', 'doctors'),
+    ('patients.csv', 'patients'),
+    ('appointments.csv', 'appointments'),
+    ('treatments.csv', 'treatments'),
+    ('billing.csv', 'billing'),
+]
+CHUNK_ROWS = 50_000  # 每批 executemany 的行数，内存占用与此成正比
+
+ID_COLUMNS = {'doctor_id', 'patient_id', 'appointment_id', 'treatment_id', 'bill_id'}
+MONEY_COLUMNS = {'cost', 'amount'}
+INT_COLUMNS = {'years_experience'}
+
+_DIGITS = re.compile(r'\d+')
+_ID_PREFIX = string.ascii_letters + string.whitespace
+
+
+# ================= 字段转换 =================
+def to_text(value):
+    value = value.strip()
+    return value or None
+
+
+def to_id(value):
+    # 智能去字母处理 (D001 -> 1)；常见格式走快速路径，其余再用正则
+    try:
+        return int(value.lstrip(_ID_PREFIX))
+    except ValueError:
+        match = _DIGITS.search(value)
+        return int(match.group()) if match else None
+
+
+def to_money(value):
+    value = value.strip().replace('$', '').replace(',', '')
+    return float(value) if value else None
+
+
+def to_int(value):
+    value = value.strip()
+    return int(float(value)) if value else None
+
+
+def converter_for(column):
+    if column in ID_COLUMNS:
+        return to_id
+    if column in MONEY_COLUMNS:
+        return to_money
+    if column in INT_COLUMNS:
+        return to_int
+    return to_text
+
+
+# ================= 流式导入 =================
+def drop_deferred_objects(conn, tables):
+    """删除二级索引和触发器，返回其建表语句，导入完成后再重建。"""
+
+    placeholders = ', '.join('?' * len(tables))
+    objects = conn.execute(
+        f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        """,
+        tables,
+    ).fetchall()
+    for kind, name, _ in objects:
+        conn.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+    conn.commit()
+    return [sql for _, _, sql in objects]
+
+
+def import_csv(conn, file_path, table_name, chunk_rows=CHUNK_ROWS):
+    """逐块读取 CSV 并用 executemany 写入，返回导入行数。"""
+
+    with open(file_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader)]
+        converters = [converter_for(column) for column in header]
+        sql = f"INSERT INTO {table_name} ({', '.join(header)}) VALUES ({', '.join('?' * len(header))})"
+
+        total = 0
+        while True:
+            chunk = [
+                tuple(convert(value) for convert, value in zip(converters, row))
+                for row in itertools.islice(reader, chunk_rows)
+                if row
+            ]
+            if not chunk:
+                break
+            conn.executemany(sql, chunk)
+            conn.commit()
+            total += len(chunk)
+    return total
+
+
+def reset_database(conn):
+    """删除所有表并按 backend/schema.py 的迁移重新建表。"""
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    cursor.execute("PRAGMA foreign_keys = ON;")
 
     # ================= 1. 清理旧表 =================
     print("清理旧数据表")
@@ -20,148 +126,123 @@ def init_db():
     cursor.execute("DROP TABLE IF EXISTS appointments")
     cursor.execute("DROP TABLE IF EXISTS patients")
     cursor.execute("DROP TABLE IF EXISTS doctors")
+    cursor.execute("DROP TABLE IF EXISTS patients_fts")
+    cursor.execute("DROP TABLE IF EXISTS doctors_fts")
+    cursor.execute("DROP TABLE IF EXISTS stats_counters")
+    cursor.execute("DROP TABLE IF EXISTS stats_daily")
+    # 变更日志里的 id 属于旧数据；重建后客户端凭旧的 Last-Event-ID 会收到 reset
+    cursor.execute("DROP TABLE IF EXISTS appointment_changes")
+    cursor.execute("DROP TABLE IF EXISTS changes_paused")
+    cursor.execute("DROP TABLE IF EXISTS change_versions")
+    cursor.execute("DROP TABLE IF EXISTS schema_version")
+    conn.commit()
 
-    # ================= 2. 创建表结构 =================
-    print("创建新表结构")
-
-    # Doctors
-    cursor.execute("""
-                   CREATE TABLE doctors
-                   (
-                       doctor_id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                       first_name       TEXT        NOT NULL,
-                       last_name        TEXT        NOT NULL,
-                       specialization   TEXT,
-                       phone_number     TEXT,
-                       years_experience INTEGER,
-                       hospital_branch  TEXT,
-                       email            TEXT UNIQUE NOT NULL
-                   );
-                   """)
-
-    # Patients (注意：已移除 email 的 UNIQUE 约束)
-    cursor.execute("""
-                   CREATE TABLE patients
-                   (
-                       patient_id         INTEGER PRIMARY KEY AUTOINCREMENT,
-                       first_name         TEXT NOT NULL,
-                       last_name          TEXT NOT NULL,
-                       gender             TEXT,
-                       date_of_birth      DATE,
-                       contact_number     TEXT,
-                       address            TEXT,
-                       registration_date  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                       insurance_provider TEXT,
-                       insurance_number   TEXT,
-                       email              TEXT NOT NULL
-                   );
-                   """)
-
-    # Appointments
-    cursor.execute("""
-                   CREATE TABLE appointments
-                   (
-                       appointment_id   INTEGER PRIMARY KEY AUTOINCREMENT,
-                       patient_id       INTEGER NOT NULL,
-                       doctor_id        INTEGER NOT NULL,
-                       appointment_date DATE    NOT NULL,
-                       appointment_time TIME    NOT NULL,
-                       reason_for_visit TEXT,
-                       status           TEXT DEFAULT 'Scheduled',
-                       FOREIGN KEY (patient_id) REFERENCES patients (patient_id) ON DELETE CASCADE,
-                       FOREIGN KEY (doctor_id) REFERENCES doctors (doctor_id) ON DELETE SET NULL
-                   );
-                   """)
-
-    # Treatments
-    cursor.execute("""
-                   CREATE TABLE treatments
-                   (
-                       treatment_id   INTEGER PRIMARY KEY AUTOINCREMENT,
-                       appointment_id INTEGER NOT NULL,
-                       treatment_type TEXT,
-                       description    TEXT,
-                       cost           REAL    NOT NULL,
-                       treatment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                       FOREIGN KEY (appointment_id) REFERENCES appointments (appointment_id) ON DELETE CASCADE
-                   );
-                   """)
-
-    # Billing
-    cursor.execute("""
-                   CREATE TABLE billing
-                   (
-                       bill_id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                       patient_id     INTEGER NOT NULL,
-                       treatment_id   INTEGER NOT NULL,
-                       bill_date      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                       amount         REAL    NOT NULL,
-                       payment_method TEXT,
-                       payment_status TEXT      DEFAULT 'Unpaid',
-                       FOREIGN KEY (patient_id) REFERENCES patients (patient_id),
-                       FOREIGN KEY (treatment_id) REFERENCES treatments (treatment_id)
-                   );
-                   """)
-
-    # ================= 3. 创建索引 (优化部分) =================
-    print("创建索引以优化查询速度")
-
-    # 场景：医生查看某一天的排班 (WHERE appointment_date = ?)
-    cursor.execute("CREATE INDEX idx_appointment_date ON appointments(appointment_date);")
-
-    # 场景：查询某个病人的所有历史预约 (WHERE patient_id = ?)
-    cursor.execute("CREATE INDEX idx_appointment_patient ON appointments(patient_id);")
-
-    # 场景：财务查看所有未支付的账单 (WHERE payment_status = 'Unpaid')
-    cursor.execute("CREATE INDEX idx_billing_status ON billing(payment_status);")
-
-    # 场景：根据名字搜索医生 (WHERE last_name = ?)
-    cursor.execute("CREATE INDEX idx_doctor_name ON doctors(last_name, first_name);")
-
-    # ================= 4. 导入数据 =================
-    print("导入初始数据")
+    # ================= 2. 创建表结构和索引 =================
+    # 表结构与索引统一定义在 backend/schema.py 的迁移中
+    print("创建新表结构和索引")
+    version = migrate(conn)
+    print(f"schema 版本: {version}")
+
+
+def begin_bulk_load(conn):
+    """导入期间不维护索引、触发器和外键；返回结束后需要重建的对象。"""
+
+    deferred = drop_deferred_objects(conn, [table for _, table in CSV_FILES])
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    # 建索引时的排序落盘而不是占用内存，大数据量下内存保持平稳
+    conn.execute("PRAGMA temp_store = FILE")
+    conn.execute("PRAGMA mmap_size = 0")
+    return deferred
+
+
+def finish_bulk_load(conn, deferred):
+    """一次性重建索引、触发器、全文索引和统计，并校验外键。"""
+
+    print("重建索引和触发器")
+    rebuild_started = time.perf_counter()
+    for sql in deferred:
+        conn.execute(sql)
+    conn.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO doctors_fts (doctors_fts) VALUES ('rebuild')")
+    stats.rebuild(conn)
+    # 导入期间触发器未运行，作废所有已发出的 ETag
+    etag.new_epoch(conn)
+    conn.commit()
+    print(f" 重建完成: {time.perf_counter() - rebuild_started:.1f}s")
+
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    violations = conn.execute("PRAGMA foreign_key_check")
+    first = violations.fetchone()
+    if first:
+        count = 1 + sum(1 for _ in violations)
+        print(f"警告: {count} 行违反外键约束 (例如 {first['table']} rowid={first['rowid']})")
+
+
+def report_rate(label, rows, elapsed):
+    print(f"{label}: {rows} 行, {elapsed:.1f}s, {rows / max(elapsed, 1e-9):,.0f} 行/秒")
 
-    def import_csv(file_name, table_name):
-        file_path = os.path.join(RAW_DATA_DIR, file_name)
+
+def remove_archive(db_path):
+    """删除归档库：其中的旧记录与重新导入的数据 id 重叠。"""
+
+    for suffix in ('', '-wal', '-shm'):
+        path = archive_path(db_path) + suffix
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def prepare_rebuild(db_path, backup_dir=backup.DEFAULT_BACKUP_DIR):
+    """重建会删除所有表：先给现有数据库留一份快照（backup_dir=None 跳过），再删除归档库。"""
+
+    if backup_dir and os.path.exists(db_path):
+        manifest = backup.snapshot(db_path, backup_dir, keep=0)
+        print(f"已备份现有数据库: {manifest['path']}")
+    remove_archive(db_path)
+
+
+def init_db(db_path=DB_PATH, data_dir=RAW_DATA_DIR, chunk_rows=CHUNK_ROWS, backup_dir=backup.DEFAULT_BACKUP_DIR):
+    prepare_rebuild(db_path, backup_dir)
+    conn = connect(db_path)
+    reset_database(conn)
+
+    # ================= 3. 导入数据 =================
+    print("导入初始数据")
+    deferred = begin_bulk_load(conn)
+    started = time.perf_counter()
+    loaded = 0
+    for file_name, table_name in CSV_FILES:
+        file_path = os.path.join(data_dir, file_name)
         if not os.path.exists(file_path):
             print(f"警告: 找不到文件 {file_name}")
-            return
-
+            continue
         try:
-            df = pd.read_csv(file_path)
-            df.columns = df.columns.str.strip()
-
-            # 智能去字母处理 (D001 -> 1)
-            id_cols = ['doctor_id', 'patient_id', 'appointment_id', 'treatment_id', 'bill_id']
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    df[col] = df[col].apply(lambda x: x.strip() if isinstance(x, str) else x)
-                if col in id_cols and df[col].dtype == 'object':
-                    df[col] = df[col].astype(str).str.extract(r'(\d+)').astype(float).astype('Int64')
-
-            # 金额处理
-            float_cols = ['cost', 'amount']
-            for col in float_cols:
-                if col in df.columns and df[col].dtype == 'object':
-                    df[col] = df[col].astype(str).str.replace('$', '', regex=False)
-
-            df.to_sql(table_name, conn, if_exists='append', index=False)
-            print(f" {table_name} 导入成功")
-
+            table_started = time.perf_counter()
+            rows = import_csv(conn, file_path, table_name, chunk_rows)
+            loaded += rows
+            report_rate(f" {table_name} 导入成功", rows, time.perf_counter() - table_started)
         except Exception as e:
+            conn.rollback()
             print(f" {table_name} 导入失败: {e}")
 
-    # 按顺序导入
-    import_csv('doctors.csv', 'doctors')
-    import_csv('patients.csv', 'patients')
-    import_csv('appointments.csv', 'appointments')
-    import_csv('treatments.csv', 'treatments')
-    import_csv('billing.csv', 'billing')
-
-    conn.commit()
+    # ================= 4. 重建索引、全文索引和统计 =================
+    finish_bulk_load(conn, deferred)
     conn.close()
-    print("数据库初始化完成！(包含索引优化)")
+    report_rate("数据库初始化完成！总计", loaded, time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the hospital database from CSV files.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--data-dir", default=RAW_DATA_DIR, help="directory holding the CSV files")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per executemany batch")
+    parser.add_argument("--backup-dir", default=backup.DEFAULT_BACKUP_DIR,
+                        help="where to snapshot the existing database before rebuilding it")
+    parser.add_argument("--no-backup", action="store_true", help="rebuild without snapshotting the old database")
+    args = parser.parse_args(argv)
+    init_db(args.db, args.data_dir, args.chunk_rows, None if args.no_backup else args.backup_dir)
 
 
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def app(tmp_path):
+    from backend.app import create_app
+
+    return create_app({
+        "TESTING": True,
+        "DB_PATH": str(tmp_path / "hospital.db"),
+        "SLOW_QUERY_LOG": str(tmp_path / "slow_queries.log"),
+    })
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def seeded(client):
+    """One doctor and one patient; returns their ids."""
+
+    doctor = client.post("/admin/doctors", json={"first_name": "Ada", "last_name": "Lee", "specialization": "Oncology",
+                                                  "hospital_branch": "Central"}).get_json()["doctor_id"]
+    patient = client.post("/admin/patients", json={"first_name": "Bo", "last_name": "Chan"}).get_json()["patient_id"]
+    return doctor, patient
@@ -0,0 +1,49 @@
+import threading
+
+
+def book_concurrently(app, requests):
+    """POST each ``(path, body)`` from its own thread and client; returns the responses in order."""
+
+    responses = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def post(index, path, body):
+        client = app.test_client()
+        start.wait()
+        responses[index] = client.post(path, json=body)
+
+    threads = [threading.Thread(target=post, args=(index, *request)) for index, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return responses
+
+
+def slot(seeded, time="09:00"):
+    doctor, patient = seeded
+    return {"patient_id": patient, "doctor_id": doctor, "appointment_date": "2099-01-05", "appointment_time": time}
+
+
+def test_one_of_two_bookings_of_a_slot_wins(app, seeded):
+    first, second = book_concurrently(app, [("/appointments", slot(seeded)), ("/appointments", slot(seeded, "09:15"))])
+
+    assert sorted((first.status_code, second.status_code)) == [201, 409]
+    won, lost = (first, second) if first.status_code == 201 else (second, first)
+    assert lost.get_json()["conflicting_appointment_id"] == won.get_json()["appointment_id"]
+
+
+def test_single_and_bulk_bookings_of_a_slot_do_not_both_win(app, client, seeded):
+    single, bulk = book_concurrently(app, [
+        ("/appointments", slot(seeded)),
+        ("/appointments/bulk", {"items": [slot(seeded, "09:10")]}),
+    ])
+
+    if single.status_code == 201:
+        assert bulk.status_code == 400
+        assert bulk.get_json()["results"][0]["conflicting_appointment_id"] == single.get_json()["appointment_id"]
+    else:
+        assert (single.status_code, bulk.status_code) == (409, 201)
+        assert single.get_json()["conflicting_appointment_id"] == bulk.get_json()["results"][0]["appointment_id"]
+    doctor, _ = seeded
+    assert len(client.get(f"/doctors/{doctor}/appointments").get_json()) == 1
@@ -0,0 +1,110 @@
+import pytest
+
+from backend import archive, stats
+from backend.db import connect
+
+
+@pytest.fixture
+def history(app, seeded):
+    """Closed, paid visits from 2020 (due for archiving) plus one upcoming visit."""
+
+    doctor, patient = seeded
+    conn = connect(app.config["DB_PATH"])
+    archive.attach(conn, app.config["ARCHIVE_PATH"])
+    with conn:
+        for day in range(1, 11):
+            appointment = conn.execute(
+                "INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, status) "
+                "VALUES (?, ?, ?, '09:00', 'Completed')",
+                (patient, doctor, f"2020-03-{day:02d}"),
+            ).lastrowid
+            treatment = conn.execute(
+                "INSERT INTO treatments (appointment_id, treatment_type, cost, treatment_date) VALUES (?, 'MRI', 100.1, ?)",
+                (appointment, f"2020-03-{day:02d}"),
+            ).lastrowid
+            conn.execute(
+                "INSERT INTO billing (patient_id, treatment_id, bill_date, amount, payment_method, payment_status) "
+                "VALUES (?, ?, ?, 100.1, 'Card', 'Paid')",
+                (patient, treatment, f"2020-03-{day:02d}"),
+            )
+        conn.execute(
+            "INSERT INTO appointments (patient_id, doctor_id, appointment_date, appointment_time, status) "
+            "VALUES (?, ?, '2099-01-01', '10:00', 'Scheduled')",
+            (patient, doctor),
+        )
+    yield conn
+    conn.close()
+
+
+def daily(conn):
+    return {(row["metric"], row["day"]): round(row["value"], 6) for row in conn.execute("SELECT * FROM stats_daily")}
+
+
+def test_archiving_leaves_the_dashboard_unchanged(client, history):
+    before = client.get("/admin/dashboard").get_json()
+    rollups = daily(history)
+
+    moved = archive.run(history, after_days=30, pause_seconds=0)
+    assert moved["appointments"] == 10
+
+    assert client.get("/admin/dashboard").get_json() == before
+    assert daily(history) == rollups
+
+    # A rebuild counts the archive as well, so it agrees with the triggers.
+    with history:
+        stats.rebuild(history, archive.stats_sources(history))
+    assert client.get("/admin/dashboard").get_json() == before
+    assert daily(history) == rollups
+
+
+def test_purging_archived_history_updates_the_dashboard(client, history, seeded):
+    _, patient = seeded
+    archive.run(history, after_days=30, pause_seconds=0)
+
+    assert client.delete(f"/admin/patients/{patient}").status_code == 200
+    counts = {row["name"]: row["value"] for row in history.execute("SELECT * FROM stats_counters")}
+    assert counts["appointments"] == counts["treatments"] == counts["billing"] == 0
+    assert all(abs(value) < 1e-6 for value in daily(history).values())
+
+
+def test_updating_archived_records_is_refused(client, history):
+    archive.run(history, after_days=30, pause_seconds=0)
+    appointment = history.execute("SELECT MIN(appointment_id) FROM archive.appointments").fetchone()[0]
+    bill = history.execute("SELECT MIN(bill_id) FROM archive.billing").fetchone()[0]
+
+    response = client.put(f"/admin/appointments/{appointment}", json={"status": "Cancelled"})
+    assert response.status_code == 409
+    assert response.get_json() == {"error": "Appointment is archived and read-only"}
+    response = client.put(f"/admin/billing/{bill}", json={"payment_status": "Pending"})
+    assert response.status_code == 409
+    assert client.put(f"/appointments/{appointment}", json={"reason_for_visit": "Follow-up"}).status_code == 409
+    assert client.put(f"/appointments/{appointment}/status", json={"status": "Cancelled"}).status_code == 409
+    assert client.delete(f"/appointments/{appointment}").status_code == 409
+
+    assert client.put("/admin/appointments/999999", json={"status": "Cancelled"}).status_code == 404
+    assert client.put("/admin/billing/999999", json={"payment_status": "Pending"}).status_code == 404
+    assert client.put("/appointments/999999/status", json={"status": "Cancelled"}).status_code == 404
+    assert client.delete("/appointments/999999").status_code == 404
+    scheduled = history.execute("SELECT appointment_id FROM appointments").fetchone()[0]
+    assert client.put(f"/admin/appointments/{scheduled}", json={"status": "Cancelled"}).status_code == 200
+
+
+def test_copies_of_an_interrupted_batch_never_show_twice(client, history, seeded):
+    _, patient = seeded
+    # The first transaction of a batch committed, the second never ran.
+    with history:
+        for table in archive.ARCHIVED_TABLES:
+            columns = archive._columns(table)
+            history.execute(f"INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table}")
+    appointments = client.get(f"/patients/{patient}/appointments?history=all").get_json()
+    assert len(appointments) == 11
+
+    reopened = appointments[0]["appointment_id"]
+    with history:
+        history.execute("UPDATE appointments SET status = 'Scheduled' WHERE appointment_id = ?", (reopened,))
+    archive.run(history, after_days=30, pause_seconds=0)
+
+    ids = [row["appointment_id"] for row in client.get(f"/patients/{patient}/appointments?history=all").get_json()]
+    assert len(ids) == len(set(ids)) == 11
+    assert client.get("/admin/appointments?history=all&limit=50").get_json()["total"] == 11
+    assert history.execute("SELECT 1 FROM archive.appointments WHERE appointment_id = ?", (reopened,)).fetchone() is None
@@ -0,0 +1,30 @@
+from backend import backup
+
+
+def book(client, seeded, time):
+    doctor, patient = seeded
+    response = client.post("/appointments", json={"patient_id": patient, "doctor_id": doctor,
+                                                  "appointment_date": "2099-01-01", "appointment_time": time})
+    assert response.status_code == 201
+
+
+def last_event_id(client):
+    return client.get("/appointments/changes?last_event_id=0").get_json()["last_event_id"]
+
+
+def test_restoring_a_snapshot_resets_change_feeds(app, client, seeded, tmp_path):
+    book(client, seeded, "09:00")
+    manifest = backup.snapshot(app.config["DB_PATH"], str(tmp_path / "backups"), keep=0)
+    book(client, seeded, "10:00")
+    book(client, seeded, "11:00")
+    seen = last_event_id(client)
+
+    backup.restore(manifest["path"], app.config["DB_PATH"])
+    for position in (1, seen - 1, seen):
+        assert client.get(f"/appointments/changes?last_event_id={position}").get_json()["reset"] is True
+
+    # Ids clients already hold are never reused.
+    book(client, seeded, "10:00")
+    page = client.get(f"/appointments/changes?last_event_id={seen}").get_json()
+    assert page["reset"] is True
+    assert [change["change_id"] for change in page["changes"]] == [seen + 2]
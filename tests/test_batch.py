@@ -0,0 +1,26 @@
+import threading
+
+
+def post_batch(client, requests):
+    result = {}
+    worker = threading.Thread(
+        target=lambda: result.update(response=client.post("/batch", json={"requests": requests})), daemon=True
+    )
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive(), "batch did not return"
+    return result["response"]
+
+
+def test_event_streams_are_rejected_per_item(client, seeded):
+    doctor, _ = seeded
+    response = post_batch(client, [
+        {"path": "/appointments/changes", "headers": {"Accept": "text/event-stream"}},
+        {"path": f"/doctors/{doctor}"},
+    ])
+    assert response.status_code == 200
+    streamed, doctor_response = response.get_json()["responses"]
+    assert streamed["status"] == 400
+    assert "streamed" in streamed["body"]["error"]
+    assert doctor_response["status"] == 200
+    assert client.application.extensions["change_hub"].subscriber_count() == 0
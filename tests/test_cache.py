@@ -0,0 +1,41 @@
+import pytest
+
+from backend.app import create_app
+from backend.db import connect
+
+
+@pytest.fixture
+def app(tmp_path):
+    return create_app({
+        "TESTING": True,
+        "DB_PATH": str(tmp_path / "hospital.db"),
+        "SLOW_QUERY_LOG": str(tmp_path / "slow_queries.log"),
+        "CACHE_SHARED": True,
+        "CACHE_SHARED_CHECK_SECONDS": 0,
+    })
+
+
+@pytest.fixture
+def other_worker(app):
+    """A second app on the same database, like another worker process."""
+
+    return create_app({key: app.config[key] for key in ("TESTING", "DB_PATH", "SLOW_QUERY_LOG", "CACHE_SHARED",
+                                                         "CACHE_SHARED_CHECK_SECONDS")}).test_client()
+
+
+def test_shared_caches_follow_writes_from_anywhere(app, client, seeded, other_worker):
+    doctor, patient = seeded
+    assert other_worker.get(f"/doctors/{doctor}").get_json()["first_name"] == "Ada"
+    assert other_worker.get(f"/patients/{patient}").get_json()["first_name"] == "Bo"
+
+    assert client.put(f"/admin/doctors/{doctor}", json={"first_name": "Grace"}).status_code == 200
+    assert other_worker.get(f"/doctors/{doctor}").get_json()["first_name"] == "Grace"
+
+    # Writes that bypass the routes (and their invalidations) are noticed as well.
+    conn = connect(app.config["DB_PATH"])
+    with conn:
+        conn.execute("UPDATE patients SET first_name = 'Cy' WHERE patient_id = ?", (patient,))
+    assert other_worker.get(f"/patients/{patient}").get_json()["first_name"] == "Cy"
+    # Invalidating costs no write of its own.
+    assert conn.execute("SELECT COUNT(*) FROM change_versions WHERE scope = 'cache'").fetchone()[0] == 0
+    conn.close()
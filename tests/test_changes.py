@@ -0,0 +1,50 @@
+import os
+import sys
+
+from backend.db import connect
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset"))
+from init_db import reset_database  # noqa: E402
+
+
+def book(client, seeded, time="09:00"):
+    doctor, patient = seeded
+    response = client.post("/appointments", json={"patient_id": patient, "doctor_id": doctor,
+                                                  "appointment_date": "2099-01-01", "appointment_time": time})
+    assert response.status_code == 201
+
+
+def first_event(client, last_event_id):
+    response = client.get("/appointments/changes", headers={"Accept": "text/event-stream",
+                                                            "Last-Event-ID": str(last_event_id)})
+    try:
+        return next(response.response).decode()
+    finally:
+        response.close()
+
+
+def test_a_position_past_the_end_of_the_log_is_reset(client, seeded):
+    book(client, seeded)
+    last = client.get("/appointments/changes?last_event_id=0").get_json()["last_event_id"]
+    assert last > 0
+
+    page = client.get(f"/appointments/changes?last_event_id={last + 100}").get_json()
+    assert page == {"changes": [], "last_event_id": last, "reset": True}
+    assert first_event(client, last + 100) == f'id: {last}\nevent: reset\ndata: {{"last_event_id": {last}}}\n\n'
+
+    # A later event is not hidden behind the stale position.
+    book(client, seeded, "10:00")
+    page = client.get(f"/appointments/changes?last_event_id={last}").get_json()
+    assert [change["change_id"] for change in page["changes"]] == [last + 1]
+    assert page["reset"] is False
+
+
+def test_rebuilding_the_database_restarts_the_change_log(app, client, seeded):
+    book(client, seeded)
+    conn = connect(app.config["DB_PATH"])
+    try:
+        reset_database(conn)
+        assert conn.execute("SELECT COUNT(*) FROM appointment_changes").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_sequence WHERE name = 'appointment_changes'").fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,43 @@
+import pytest
+
+from backend.pagination import encode_cursor
+
+
+@pytest.fixture
+def patients_seen(client, seeded):
+    """Three patients with one visit each to the seeded doctor, newest last."""
+
+    doctor, first = seeded
+    patients = [first]
+    for name in ("Cy", "Di"):
+        patients.append(client.post("/admin/patients", json={"first_name": name, "last_name": "Chan"}).get_json()["patient_id"])
+    for day, patient in enumerate(patients, start=1):
+        response = client.post("/appointments", json={"patient_id": patient, "doctor_id": doctor,
+                                                      "appointment_date": f"2099-01-0{day}", "appointment_time": "09:00"})
+        assert response.status_code == 201
+    return doctor, patients
+
+
+def test_doctor_patients_pages_by_cursor(client, patients_seen):
+    doctor, patients = patients_seen
+    first = client.get(f"/doctors/{doctor}/patients?limit=2").get_json()
+    assert [item["patient"]["patient_id"] for item in first["items"]] == patients[:0:-1]
+    assert first["total"] == 3
+
+    rest = client.get(f"/doctors/{doctor}/patients?limit=2&cursor={first['next_cursor']}").get_json()
+    assert [item["patient"]["patient_id"] for item in rest["items"]] == patients[:1]
+    assert rest["next_cursor"] is None
+
+
+@pytest.mark.parametrize("values", [
+    ["a", "b"],
+    [1, 2],
+    ["last_visit", "desc", "2099-01-01", 1],
+    ["last_visit", "desc", 1, True],
+    ["date", "desc", 1, 1],
+])
+def test_doctor_patients_rejects_invalid_cursors(client, patients_seen, values):
+    doctor, _ = patients_seen
+    response = client.get(f"/doctors/{doctor}/patients?limit=2&cursor={encode_cursor(values)}")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "invalid cursor"}
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from backend.serve import worker_environment
+
+
+@pytest.fixture
+def environ(monkeypatch):
+    for name in list(os.environ):
+        if name.startswith("HOSPITAL_"):
+            monkeypatch.delenv(name)
+    # Registers the variables worker_environment sets, so they are undone afterwards.
+    for name in ("DB_AUTO_MIGRATE", "DB_POOL_SIZE", "CACHE_SHARED", "CHANGE_FEED_MAX_CLIENTS",
+                 "ARCHIVE_INTERVAL_SECONDS", "BACKUP_INTERVAL_SECONDS"):
+        monkeypatch.setenv(f"HOSPITAL_{name}", "")
+        monkeypatch.delenv(f"HOSPITAL_{name}")
+    return os.environ
+
+
+def test_change_feeds_leave_threads_for_requests(environ):
+    worker_environment(0, 2, 8)
+    assert environ["HOSPITAL_CHANGE_FEED_MAX_CLIENTS"] == "4"
+
+
+def test_change_feed_limit_is_capped_below_threads(environ):
+    environ["HOSPITAL_CHANGE_FEED_MAX_CLIENTS"] = "64"
+    worker_environment(0, 2, 8)
+    assert environ["HOSPITAL_CHANGE_FEED_MAX_CLIENTS"] == "7"
+
+    environ["HOSPITAL_CHANGE_FEED_MAX_CLIENTS"] = "64"
+    worker_environment(0, 1, 1)
+    assert environ["HOSPITAL_CHANGE_FEED_MAX_CLIENTS"] == "0"
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+
+import pytest
+
+from backend.app import create_app
+from backend.availability import SlotConflict
+from backend.db import connect
+from backend.writes import WriteQueue
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Every statement counts as slow, so each one lands in the log.
+    return create_app({
+        "TESTING": True,
+        "DB_PATH": str(tmp_path / "hospital.db"),
+        "SLOW_QUERY_LOG": str(tmp_path / "slow_queries.log"),
+        "SLOW_QUERY_MS": 0,
+    })
+
+
+def metric(client, name, endpoint):
+    for line in client.get("/metrics").get_data(as_text=True).splitlines():
+        if line.startswith(f'{name}{{endpoint="{endpoint}"}}'):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_queued_writes_are_charged_to_their_request(app, client, seeded):
+    doctor, patient = seeded
+    response = client.post("/appointments", json={"patient_id": patient, "doctor_id": doctor,
+                                                   "appointment_date": "2030-01-07", "appointment_time": "09:00"})
+    assert response.status_code == 201
+    appointment = response.get_json()["appointment_id"]
+    assert client.put(f"/appointments/{appointment}/status", json={"status": "completed"}).status_code == 200
+
+    assert metric(client, "hospital_sql_statements_total", "appointments.create_appointment") >= 1
+    assert metric(client, "hospital_sql_statements_total", "appointments.update_appointment_status") >= 1
+
+    with open(app.config["SLOW_QUERY_LOG"]) as handle:
+        entries = [json.loads(line) for line in handle]
+    logged = {(entry["endpoint"], entry["sql"].split()[0]) for entry in entries}
+    assert ("appointments.create_appointment", "INSERT") in logged
+    assert ("appointments.update_appointment_status", "UPDATE") in logged
+
+
+def test_the_writer_stops_once_its_own_write_is_done(tmp_path):
+    write_queue = WriteQueue(str(tmp_path / "writes.db"))
+    release = threading.Event()
+    ran_by = {}
+
+    def write(name):
+        def fn(conn):
+            ran_by[name] = threading.current_thread().name
+            if name == "first":
+                release.wait(5)
+            conn.execute("CREATE TABLE IF NOT EXISTS t (name TEXT)")
+            conn.execute("INSERT INTO t VALUES (?)", (name,))
+        return fn
+
+    threads = [threading.Thread(target=write_queue.run, args=(write(name),), name=name)
+               for name in ("first", "second", "third")]
+    threads[0].start()
+    while "first" not in ran_by:
+        time.sleep(0.01)
+    for thread in threads[1:]:
+        thread.start()
+    while write_queue._queue.qsize() < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # The first writer left the writes queued behind it to their threads.
+    assert sorted(ran_by) == ["first", "second", "third"]
+    assert [name for name, thread in ran_by.items() if thread == "first"] == ["first"]
+
+
+def run_concurrently(write_queue, jobs, group):
+    """``write_queue.run`` each job from its own thread; returns ``{name: (ok, value)}``."""
+
+    outcomes = {}
+
+    def submit(name, fn):
+        try:
+            outcomes[name] = (True, write_queue.run(fn, group))
+        except Exception as error:
+            outcomes[name] = (False, error)
+
+    threads = [threading.Thread(target=submit, args=item) for item in jobs.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_a_failing_write_leaves_the_rest_of_its_group_committed(tmp_path):
+    path = str(tmp_path / "writes.db")
+    with connect(path) as conn:
+        conn.execute("CREATE TABLE t (name TEXT)")
+    # Waiting after the first write gathers all three into one transaction.
+    write_queue = WriteQueue(path, group_wait=0.5)
+
+    def insert(name):
+        return lambda conn: conn.execute("INSERT INTO t VALUES (?)", (name,)).lastrowid
+
+    def conflicting(conn):
+        conn.execute("INSERT INTO t VALUES ('conflicting')")
+        raise SlotConflict(7)
+
+    outcomes = run_concurrently(write_queue, {"a": insert("a"), "conflicting": conflicting, "b": insert("b")}, True)
+
+    assert outcomes["a"][0] and outcomes["b"][0]
+    ok, error = outcomes["conflicting"]
+    assert not ok and isinstance(error, SlotConflict) and error.appointment_id == 7
+    stats = write_queue.stats()
+    assert (stats["jobs"], stats["failed"], stats["transactions"]) == (3, 1, 1)
+    with connect(path) as conn:
+        assert sorted(row[0] for row in conn.execute("SELECT name FROM t")) == ["a", "b"]
+
+
+def test_a_write_run_alone_raises_in_its_own_request(tmp_path):
+    path = str(tmp_path / "writes.db")
+    with connect(path) as conn:
+        conn.execute("CREATE TABLE t (name TEXT)")
+    write_queue = WriteQueue(path)
+
+    def conflicting(conn):
+        conn.execute("INSERT INTO t VALUES ('conflicting')")
+        raise SlotConflict(7)
+
+    with pytest.raises(SlotConflict):
+        write_queue.run(conflicting)
+    assert write_queue.run(lambda conn: conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]) == 0